@@ -0,0 +1,156 @@
+"""
+Optional helper run on the remote, enabled by "remote_agent" in sync.json.
+
+bugl starts it with python3 over an exec channel of the ssh connection and sends it batches of queries: each
+frame is a 4 bytes big endian length followed by a json document. A batch of stat, list, read, hash, makedirs or
+manifest queries costs a single round trip, where sftp needs one or more per path. When the remote has no python
+the agent doesn't answer its hello and Sync goes on with plain sftp.
+"""
+import json
+import struct
+from base64 import b64decode
+from shlex import quote
+from threading import Lock
+
+VERSION = 1
+
+# kept free of anything newer than python 3.5, it runs on whatever the remote has
+SOURCE = r'''
+import os, sys, json, struct, hashlib, base64
+
+def send(o):
+    b = json.dumps(o).encode()
+    sys.stdout.buffer.write(struct.pack(">I", len(b)) + b)
+    sys.stdout.buffer.flush()
+
+def recv():
+    h = sys.stdin.buffer.read(4)
+    if len(h) < 4:
+        return None
+    return json.loads(sys.stdin.buffer.read(struct.unpack(">I", h)[0]).decode())
+
+def attrs(st):
+    return {"mode": st.st_mode, "size": st.st_size, "mtime": st.st_mtime}
+
+def run(q):
+    op, p = q["op"], os.path.expanduser(q.get("path", "~"))
+    if op == "stat":
+        return attrs(os.lstat(p))
+    if op == "list":
+        return [dict(attrs(e.stat(follow_symlinks=False)), name=e.name) for e in os.scandir(p)]
+    if op == "read":
+        with open(p, "rb") as f:
+            return base64.b64encode(f.read()).decode()
+    if op == "hash":
+        h = hashlib.sha256()
+        with open(p, "rb") as f:
+            for b in iter(lambda: f.read(1 << 20), b""):
+                h.update(b)
+        return h.hexdigest()
+    if op == "makedirs":
+        created, d = [], p.rstrip("/")
+        while d and not os.path.isdir(d):
+            created.insert(0, d)
+            d = os.path.dirname(d)
+        os.makedirs(p, exist_ok=True)
+        return created
+    if op == "manifest":
+        out = []
+        for r, ds, fs in os.walk(p):
+            for n in ds + fs:
+                full = os.path.join(r, n)
+                out.append(dict(attrs(os.lstat(full)), path=os.path.relpath(full, p)))
+        return out
+    if op == "home":
+        return p
+    raise ValueError("unknown op " + op)
+
+send({"version": %d})
+while True:
+    req = recv()
+    if req is None:
+        break
+    res = []
+    for q in req:
+        try:
+            res.append({"ok": run(q)})
+        except OSError as e:
+            res.append({"errno": e.errno, "error": str(e)})
+        except Exception as e:
+            res.append({"errno": 0, "error": str(e)})
+    send(res)
+''' % VERSION
+
+
+class AgentError(Exception):
+    pass
+
+
+class RemoteAgent:
+    # seconds to wait for the hello of the agent
+    TIMEOUT = 10
+
+    def __init__(self, channel):
+        self.channel = channel
+        self._in = channel.makefile_stdin("wb")
+        self._out = channel.makefile("rb")
+        self._lock = Lock()
+
+    @classmethod
+    def start(cls, ssh, timeout=TIMEOUT):
+        """
+        Starts the agent on the remote of ssh, returns None if it can't run there.
+        """
+        channel = ssh.get_transport().open_session()
+        channel.settimeout(timeout)
+        channel.exec_command(f"python3 -u -c {quote(SOURCE)}")
+        agent = cls(channel)
+        try:
+            hello = agent._recv()
+        except (OSError, EOFError, AgentError, ValueError):
+            hello = None
+        if not hello or hello.get("version") != VERSION:
+            channel.close()
+            return None
+        channel.settimeout(None)
+        return agent
+
+    def _send(self, o):
+        b = json.dumps(o).encode()
+        self._in.write(struct.pack(">I", len(b)) + b)
+        self._in.flush()
+
+    def _read(self, n):
+        b = b""
+        while len(b) < n:
+            chunk = self._out.read(n - len(b))
+            if not chunk:
+                raise AgentError("the agent exited")
+            b += chunk
+        return b
+
+    def _recv(self):
+        return json.loads(self._read(struct.unpack(">I", self._read(4))[0]).decode())
+
+    def query(self, *queries):
+        """
+        Runs the queries, dicts with "op" and "path", in a single round trip. Returns their results, the failed
+        ones as the OSError sftp would have raised, FileNotFoundError and so on.
+        """
+        with self._lock:
+            self._send(list(queries))
+            res = self._recv()
+        return [_r["ok"] if "ok" in _r else OSError(_r["errno"], _r["error"]) for _r in res]
+
+    def one(self, op, path_=None):
+        res = self.query({"op": op, "path": path_} if path_ is not None else {"op": op})[0]
+        if isinstance(res, OSError):
+            raise res
+        return res
+
+    @staticmethod
+    def content(res):
+        return b64decode(res)
+
+    def close(self):
+        self.channel.close()
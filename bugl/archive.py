@@ -0,0 +1,228 @@
+"""
+Archival of the data of the games not played for "archive_after_days" days.
+
+Two modes, "archive_mode" in config.json:
+  "pack": every data root becomes a gzip tarball under .sync/archives/<game id>/, the root is removed once the
+          archive is written and verified. Restored locally.
+  "drop": the root is removed only if a dry run shows that remote has all of it. Restored by a pull.
+The archived roots are listed in .sync/archives/state.json along with their size, so that the restore time can be
+estimated before it starts. The state is kept out of the synced configs: what's archived is a matter of this host.
+"""
+import os
+import json
+import shutil
+import tarfile
+from time import time, monotonic
+from threading import Lock, Thread
+
+PACK = "pack"
+DROP = "drop"
+
+
+def tree_size(path_):
+    if os.path.isfile(path_) or os.path.islink(path_):
+        return os.lstat(path_).st_size
+    out = 0
+    for _r, _, _fs in os.walk(path_):
+        for _f in _fs:
+            try:
+                out += os.lstat(os.path.join(_r, _f)).st_size
+            except OSError:
+                continue
+    return out
+
+
+class Archiver:
+    # bytes per second assumed before anything was measured: unpacking from a local disk, pulling from remote
+    UNPACK_RATE = 100 * 1024 * 1024
+    PULL_RATE = 5 * 1024 * 1024
+    # seconds a measured disk usage is shown for before being measured again
+    USAGE_TTL = 300
+
+    def __init__(self, conf, root=".sync/archives/"):
+        self.conf = conf
+        self.root = root
+        self.state_path = os.path.join(root, "state.json")
+        self._lock = Lock()
+        # game id -> Lock, held while its data is packed, dropped or restored
+        self._games = {}
+        # game id -> (time, {uniq: bytes}), measured in background
+        self._usage = {}
+        self._measuring = set()
+        try:
+            with open(self.state_path) as f:
+                self.state = json.load(f)
+        except (FileNotFoundError, json.decoder.JSONDecodeError):
+            self.state = {}
+        self.state.setdefault("games", {})
+        # measured by the last unpack, 0 until then
+        self.state.setdefault("unpack_rate", 0)
+
+    def _save(self):
+        os.makedirs(self.root, exist_ok=True)
+        with open(self.state_path + ".tmp", "w") as f:
+            json.dump(self.state, f)
+        os.replace(self.state_path + ".tmp", self.state_path)
+
+    def lock(self, g):
+        with self._lock:
+            return self._games.setdefault(g.conf.get("id"), Lock())
+
+    def archived(self, g):
+        return dict(self.state["games"].get(g.conf.get("id"), {}))
+
+    def packed(self, g):
+        return [_u for _u, _r in self.archived(g).items() if _r["mode"] == PACK]
+
+    def dropped(self, g):
+        return [_u for _u, _r in self.archived(g).items() if _r["mode"] == DROP]
+
+    def cold(self, g):
+        days = self.conf.get("archive_after_days")
+        l_l = g.conf.get("latest_launch")
+        if not days or l_l == -1 or time() - l_l < days * 24 * 60 * 60 or g.is_alive():
+            return False
+        return any(os.path.exists(os.path.expanduser(_l)) and _u not in self.archived(g)
+                   for _u, _l in g.conf.get("data").items())
+
+    def _record(self, g, uniq, rec):
+        with self._lock:
+            self.state["games"].setdefault(g.conf.get("id"), {})[uniq] = rec
+            self._save()
+        self._usage.pop(g.conf.get("id"), None)
+
+    def forget(self, g, uniq):
+        with self._lock:
+            recs = self.state["games"].get(g.conf.get("id"), {})
+            rec = recs.pop(uniq, None)
+            if not recs:
+                self.state["games"].pop(g.conf.get("id"), None)
+            self._save()
+        self._usage.pop(g.conf.get("id"), None)
+        return rec
+
+    def pack(self, g, uniq, loc):
+        """
+        Moves the data root loc into a compressed archive, returns False if it's left in place.
+        """
+        with self.lock(g):
+            loc = os.path.expanduser(loc).rstrip("/")
+            # the game may have been launched since it was found cold
+            if g.is_alive() or not os.path.exists(loc) or uniq in self.archived(g):
+                return False
+            return self._pack(g, uniq, loc)
+
+    def _pack(self, g, uniq, loc):
+        folder = os.path.join(self.root, g.conf.get("id"))
+        os.makedirs(folder, exist_ok=True)
+        path_ = os.path.join(folder, f"{uniq}.tar.gz")
+        size = tree_size(loc)
+        try:
+            with tarfile.open(path_ + ".tmp", "w:gz", compresslevel=6) as tar:
+                tar.add(loc, arcname=os.path.basename(loc))
+            # the data goes away only once the archive reads back whole
+            with tarfile.open(path_ + ".tmp", "r:gz") as tar:
+                members = len(tar.getmembers())
+        except (OSError, tarfile.TarError):
+            os.remove(path_ + ".tmp")
+            raise
+        if members == 0:
+            os.remove(path_ + ".tmp")
+            return False
+        os.replace(path_ + ".tmp", path_)
+        self._remove(loc)
+        self._record(g, uniq, {"mode": PACK, "archive": path_, "bytes": size, "packed": os.path.getsize(path_),
+                               "time": time()})
+        return True
+
+    def drop(self, g, uniq, loc):
+        # the caller checked that remote has all of loc
+        with self.lock(g):
+            loc = os.path.expanduser(loc).rstrip("/")
+            if g.is_alive() or not os.path.exists(loc) or uniq in self.archived(g):
+                return False
+            size = tree_size(loc)
+            self._remove(loc)
+            self._record(g, uniq, {"mode": DROP, "bytes": size, "time": time()})
+            return True
+
+    @staticmethod
+    def _remove(loc):
+        if os.path.isdir(loc) and not os.path.islink(loc):
+            shutil.rmtree(loc)
+        else:
+            os.remove(loc)
+
+    def unpack(self, g, uniq, loc):
+        """
+        Restores a packed data root, returns False if it's not packed. Restoring twice is harmless: the second one
+        waits for the first and finds nothing left to do.
+        """
+        with self.lock(g):
+            rec = self.archived(g).get(uniq)
+            if not rec or rec["mode"] != PACK:
+                return False
+            loc = os.path.expanduser(loc).rstrip("/")
+            start = monotonic()
+            # unpacked aside, the root appears whole or not at all
+            tmp = f"{loc}.unpack"
+            shutil.rmtree(tmp, ignore_errors=True)
+            with tarfile.open(rec["archive"], "r:gz") as tar:
+                # the archive is ours, links and modes come back as they were
+                tar.extractall(tmp, **({"filter": "tar"} if hasattr(tarfile, "tar_filter") else {}))
+            os.replace(os.path.join(tmp, os.path.basename(loc)), loc)
+            shutil.rmtree(tmp, ignore_errors=True)
+            elapsed = monotonic() - start
+            if elapsed > 0:
+                self.state["unpack_rate"] = rec["bytes"] / elapsed
+            os.remove(rec["archive"])
+            self.forget(g, uniq)
+            return True
+
+    def restore_time(self, g):
+        """
+        Estimated seconds to bring back the archived roots of g.
+        """
+        unpack_rate = self.state["unpack_rate"] or self.UNPACK_RATE
+        out = 0
+        for _u, _r in self.archived(g).items():
+            if _r["mode"] == PACK:
+                out += _r["bytes"] / unpack_rate
+            else:
+                # the best throughput the compression history saw for this root, if any
+                try:
+                    modes = g.conf.get("compression").get(_u, {}).get("modes", {})
+                except KeyError:
+                    modes = {}
+                out += _r["bytes"] / max(modes.values(), default=self.PULL_RATE)
+        return out
+
+    def usage(self, g):
+        """
+        Bytes on disk of every data root of g, None while being measured.
+        """
+        id_ = g.conf.get("id")
+        cached = self._usage.get(id_)
+        if cached is None or time() - cached[0] > self.USAGE_TTL:
+            self.measure(g)
+        return cached[1] if cached else None
+
+    def measuring(self):
+        return bool(self._measuring)
+
+    def measure(self, g):
+        id_ = g.conf.get("id")
+        if id_ in self._measuring:
+            return
+
+        def _measure():
+            out = {}
+            for _u, _l in g.conf.get("data").items():
+                _l = os.path.expanduser(_l)
+                if os.path.exists(_l):
+                    out[_u] = tree_size(_l)
+            self._usage[id_] = (time(), out)
+            self._measuring.discard(id_)
+
+        self._measuring.add(id_)
+        Thread(target=_measure, daemon=True).start()
@@ -0,0 +1,344 @@
+#!/usr/bin/env python
+"""
+Sync benchmark against an in-process SSH/SFTP stand-in.
+
+A paramiko server bound to localhost serves a temporary "remote home" over SFTP and runs exec requests (mkdir -p,
+rsync --server) as local processes, with configurable per-request latency and bandwidth limits. A synthetic
+library is generated under a temporary HOME and the main sync paths are timed, results are printed as json.
+"""
+import os
+import sys
+import json
+import socket
+import shutil
+from argparse import ArgumentParser
+from subprocess import Popen, PIPE
+from tempfile import mkdtemp
+from threading import Thread
+from time import sleep
+from paramiko import (Transport, ServerInterface, RSAKey, SFTPServer, SFTPServerInterface, SFTPHandle,
+                      SFTPAttributes, AUTH_SUCCESSFUL, OPEN_SUCCEEDED, SFTP_OK)
+from benchlib import gen_library, gen_sync_conf, timed
+
+
+class Link:
+    """
+    Simulated link: every request pays latency seconds and every chunk is throttled to bandwidth bytes/s.
+    """
+    def __init__(self, latency=0.0, bandwidth=0):
+        self.latency = latency
+        self.bandwidth = bandwidth
+
+    def request(self):
+        if self.latency:
+            sleep(self.latency)
+
+    def transfer(self, n):
+        if self.bandwidth and n:
+            sleep(n / self.bandwidth)
+
+
+class StubSFTPHandle(SFTPHandle):
+    link = Link()
+
+    def stat(self):
+        try:
+            return SFTPAttributes.from_stat(os.fstat(self.readfile.fileno()))
+        except OSError as e:
+            return SFTPServer.convert_errno(e.errno)
+
+    def chattr(self, attr):
+        try:
+            SFTPServer.set_file_attr(self.filename, attr)
+            return SFTP_OK
+        except OSError as e:
+            return SFTPServer.convert_errno(e.errno)
+
+    def read(self, offset, length):
+        self.link.request()
+        data = super().read(offset, length)
+        if isinstance(data, bytes):
+            self.link.transfer(len(data))
+        return data
+
+    def write(self, offset, data):
+        self.link.request()
+        self.link.transfer(len(data))
+        return super().write(offset, data)
+
+
+class StubSFTPServer(SFTPServerInterface):
+    # set by StandIn before the server starts
+    home = "/"
+    link = Link()
+
+    def canonicalize(self, path):
+        if not os.path.isabs(path):
+            path = os.path.join(self.home, path)
+        return os.path.normpath(path)
+
+    def _call(self, f, *args):
+        self.link.request()
+        try:
+            return f(*args)
+        except OSError as e:
+            return SFTPServer.convert_errno(e.errno)
+
+    def list_folder(self, path):
+        def _list(p):
+            out = []
+            for name in os.listdir(p):
+                attr = SFTPAttributes.from_stat(os.lstat(os.path.join(p, name)))
+                attr.filename = name
+                out.append(attr)
+            return out
+        return self._call(_list, self.canonicalize(path))
+
+    def stat(self, path):
+        return self._call(lambda p: SFTPAttributes.from_stat(os.stat(p)), self.canonicalize(path))
+
+    def lstat(self, path):
+        return self._call(lambda p: SFTPAttributes.from_stat(os.lstat(p)), self.canonicalize(path))
+
+    def open(self, path, flags, attr):
+        def _open(p):
+            fd = os.open(p, flags, getattr(attr, "st_mode", None) or 0o666)
+            if flags & os.O_WRONLY:
+                mode = "ab" if flags & os.O_APPEND else "wb"
+            elif flags & os.O_RDWR:
+                mode = "a+b" if flags & os.O_APPEND else "r+b"
+            else:
+                mode = "rb"
+            handle = StubSFTPHandle(flags)
+            handle.link = self.link
+            handle.filename = p
+            handle.readfile = handle.writefile = os.fdopen(fd, mode)
+            return handle
+        return self._call(_open, self.canonicalize(path))
+
+    def remove(self, path):
+        return self._call(lambda p: os.remove(p) or SFTP_OK, self.canonicalize(path))
+
+    def rename(self, old, new):
+        return self._call(lambda o, n: os.rename(o, n) or SFTP_OK, self.canonicalize(old), self.canonicalize(new))
+
+    def posix_rename(self, old, new):
+        return self._call(lambda o, n: os.replace(o, n) or SFTP_OK, self.canonicalize(old), self.canonicalize(new))
+
+    def mkdir(self, path, attr):
+        return self._call(lambda p: os.mkdir(p) or SFTP_OK, self.canonicalize(path))
+
+    def rmdir(self, path):
+        return self._call(lambda p: os.rmdir(p) or SFTP_OK, self.canonicalize(path))
+
+    def chattr(self, path, attr):
+        return self._call(lambda p: SFTPServer.set_file_attr(p, attr) or SFTP_OK, self.canonicalize(path))
+
+    def symlink(self, target, path):
+        return self._call(lambda t, p: os.symlink(t, p) or SFTP_OK, target, self.canonicalize(path))
+
+    def readlink(self, path):
+        return self._call(os.readlink, self.canonicalize(path))
+
+
+class StubServer(ServerInterface):
+    def __init__(self, stand_in):
+        self.stand_in = stand_in
+
+    def get_allowed_auths(self, username):
+        return "password,publickey"
+
+    def check_auth_password(self, username, password):
+        return AUTH_SUCCESSFUL
+
+    def check_auth_publickey(self, username, key):
+        return AUTH_SUCCESSFUL
+
+    def check_channel_request(self, kind, chanid):
+        return OPEN_SUCCEEDED
+
+    def check_channel_exec_request(self, channel, command):
+        Thread(target=self.stand_in.execute, args=(channel, command.decode()), daemon=True).start()
+        return True
+
+
+class StandIn:
+    """
+    Local SSH/SFTP server, serving home as the remote user's home directory.
+    """
+    def __init__(self, home, latency=0.0, bandwidth=0):
+        self.home = home
+        self.link = Link(latency, bandwidth)
+        self.host_key = RSAKey.generate(2048)
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.sock.bind(("127.0.0.1", 0))
+        self.port = self.sock.getsockname()[1]
+        self.transports = []
+        StubSFTPServer.home = home
+        StubSFTPServer.link = self.link
+
+    def start(self):
+        self.sock.listen(8)
+        Thread(target=self._accept, daemon=True).start()
+
+    def _accept(self):
+        while True:
+            try:
+                conn, _ = self.sock.accept()
+            except OSError:
+                return
+            t = Transport(conn)
+            t.add_server_key(self.host_key)
+            t.set_subsystem_handler("sftp", SFTPServer, StubSFTPServer)
+            t.start_server(server=StubServer(self))
+            self.transports.append(t)
+
+    def execute(self, channel, command):
+        self.link.request()
+        proc = Popen(command, shell=True, cwd=self.home, env={**os.environ, "HOME": self.home},
+                     stdin=PIPE, stdout=PIPE, stderr=PIPE)
+
+        def pump_in():
+            while (data := channel.recv(32768)) != b"":
+                self.link.transfer(len(data))
+                proc.stdin.write(data)
+                proc.stdin.flush()
+            proc.stdin.close()
+
+        def pump_err():
+            while (data := proc.stderr.read1(32768)) != b"":
+                channel.sendall_stderr(data)
+
+        Thread(target=pump_in, daemon=True).start()
+        err = Thread(target=pump_err, daemon=True)
+        err.start()
+        while (data := proc.stdout.read1(32768)) != b"":
+            self.link.transfer(len(data))
+            channel.sendall(data)
+        err.join()
+        channel.send_exit_status(proc.wait())
+        channel.close()
+
+    def stop(self):
+        self.sock.close()
+        for t in self.transports:
+            t.close()
+
+
+def run(args):
+    from sync import Rsync
+    from cli import HeadlessBugl
+    from bugl import prepare
+
+    tmp = mkdtemp(prefix="bugl-bench-")
+    home, remote_home = os.path.join(tmp, "home"), os.path.join(tmp, "remote")
+    conf_dir, data_dir = os.path.join(home, ".config", "bugl"), os.path.join(home, "saves")
+    os.makedirs(remote_home)
+    key_path = os.path.join(tmp, "id_rsa")
+    RSAKey.generate(2048).write_private_key_file(key_path)
+
+    stand_in = StandIn(remote_home, args.latency / 1000, args.bandwidth * 1024)
+    stand_in.start()
+    gen_library(conf_dir, data_dir, args.games, args.files, args.depth, args.size)
+    gen_sync_conf(conf_dir, stand_in.port, key_path)
+
+    class BenchRsync(Rsync):
+        def command_gen(self, dry=False):
+            cmd = super().command_gen(dry)
+            cmd[cmd.index("-e") + 1] += f" -i {key_path} -o StrictHostKeyChecking=no " \
+                                        f"-o UserKnownHostsFile=/dev/null -o LogLevel=ERROR"
+            return cmd
+
+    class BenchBugl(HeadlessBugl):
+        def gen_rsync(self, scr, sync=None):
+            sync = sync or self.sync
+            sync.prepare_path(sync.conf.get("remote_data_path"))
+            return BenchRsync(sync)
+
+    old_home, old_cwd = os.environ.get("HOME"), os.getcwd()
+    os.environ["HOME"] = home
+    results = {}
+    try:
+        _b, _ = prepare()
+        bugl = BenchBugl.from_bugl(_b, HeadlessBugl.LOCAL, args.jobs)
+
+        timed(results, "connect", bugl.connect)
+
+        def sync_all():
+            bugl._sync_all()
+            bugl.wait()
+        timed(results, "sync_all_initial", sync_all)
+        timed(results, "sync_all_noop", sync_all, args.repeat)
+
+        def check(full):
+            def f():
+                if full:
+                    bugl.feed.seen(-1)
+                bugl.check_for_sync(None, HeadlessBugl.NullProgress())
+            return f
+        timed(results, "check_for_sync_full", check(True), args.repeat)
+        timed(results, "check_for_sync_feed", check(False), args.repeat)
+
+        if shutil.which("ssh") and shutil.which("rsync"):
+            def data(operation):
+                def f():
+                    for _g in bugl._games:
+                        bugl.sync_data(_g, None, operation)
+                    bugl.wait()
+                return f
+            timed(results, "sync_data_push", data(Rsync.PUSH))
+            timed(results, "sync_data_push_noop", data(Rsync.PUSH), args.repeat)
+            timed(results, "sync_data_pull_noop", data(Rsync.PULL), args.repeat)
+        else:
+            results["sync_data"] = "skipped: ssh or rsync not available"
+
+        bugl.sync.upload(os.path.join(conf_dir, "games", "game00000.json"), "checksum.json")
+        timed(results, "r_checksum", lambda: bugl.sync.r_checksum("checksum.json"), args.repeat)
+
+        def download_a():
+            dest = os.path.join(tmp, "download")
+            shutil.rmtree(dest, ignore_errors=True)
+            bugl.sync.download_a("games", dest)
+        timed(results, "download_a", download_a, args.repeat)
+        errors = [m for m in bugl.report if m["title"] in ("Job Error", "Rsync Error")]
+    finally:
+        os.chdir(old_cwd)
+        if old_home is not None:
+            os.environ["HOME"] = old_home
+        stand_in.stop()
+        if not args.keep:
+            shutil.rmtree(tmp, ignore_errors=True)
+
+    return {
+        "benchmark": "sync",
+        "params": vars(args),
+        "results": results,
+        "errors": errors
+    }
+
+
+def main(argv=None):
+    arg_p = ArgumentParser("bench_sync")
+    arg_p.add_argument("--games", type=int, default=50)
+    arg_p.add_argument("--files", type=int, default=20, help="files per data root")
+    arg_p.add_argument("--depth", type=int, default=2, help="folder depth of data roots")
+    arg_p.add_argument("--size", type=int, default=16384, help="bytes per file")
+    arg_p.add_argument("--latency", type=float, default=0.0, help="ms added to every request")
+    arg_p.add_argument("--bandwidth", type=int, default=0, help="KiB/s, 0 for unlimited")
+    arg_p.add_argument("--jobs", type=int, default=1)
+    arg_p.add_argument("--repeat", type=int, default=3)
+    arg_p.add_argument("--keep", action="store_true", help="keep the temporary directory")
+    arg_p.add_argument("-o", "--output", default=None, help="write results here instead of stdout")
+    args = arg_p.parse_args(argv)
+    out = run(args)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(out, f, indent=2)
+    else:
+        json.dump(out, sys.stdout, indent=2)
+        print()
+
+
+if __name__ == "__main__":
+    main()
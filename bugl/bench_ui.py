@@ -0,0 +1,191 @@
+#!/usr/bin/env python
+"""
+Startup and UI render benchmark.
+
+For every library size a synthetic library is generated under a temporary HOME, prepare() is timed phase by phase
+and the Bugl.gui loop is driven headlessly against a null curses screen, recording frame times, addstr calls and
+bytes emitted per frame. Results are printed as json.
+"""
+import os
+import sys
+import json
+import shutil
+import curses
+from argparse import ArgumentParser
+from contextlib import contextmanager
+from statistics import median
+from tempfile import mkdtemp
+from time import perf_counter
+from benchlib import gen_library, gen_bugl_conf
+from tracing import PhaseTimer
+
+
+class NullWindow:
+    """
+    Stand-in for a curses window or pad: draws nothing, counts what would have been drawn.
+    """
+    def __init__(self, screen, rows, cols):
+        self.screen = screen
+        self.rows = rows
+        self.cols = cols
+
+    def getmaxyx(self):
+        return self.rows, self.cols
+
+    def addstr(self, y, x, s, attr=0):
+        self.screen.calls += 1
+        self.screen.bytes += len(s.encode())
+
+    def timeout(self, *args):
+        pass
+
+    def getch(self):
+        return self.screen.getch()
+
+    def refresh(self, *args):
+        self.screen.refreshes += 1
+
+    def erase(self):
+        pass
+
+    def vline(self, *args):
+        self.screen.calls += 1
+
+    def resize(self, rows, cols):
+        self.rows, self.cols = rows, cols
+
+    def border(self, *args):
+        self.screen.calls += 1
+
+    def untouchwin(self):
+        pass
+
+
+class NullScreen(NullWindow):
+    """
+    Root window, feeds the scripted keys and closes a frame every time input is requested.
+    """
+    def __init__(self, rows, cols, keys):
+        self.keys = list(keys)
+        self.calls = self.bytes = self.refreshes = 0
+        self.frames = []
+        self._start = None
+        super().__init__(self, rows, cols)
+
+    def getch(self):
+        now = perf_counter()
+        if self._start is not None:
+            self.frames.append({"time": now - self._start, "addstr": self.calls, "bytes": self.bytes,
+                                "refresh": self.refreshes})
+        self.calls = self.bytes = self.refreshes = 0
+        key = self.keys.pop(0) if self.keys else ord("q")
+        self._start = perf_counter()
+        return key
+
+    def newwin(self, rows, cols, *args):
+        return NullWindow(self, rows, cols)
+
+
+@contextmanager
+def patched_curses(screen):
+    saved = {k: getattr(curses, k, None) for k in ("newwin", "newpad", "curs_set", "ACS_VLINE")}
+    curses.newwin = screen.newwin
+    curses.newpad = screen.newwin
+    curses.curs_set = lambda *args: None
+    if saved["ACS_VLINE"] is None:
+        # only defined once initscr() ran
+        curses.ACS_VLINE = ord("|")
+    try:
+        yield
+    finally:
+        for k, v in saved.items():
+            if v is not None:
+                setattr(curses, k, v)
+
+
+def summary(values):
+    values = sorted(values)
+    if not values:
+        return {}
+    return {"median": median(values), "p95": values[int(len(values) * .95) - 1 if len(values) > 1 else 0],
+            "max": values[-1], "mean": sum(values) / len(values)}
+
+
+def bench_size(games, args):
+    import bugl as bugl_mod
+    from sww import SafeWinWrapper
+
+    tmp = mkdtemp(prefix="bugl-bench-ui-")
+    home = os.path.join(tmp, "home")
+    conf_dir = os.path.join(home, ".config", "bugl")
+    gen_bugl_conf(conf_dir, ignore_missing_host=True)
+    gen_library(conf_dir, os.path.join(home, "saves"), games)
+
+    old_home, old_cwd = os.environ.get("HOME"), os.getcwd()
+    os.environ["HOME"] = home
+    timer = PhaseTimer()
+    bugl_mod.phase_timer = timer
+    try:
+        start = perf_counter()
+        _b, errs = bugl_mod.prepare()
+        total = perf_counter() - start
+        bugl_mod.phase_timer = None
+
+        # browse the list, then quit: confirm, and refuse to sync before exiting
+        keys = [curses.KEY_DOWN] * args.frames + [ord("q"), ord("\n"), ord("\n")]
+        screen = NullScreen(args.rows, args.cols, keys)
+        with patched_curses(screen):
+            start = perf_counter()
+            _b.gui(SafeWinWrapper(screen), errs, type("Args", (), {"skip_check": True, "poll": True})())
+            gui_total = perf_counter() - start
+    finally:
+        bugl_mod.phase_timer = None
+        os.chdir(old_cwd)
+        if old_home is not None:
+            os.environ["HOME"] = old_home
+        if not args.keep:
+            shutil.rmtree(tmp, ignore_errors=True)
+
+    frames = screen.frames[1:args.frames + 1]
+    return {
+        "games": games,
+        "prepare": {
+            "total": total,
+            "phases": {k: {"total": v, "count": timer.counts[k]} for k, v in timer.totals.items()}
+        },
+        "gui": {
+            "total": gui_total,
+            "frames": len(frames),
+            "frame_time": summary([f["time"] for f in frames]),
+            "addstr_per_frame": summary([f["addstr"] for f in frames]),
+            "bytes_per_frame": summary([f["bytes"] for f in frames]),
+            "refresh_per_frame": summary([f["refresh"] for f in frames])
+        }
+    }
+
+
+def main(argv=None):
+    arg_p = ArgumentParser("bench_ui")
+    arg_p.add_argument("--sizes", type=int, nargs="+", default=[10, 100, 1000, 10000],
+                       help="library sizes, in game configs")
+    arg_p.add_argument("--frames", type=int, default=200, help="frames rendered per size")
+    arg_p.add_argument("--rows", type=int, default=50)
+    arg_p.add_argument("--cols", type=int, default=160)
+    arg_p.add_argument("--keep", action="store_true", help="keep the temporary directories")
+    arg_p.add_argument("-o", "--output", default=None, help="write results here instead of stdout")
+    args = arg_p.parse_args(argv)
+    out = {
+        "benchmark": "ui",
+        "params": vars(args),
+        "results": [bench_size(n, args) for n in args.sizes]
+    }
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(out, f, indent=2)
+    else:
+        json.dump(out, sys.stdout, indent=2)
+        print()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,71 @@
+"""
+Helpers shared by the benchmarks: synthetic library generation and timing.
+"""
+import os
+import random
+from statistics import median
+from time import perf_counter
+from TopongoConfigs.configs import Configs
+
+
+def gen_library(conf_dir, data_dir, games, files=0, depth=0, size=0, seed=0):
+    """
+    Writes games configs under conf_dir/games/ and for each game one data root under data_dir, made of files
+    spread over depth nested folders, half text and half random bytes.
+    """
+    from templates import game_defaults
+
+    rnd = random.Random(seed)
+    os.makedirs(os.path.join(conf_dir, "games"), exist_ok=True)
+    for n in range(games):
+        root = os.path.join(data_dir, f"game{n:05d}")
+        for f in range(files):
+            folder = os.path.join(root, *[f"d{(f + _d) % 4}" for _d in range(depth)])
+            os.makedirs(folder, exist_ok=True)
+            with open(os.path.join(folder, f"save{f:04d}.{'txt' if f % 2 else 'bin'}"), "wb") as _f:
+                if f % 2:
+                    _f.write((f"slot {f} level {rnd.randint(0, 99)} " * (size // 16 + 1)).encode()[:size])
+                else:
+                    _f.write(rnd.randbytes(size))
+        conf = Configs(game_defaults, data={
+            **game_defaults,
+            "id": f"game{n:05d}",
+            "name": f"Game {n}",
+            "exec": "true",
+            "data": {f"{n:08d}-0000-4000-8000-000000000000": root + "/"} if files else {}
+        }, config_path=os.path.join(conf_dir, "games", f"game{n:05d}.json"))
+        conf.write()
+
+
+def gen_bugl_conf(conf_dir, **overrides):
+    from templates import bugl_defaults
+
+    os.makedirs(conf_dir, exist_ok=True)
+    conf = Configs(bugl_defaults, data={**bugl_defaults, **overrides},
+                   config_path=os.path.join(conf_dir, "config.json"))
+    conf.write()
+
+
+def gen_sync_conf(conf_dir, port, key_path):
+    from templates import sync_defaults
+
+    conf = Configs(sync_defaults, data={
+        **sync_defaults,
+        "user": os.environ.get("USER", "bench"),
+        "host": "127.0.0.1",
+        "port": port,
+        "private_key_path": key_path,
+        "mode": 1,
+        "remote_path": "~/.config/bugl/",
+        "remote_data_path": "~/data/"
+    }, config_path=os.path.join(conf_dir, "sync.json"))
+    conf.write()
+
+
+def timed(results, name, f, repeat=1):
+    times = []
+    for _ in range(repeat):
+        start = perf_counter()
+        f()
+        times.append(perf_counter() - start)
+    results[name] = {"median": median(times), "min": min(times), "runs": times}
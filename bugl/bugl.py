@@ -1,15 +1,32 @@
 #!/usr/bin/env python
+from time import perf_counter
+_import_start = perf_counter()
 import curses
 import subprocess
 import os
+import socket
 from datetime import datetime, timedelta
 from TopongoConfigs.configs import Configs
 from sww import SafeWinWrapper
-from sync import Sync, RConfigs, Rsync, Job, REMOTE, LOCAL
+from sync_base import Job, PULL, PUSH
+from tracing import span
+import tracing
+from merge import MergeBase, three_way, conf_dict, apply_choice
+from qos import QoS
 from uuid import uuid4
+from time import sleep, monotonic
 from itertools import chain
-from threading import Thread
+from threading import Thread, Lock, current_thread
 from collections import deque
+_import_time = perf_counter() - _import_start
+
+
+# optional phase timer, a callable returning a context manager for the given phase name, see bench_ui.py
+phase_timer = None
+
+
+def phase(name):
+    return phase_timer(name) if phase_timer else span(name)
 
 
 def prepare_path(_f, _c_f=False, _folder=False):
@@ -41,6 +58,14 @@ def time_elapsed(_d: timedelta, none_word="Now", form="{}"):
     return form.format(out)
 
 
+def size_fmt(_b):
+    for _u in ("B", "KiB", "MiB", "GiB"):
+        if _b < 1024:
+            return f"{_b:.1f}{_u}" if _u != "B" else f"{_b}B"
+        _b /= 1024
+    return f"{_b:.1f}TiB"
+
+
 class Game:
     class PollBeforeStartException(Exception):
         pass
@@ -54,38 +79,46 @@ class Game:
         self.args = None
         self.rsync = None
         self.syncing = False
-        prepare_path(self.conf.get("stdout"))
-        prepare_path(self.conf.get("stderr"))
+        with phase("prepare_path"):
+            prepare_path(self.conf.get("stdout"))
+            prepare_path(self.conf.get("stderr"))
         # if some of its datapaths contains a numeric or empty key assign an uuid to the datapath
-        deltas = {}
-        for k, i in self.conf.get("data").items():
-            try:
-                int(k)
-            except ValueError:
-                if k != "":
-                    continue
-            deltas[k] = str(uuid4())
-        if deltas:
-            tmp = self.conf.get("data")
-            for old, new in deltas.items():
-                tmp[new] = tmp.pop(old)
-            self.conf.set("data", tmp)
+        with phase("uuid_migration"):
+            deltas = {}
+            for k, i in self.conf.get("data").items():
+                try:
+                    int(k)
+                except ValueError:
+                    if k != "":
+                        continue
+                deltas[k] = str(uuid4())
+            if deltas:
+                tmp = self.conf.get("data")
+                for old, new in deltas.items():
+                    tmp[new] = tmp.pop(old)
+                self.conf.set("data", tmp)
 
     def run(self):
-        self.args = [self.conf.get("exec"), self.conf.get("exec_path", path=True)] + self.conf.get("exec_args")
-        self.conf.set("latest_launch", datetime.now().timestamp())
-        self.conf.game_conf.write()
-        self._session_started = True
-        for _i in ("stdout", "stderr"):
-            prepare_path(self.conf.get(_i))
-        if self.conf.get("exec_in_path"):
-            cwd = {"cwd": os.path.dirname(self.conf.get("exec_path", path=True))}
-        else:
-            cwd = {}
-        self._proc = subprocess.Popen(self.args,
-                                      stdout=open(self.conf.get("stdout", path=True), "w+"),
-                                      stderr=open(self.conf.get("stderr", path=True), "w+"),
-                                      stdin=subprocess.DEVNULL, **cwd)
+        with span("Game.run", game=self.conf.get("id")):
+            self.args = [self.conf.get("exec"), self.conf.get("exec_path", path=True)] + self.conf.get("exec_args")
+            self.conf.set("latest_launch", datetime.now().timestamp())
+            self.conf.game_conf.write()
+            self._session_started = True
+            for _i in ("stdout", "stderr"):
+                prepare_path(self.conf.get(_i))
+            if self.conf.get("exec_in_path"):
+                cwd = {"cwd": os.path.dirname(self.conf.get("exec_path", path=True))}
+            else:
+                cwd = {}
+            env = self.bugl.wine.env(self)
+            warm = self.bugl.wine.warm_for(self)
+            start = monotonic()
+            self._proc = subprocess.Popen(self.args,
+                                          stdout=open(self.conf.get("stdout", path=True), "w+"),
+                                          stderr=open(self.conf.get("stderr", path=True), "w+"),
+                                          stdin=subprocess.DEVNULL, env=env, **cwd)
+            from wine import LaunchTimer
+            LaunchTimer(self, start, warm).start()
 
     def name(self):
         return self.conf.get("name") + (" (Running)" if self.is_alive() else "")
@@ -107,6 +140,7 @@ class Game:
             if not self.is_alive():
                 self._session_started = False
                 self._init_playtime = self.conf.get("playtime")
+                self.bugl.sessions.record(self.conf.get("id"), self.conf.get("latest_launch"), t_e.total_seconds())
                 # if process exited with a non-zero code return true
                 if self.poll() != 0:
                     return True
@@ -164,6 +198,34 @@ class Game:
             _l_l_o += time_elapsed(datetime.now() - datetime.fromtimestamp(_l_l), "(Now)", "({})")
         yield "Last Played", _l_l_o
         yield "Time Played", time_elapsed(timedelta(seconds=self.conf.get("playtime")), "0 secs")
+        log = self.bugl.sessions.log(self.conf.get("id"))
+        if len(log):
+            yield "Sessions", str(len(log))
+            from sessions import week_key
+            yield "This Week", time_elapsed(timedelta(seconds=log.by("week").get(week_key(datetime.now()), 0)),
+                                            "0 secs")
+            yield "Last 30 Days", time_elapsed(
+                timedelta(seconds=log.total(since=(datetime.now() - timedelta(days=30)).timestamp())), "0 secs")
+        try:
+            launch = self.conf.get("launch_times").get(socket.gethostname(), {})
+        except KeyError:
+            launch = {}
+        if "last" in launch:
+            out = f"{launch['last']:.2f}s"
+            for _k in ("warm", "cold"):
+                if _k in launch:
+                    out += f", {_k} avg {launch[_k][1]:.2f}s"
+            yield "Launch Time", out
+        if self.conf.get("data"):
+            archived = self.bugl.archiver.archived(self)
+            usage = self.bugl.archiver.usage(self)
+            out = "Measuring..." if usage is None else size_fmt(sum(usage.values()))
+            if packed := sum(_r["packed"] for _r in archived.values() if "packed" in _r):
+                out += f", {size_fmt(packed)} packed"
+            yield "Disk Usage", out
+            if archived:
+                size = size_fmt(sum(_r["bytes"] for _r in archived.values()))
+                yield "Archived", f"{len(archived)} data root(s), {size}, restored {self.bugl.restore_estimate(self)}"
 
     def sync_data(self):
         if not self.rsync.running:
@@ -177,44 +239,96 @@ class Game:
 
 
 class JobRunner:
-    def __init__(self, *jobs: Job):
+    def __init__(self, *jobs: Job, workers=1, qos: QoS = None):
         self.bar_p = 0
         self.jobs = []
         self.dump = []
-        self.thread = None
+        self.threads = []
+        self.workers = max(1, workers)
         self.current = None
         self.messages = deque()
+        self._lock = Lock()
+        # called from the workers whenever there is something new to show
+        self.notify = None
+        self.qos = qos
+        # JobJournal recording the jobs that have a journal_key
+        self.journal = None
+        # config changes made by the workers, applied by the thread that owns the configs
+        self.updates = deque()
 
         for j in jobs:
-            if not isinstance(j, Job):
-                raise TypeError
-            self.jobs.append(j)
+            self.add_job(j)
+
+    def changed(self):
+        if self.notify:
+            self.notify()
 
     def msg_clb(self, **kwargs):
         self.messages.append(kwargs)
+        self.changed()
 
     def fetch_messages(self):
         while len(self.messages) > 0:
             yield self.messages.popleft()
 
+    def defer(self, fn, *args):
+        self.updates.append((fn, args))
+        self.changed()
+
+    def apply_updates(self):
+        while len(self.updates) > 0:
+            fn, args = self.updates.popleft()
+            fn(*args)
+
+    def _next_job(self):
+        # picking a job and retiring the worker happen under the same lock, so that run_threaded never sees a
+        # worker that is about to exit as still available
+        with self._lock:
+            if not self.paused():
+                for j in self.jobs:
+                    if not j.done and not j.running:
+                        j.running = True
+                        return j
+            self.threads.remove(current_thread())
+
+    def paused(self):
+        return self.qos is not None and self.qos.paused()
+
+    def set_gaming(self, gaming):
+        """
+        Switches the transfer policy when a game starts or exits: queued jobs are held or released and the
+        running ones are throttled to the new limits.
+        """
+        if self.qos is None or self.qos.gaming == gaming:
+            return
+        self.qos.gaming = gaming
+        for j in self.jobs:
+            if j.running:
+                j.throttle()
+        self.run_threaded()
+        self.changed()
+
     def run_all(self):
         # support for dynamic adding to list
         # if using a normal if, the list would change size while iterating
-        while True:
-            t = None
-            for j in self.jobs:
-                if not j.done and not j.running:
-                    t = j
-            self.current = t
-            if self.current is None:
-                break
-            self.current.running = True
-            self.current.run(self.msg_clb)
-            self.current.running = False
-            self.current.done = True
+        while (j := self._next_job()) is not None:
+            self.current = j
+            if self.journal and j.journal_key:
+                self.journal.start(j.journal_key)
+            try:
+                j.run(self.msg_clb)
+            except Exception as e:
+                j.failed = True
+                self.msg_clb(title="Job Error", msg=f"{type(e).__name__}: {e}")
+            if self.journal and j.journal_key:
+                if j.failed:
+                    self.journal.failed(j.journal_key)
+                else:
+                    self.journal.done(j.journal_key)
+            j.running = False
+            j.done = True
+            self.changed()
         self.current = None
-        if self.thread:
-            self.thread = None
 
     def speed(self):
         if self.current:
@@ -230,8 +344,13 @@ class JobRunner:
             tot_p = sum([j.progress() for j in displayed])
             return tot_p / len(displayed), len([i for i in displayed if i.done]), len(displayed)
 
+    def queued(self, journal_key):
+        return any(j.journal_key == journal_key and not j.done for j in self.jobs)
+
     def add_job(self, job: Job):
         if isinstance(job, Job):
+            job.on_change = self.changed
+            job.qos = self.qos
             self.jobs.append(job)
         else:
             raise TypeError(job)
@@ -241,18 +360,27 @@ class JobRunner:
         self.jobs = []
 
     def has_runnable_jobs(self):
-        return len(self.jobs) > 0 and not all(map(lambda l: l.running, self.jobs))
+        return any(map(lambda l: not l.running and not l.done, self.jobs))
 
     def completed(self):
         return len(self.jobs) > 0 and all(map(lambda l: l.done, self.jobs))
 
     def running(self):
-        return self.thread is not None
+        return len(self.threads) > 0
 
     def run_threaded(self):
-        if not self.running() and self.jobs:
-            self.thread = Thread(target=self.run_all)
-            self.thread.start()
+        with self._lock:
+            pending = 0 if self.paused() else len([j for j in self.jobs if not j.done and not j.running])
+            while pending > 0 and len(self.threads) < self.workers:
+                t = Thread(target=self.run_all, daemon=True)
+                self.threads.append(t)
+                t.start()
+                pending -= 1
+
+    def wait(self, interval=.2):
+        while self.running() or self.has_runnable_jobs():
+            self.run_threaded()
+            sleep(interval)
 
     def bar(self):
         self.bar_p += 1
@@ -276,25 +404,103 @@ class Bugl:
         self.rsync = None
         self.game_defaults = Game.GameConfig(_c_d, self.conf).game_conf
         self._games = []
-        self._jobs = JobRunner()
+        self._jobs = JobRunner(qos=QoS(sync_conf))
         self._selected = None
         self._section = "main"
         self._progress = True
+        self._trace_overlay = False
+        self.watcher = None
+        self.loop = None
+        self._input_pending = False
+        # paths whose reload waits for their game to exit
+        self._reload_pending = set()
+        self.bases = MergeBase()
+        self.feed = None
+        self.replicas = None
+        # LibraryStore, when "library_store" is "sqlite"
+        self.store = None
+        # loaded on first use, an offline start that doesn't need them doesn't import them
+        self._sessions = None
+        self._journal = None
+        self._snapshots = None
+        self._wine = None
+        self._cache = None
+        self._archiver = None
+        # game the page cache and the wineserver were last warmed for
+        self._warmed = None
+        self._wine_warmed = None
+        # game selected and since when, for the restore on selection
+        self._dwelling = None
+        self._dwell_start = 0
+        self._unpacking = set()
+
+    @property
+    def sessions(self):
+        if self._sessions is None:
+            from sessions import SessionStore
+            self._sessions = SessionStore()
+        return self._sessions
+
+    @property
+    def journal(self):
+        if self._journal is None:
+            from journal import JobJournal
+            self._journal = JobJournal()
+            self._jobs.journal = self._journal
+        return self._journal
+
+    @property
+    def snapshots(self):
+        if self._snapshots is None:
+            from snapshots import Snapshots
+            self._snapshots = Snapshots(self.conf.get("snapshot_keep"))
+        return self._snapshots
+
+    @property
+    def wine(self):
+        if self._wine is None:
+            from wine import WinePrewarmer
+            self._wine = WinePrewarmer(self.conf)
+        return self._wine
+
+    @property
+    def cache(self):
+        if self._cache is None:
+            from pagecache import CacheWarmer
+            self._cache = CacheWarmer(self.conf)
+        return self._cache
+
+    @property
+    def archiver(self):
+        if self._archiver is None:
+            from archive import Archiver
+            self._archiver = Archiver(self.conf)
+        return self._archiver
 
     def _init_sync(self, scr, override_mode=None):
+        # paramiko and the rest of the sync stack are only loaded here, when a connection is actually needed
+        from sync import Sync
+
         if not self.sync:
             self.sync = Sync(self.sync_c, lambda l: self.dialog(scr, l, "Password:", "password"))
 
         if override_mode is not None:
             self.sync.override_mode(override_mode)
 
+        if not self.replicas:
+            from replicas import ReplicaSet
+            self.replicas = ReplicaSet(self.sync)
+            self.feed = self.replicas.feed()
+
+        fresh = False
         if not self.sync.sftp:
             try:
                 self.sync.connect()
             except self.DialogCancel:
                 return
             except Sync.AuthError:
-                scr.erase()
+                if scr:
+                    scr.erase()
                 if self.sync.conf.get("mode") == Sync.PKEY:
                     if self.dialog(scr, "Connection Error",
                                    "Authentication error: private key authentication failed, "
@@ -305,32 +511,92 @@ class Bugl:
                                 "Authentication error: the password you entered is wrong or invalid.")
                 return
             except Sync.NoHostSet:
-                scr.erase()
+                if scr:
+                    scr.erase()
                 self.dialog(scr, "Connection Error",
                             f"No host set in config file ({os.path.abspath(self.sync.conf.config_path)})")
                 return
             except Sync.ConnectionError as _e:
-                scr.erase()
+                if scr:
+                    scr.erase()
                 self.dialog(scr, "Connection Error", _e.args[0])
                 return
+            else:
+                fresh = True
 
+        self.replicas.connect()
+        if fresh:
+            self.resume_jobs()
         return True
 
-    def gen_rsync(self, scr):
-        self.sync.prepare_path(self.sync.conf.get("remote_data_path"))
-        return Rsync(self.sync)
+    def gen_rsync(self, scr, sync=None):
+        from sync import Rsync
+
+        sync = sync or self.sync
+        sync.prepare_path(sync.conf.get("remote_data_path"))
+        return Rsync(sync)
 
     def render_loading(self, scr, title, msg="Loading..."):
         self.dialog(scr, title, msg, _type="blank")
 
-    def add_game(self, _config_path):
+    def add_game(self, _config_path, data=None):
         try:
-            self._games.append(Game(Configs(self.game_defaults, config_path=_config_path), self))
+            with phase("config_parse"):
+                if data is not None:
+                    conf = Configs(self.game_defaults, data=data, config_path=_config_path)
+                else:
+                    conf = Configs(self.game_defaults, config_path=_config_path)
+            self._games.append(Game(conf, self))
             return _config_path, None
         except Configs.ConfigFormatErrorException as e:
             # raise e
             return _config_path, e
 
+    def game_at(self, _path):
+        for _g in self._games:
+            if _g.conf.game_conf.config_path == _path:
+                return _g
+
+    def reload_library(self):
+        """
+        Applies the changes in the games folder to the loaded library, without touching running games: their
+        changes are applied once they exit.
+        Returns the paths of the configs that failed to load.
+        """
+        # the gui registers the watcher on its loop once, it's only polled here
+        from library import LibraryWatcher
+
+        if self.watcher is None:
+            self.watcher = LibraryWatcher("games")
+        added, removed, modified = self.watcher.changes()
+        pending, self._reload_pending = self._reload_pending, set()
+        faulty = {}
+        for _path in sorted(added | removed | modified | pending):
+            _g = self.game_at(_path)
+            if _g and (_g.is_alive() or _g._session_started):
+                self._reload_pending.add(_path)
+                continue
+            if not os.path.exists(_path):
+                if _g:
+                    if self._selected is _g:
+                        self.select("prev" if len(self._games) > 1 else None)
+                    self._games.remove(_g)
+                    if self._selected is _g:
+                        self._selected = None
+            elif _g is None:
+                _path, _ex = self.add_game(_path)
+                if _ex:
+                    faulty[_path] = _ex
+            elif LibraryWatcher.differs(_g.conf.game_conf, _path):
+                try:
+                    _g.conf.game_conf.read()
+                    _g._init_playtime = _g.conf.get("playtime")
+                except Configs.ConfigFormatErrorException as _e:
+                    faulty[_path] = _e
+        if self._selected is None:
+            self.select("last_played")
+        return faulty
+
     def index(self, _g: Game):
         if type(_g) is not Game:
             raise TypeError
@@ -364,128 +630,474 @@ class Bugl:
                 raise ValueError
 
     def check_for_sync(self, win, progress):
+        # reads come from the nearest up to date replica, pushes reach all of them
+        reader = self.replicas.reader()
+        feed = self.replicas.feed(reader)
+
         def verboser(conf_):
             try:
-                self.sync_conf(conf_, autonomous=False)
+                self.sync_conf(conf_, autonomous=False, sync=reader)
             except Exception as e:
                 if isinstance(e, Configs.MissingPropertyException):
-                    if self.dialog(win, "Sync Conf",
+                    if self.decide(win, "Sync Conf",
                                    f"Remote config with path {conf_.config_path} misses a mandatory internal property, "
-                                   f"probably it's outdated, upload local file to remote?", "confirm"):
+                                   f"probably it's outdated, upload local file to remote?", "upload"):
                         self.sync_conf(conf_)
                     else:
                         return -1
                 elif isinstance(e, Configs.ConfigFormatErrorException):
-                    if self.dialog(win, "Sync Conf",
+                    if self.decide(win, "Sync Conf",
                                    f"Remote config with path {conf_.config_path} is corrupted, upload the local one?",
-                                   "confirm"):
+                                   "upload"):
                         self.render_loading(win, "Sync Conf", "Uploading conf...")
                         self.sync_conf(conf_)
                     else:
                         return -2
                 elif isinstance(e, FileNotFoundError):
                     pass
+                elif isinstance(e, Bugl.ConfigConflictException):
+                    keys = ", ".join(e.args[1])
+                    self.sync_conf(conf_, prefer="local" if self.dialog(
+                        win, "Sync Conf", f"Config {conf_.config_path} was changed both here and on remote ({keys}), "
+                                          f"which version should be kept?", "confirm", butts=("Local", "Remote")
+                    ) else "remote")
+                    return
                 else:
                     raise e
 
                 self.sync_conf(conf_)
 
-        operations = len(self._games) + 2
-        progress.update(1, operations)
-        progress.update_msg("Synchronizing system configs...")
-        if (r_ := verboser(self.conf)) is not None:
-            return r_
-        progress.update_msg("Synchronizing synchronization configs...")
-        progress.update(2, operations)
-        if (r_ := verboser(self.sync_c)) is not None:
-            return r_
-        self.sync_conf(self.sync_c)
-
-        for n, conf in enumerate(map(lambda l: l.conf.game_conf, self._games)):
-            progress.update_msg(f"Synchronizing games configs ({n+1:2d}/{len(self._games):2d})...")
-            progress.update(3 + n, operations)
-            if (r_ := verboser(conf)) is not None:
-                return r_
+        # only the configs pushed by others since the last check, and the ones changed here, need a round trip
+        gen, changed = feed.pending()
 
-    @staticmethod
-    def mirror_confs(r_conf: RConfigs, conf: Configs):
+        def needed(conf_):
+            return changed is None or conf_.config_path in changed or conf_.get("__to_sync__")
+
+        games = [c for c in map(lambda l: l.conf.game_conf, self._games) if needed(c)]
+        # with the remote agent every config needed comes in a single round trip
+        reader.prefetch([_c.config_path for _c in [self.conf, self.sync_c] + games if needed(_c)])
+        try:
+            operations = len(games) + 2
+            progress.update(1, operations)
+            progress.update_msg("Synchronizing system configs...")
+            if needed(self.conf) and (r_ := verboser(self.conf)) is not None:
+                return r_
+            progress.update_msg("Synchronizing synchronization configs...")
+            progress.update(2, operations)
+            if needed(self.sync_c):
+                if (r_ := verboser(self.sync_c)) is not None:
+                    return r_
+                self.sync_conf(self.sync_c)
+
+            for n, conf in enumerate(games):
+                progress.update_msg(f"Synchronizing games configs ({n+1:2d}/{len(games):2d})...")
+                progress.update(3 + n, operations)
+                if (r_ := verboser(conf)) is not None:
+                    return r_
+            feed.seen(max(gen, feed.local_generation()))
+        finally:
+            # copies left unread by an early return would be served stale by a later read
+            reader.forget()
+
+    def mirror_confs(self, r_conf: "RConfigs", conf: Configs, pushed=False):
         r_conf.set("__to_sync__", False)
         r_conf.write_all()
         conf.read()
+        self.bases.save(conf.config_path, conf_dict(conf))
+        if pushed and self.replicas:
+            self.replicas.feed(r_conf.sync).push(conf.config_path)
+            self.replicas.push_conf(conf.config_path, exclude=r_conf.sync)
+
+    def decide(self, win, title, msg, direction):
+        """
+        Asks for a sync decision, direction is either "upload" or "download" and tells which side would be
+        overwritten if the answer is positive.
+        """
+        return self.dialog(win, title, msg, "confirm")
+
+    def resolve_conflict(self, conf: Configs, r_conf: "RConfigs", prefer=None):
+        """
+        Called when the remote config changed since the last sync and the local one has unsynced changes.
+        Merges both against the last synced version, returns the RConfigs to be mirrored on both sides, or None to
+        leave both untouched.
+        """
+        merged, conflicts = three_way(self.bases.load(conf.config_path), conf_dict(conf), conf_dict(r_conf))
+        if conflicts:
+            if prefer:
+                merged = apply_choice(merged, conflicts, prefer)
+            else:
+                merged = self.resolve_keys(conf, merged, conflicts)
+            if merged is None:
+                return
+        for k, v in merged.items():
+            r_conf.set(k, v)
+        return r_conf
 
-    def sync_conf(self, conf: Configs, msg_clb=None, autonomous=True):
-        conf.write()
+    def resolve_keys(self, conf: Configs, merged, conflicts):
+        """
+        Called with the keys three_way couldn't merge, returns the solved merged dict or None to skip the config.
+        """
+        raise Bugl.ConfigConflictException(conf.config_path, [c.name() for c in conflicts])
 
-        try:
-            r_conf = RConfigs.from_conf(self.sync, conf)
-            if r_conf.newer(conf):
-                if conf.get("__to_sync__"):
-                    raise Bugl.ConfigConflictException
-                self.mirror_confs(r_conf, conf)
+    def sync_conf(self, conf: Configs, msg_clb=None, autonomous=True, prefer=None, sync=None):
+        from sync import RConfigs, LOCAL
+
+        sync = sync or self.sync
+        with span("sync_conf", path=conf.config_path):
+            conf.write()
+
+            try:
+                r_conf = RConfigs.from_conf(sync, conf)
+                base = self.bases.load(conf.config_path)
+                if conf.get("__to_sync__") and (r_conf.newer(conf) or base is not None and conf_dict(r_conf) != base):
+                    # remote changed since the last sync: merged whichever side is newer, never overwritten
+                    r_conf = self.resolve_conflict(conf, r_conf, prefer)
+                    if r_conf is None:
+                        return
+                    self.mirror_confs(r_conf, conf, pushed=True)
+                elif r_conf.newer(conf):
+                    self.mirror_confs(r_conf, conf)
+                elif r_conf.get("__update_time__") == conf.get("__update_time__") and not conf.get("__to_sync__"):
+                    # already in sync, nothing to write on either side
+                    return
+                else:
+                    r_conf = RConfigs(sync, conf.template, conf.config_path, load_from=LOCAL)
+                    self.mirror_confs(r_conf, conf, pushed=True)
+            except (Configs.MissingPropertyException, Configs.ConfigFormatErrorException, FileNotFoundError) as e:
+                if not autonomous:
+                    raise e
+                r_conf = RConfigs(sync, conf.template, conf.config_path, load_from=LOCAL)
+                self.mirror_confs(r_conf, conf, pushed=True)
+
+    @staticmethod
+    def data_root(loc):
+        loc = os.path.expanduser(loc)
+        if os.path.exists(loc):
+            if os.path.isdir(loc) and not os.path.islink(loc) and loc[-1] != "/":
+                loc += "/"
+        return loc
+
+    @staticmethod
+    def data_remote(sync, g: Game):
+        return f"{sync.conf.get('remote_data_path', path=True, expanduser_func=sync.expanduser)}{g.conf.get('id')}/"
+
+    def push_data(self, sync, g: Game, msg_clb=None):
+        """
+        Pushes the data of g to a replica: queued on the job runner, or run right away when msg_clb is given.
+        """
+        rsync = self.gen_rsync(None, sync)
+        rem = self.data_remote(sync, g)
+        sync.prepare_path(rem)
+        from compression import Compression
+        compression = Compression(g.conf, rsync.compress_list(), self._jobs.defer)
+        for uniq, loc in g.conf.get("data").items():
+            loc = self.data_root(loc)
+            if not os.path.exists(loc):
+                continue
+            j = rsync.gen_job(loc, rem, uniq, operation=PUSH, compression=compression)
+            if isinstance(j, int):
+                continue
+            if msg_clb:
+                j.run(msg_clb)
             else:
-                r_conf = RConfigs(self.sync, conf.template, conf.config_path, load_from=LOCAL)
-                self.mirror_confs(r_conf, conf)
-        except (Configs.MissingPropertyException, Configs.ConfigFormatErrorException, FileNotFoundError) as e:
-            if not autonomous:
-                raise e
-            r_conf = RConfigs(self.sync, conf.template, conf.config_path, load_from=LOCAL)
-            self.mirror_confs(r_conf, conf)
-
-    def sync_data(self, g: Game, win, operation=Rsync.PULL):
+                self._jobs.add_job(j)
+
+    def repair_replicas(self):
+        # replays in background what the replicas missed while unreachable, one repair at a time
+        if not self.replicas or not self.replicas.missed or self._jobs.running() or self._jobs.has_runnable_jobs():
+            return
+        if self.replicas.needs_repair():
+            self._jobs.add_job(Job("replicas", 1, actual_job=self._repair, sync=self.sync))
+            self._jobs.run_threaded()
+
+    def _repair(self, msg_clb=None):
+        games = {_g.conf.get("id"): _g for _g in self._games}
+
+        def push(sync, id_):
+            if id_ in games:
+                self.push_data(sync, games[id_], msg_clb)
+
+        self.replicas.repair(push, msg_clb)
+
+    def journal_data(self, g: Game, uniq, operation):
+        return self.journal.queue("data", f"{g.conf.get('id')}/{uniq}/{operation}", game=g.conf.get("id"), uniq=uniq,
+                                  operation=operation)
+
+    def resume_jobs(self):
+        # the dry runs need the link, they are done in background
+        if self.journal.pending():
+            self._jobs.add_job(Job("journal", 1, actual_job=self._resume, sync=self.sync))
+            self._jobs.run_threaded()
+
+    def _resume(self, msg_clb=None):
+        """
+        Queues again the operations left pending in the journal by an earlier run, or queued while offline.
+        """
+        from compression import Compression
+
+        confs = {_c.config_path: _c for _c in [self.conf, self.sync_c] + [_g.conf.game_conf for _g in self._games]}
+        games = {_g.conf.get("id"): _g for _g in self._games}
+        rsyncs = {}
+        for e in self.journal.pending():
+            k = self.journal.key(e["kind"], e["item"])
+            if self._jobs.queued(k):
+                continue
+            j = 0
+            if e["kind"] == "conf" and e["item"] in confs:
+                j = Job(e["item"], 1, actual_job=self.sync_conf, actual_job_args=(confs[e["item"]], ), sync=self.sync,
+                        retries=3)
+            elif e["kind"] == "data" and (g := games.get(e["game"])) and e["uniq"] in g.conf.get("data"):
+                source = self.replicas.reader() if e["operation"] == PULL else self.sync
+                if id(source) not in rsyncs:
+                    rsyncs[id(source)] = self.gen_rsync(None, source)
+                rsync = rsyncs[id(source)]
+                j = rsync.gen_job(self.data_root(g.conf.get("data")[e["uniq"]]), self.data_remote(source, g),
+                                  e["uniq"], operation=e["operation"],
+                                  compression=Compression(g.conf, rsync.compress_list(), self._jobs.defer))
+                if e["operation"] == PULL and not isinstance(j, int):
+                    self.snapshot(g.conf.get("data")[e["uniq"]], msg_clb)
+            if isinstance(j, int):
+                # nothing left to do, or the game or its data root is gone
+                if j == 0:
+                    self.journal.done(k)
+                else:
+                    self.journal.failed(k)
+                continue
+            j.journal_key = k
+            self._jobs.add_job(j)
+
+    def snapshot(self, loc, msg_clb):
+        from snapshots import SnapshotError
+
+        # taken before a pull overwrites loc, a filesystem that can't take it doesn't stop the pull
+        try:
+            self.snapshots.take(loc)
+        except SnapshotError as e:
+            msg_clb(title="Snapshot", msg=f"{e}, pulling without a snapshot.")
+
+    def restore_snapshot(self, g: Game, win):
+        """
+        Puts the data roots of g back as they were before the last pull, or the last restore.
+        """
+        latest = {_u: _s[0] for _u, _l in g.conf.get("data").items() if (_s := self.snapshots.list(_l))}
+        if not latest:
+            self.dialog(win, "Restore Data", f"No snapshots of the data of {g.conf.get('name')}.")
+            return
+        if g.is_alive() or self._jobs.running():
+            self.dialog(win, "Restore Data", "Can't restore while the game or a sync is running.")
+            return
+        when = max(self.snapshots.taken(_s) for _s in latest.values()).strftime("%Y/%m/%d %H:%M")
+        if not self.dialog(win, "Restore Data", f"Restore the data of {g.conf.get('name')} to the snapshot of "
+                                                f"{when}? The current data is snapshotted first.", "confirm"):
+            return
+        for _u, _s in latest.items():
+            self.snapshots.restore(g.conf.get("data")[_u], _s)
+        self.dialog(win, "Restore Data", f"Restored {len(latest)} data root(s).")
+
+    def archive_cold(self):
+        """
+        Packs, or drops when "archive_mode" is "drop", the data of the games not played for "archive_after_days".
+        """
+        from archive import DROP
+
+        cold = [_g for _g in self._games if self.archiver.cold(_g)]
+        # dropping needs the remote to check against
+        if not cold or self.conf.get("archive_mode") == DROP and not (self.sync and self.sync.sftp):
+            return
+        self._jobs.add_job(Job("archive", 1, actual_job=self._archive, actual_job_args=(cold, ), sync=self.sync))
+        self._jobs.run_threaded()
+
+    def _archive(self, games, msg_clb=None):
+        from archive import DROP
+
+        drop = self.conf.get("archive_mode") == DROP
+        rsync = self.gen_rsync(None, self.sync) if drop else None
+        # a push still to be done means remote is behind
+        pending = {(_e.get("game"), _e.get("uniq")) for _e in self.journal.pending("data")}
+        for _g in games:
+            for uniq, loc in _g.conf.get("data").items():
+                if not drop:
+                    self.archiver.pack(_g, uniq, loc)
+                    continue
+                loc_ = self.data_root(loc)
+                if (_g.conf.get("id"), uniq) in pending or not os.path.exists(loc_):
+                    continue
+                # a clean dry run with nothing to push: remote has all of it. Any failure keeps the data
+                j = rsync.gen_job(loc_, self.data_remote(self.sync, _g), uniq, operation=PUSH)
+                if j == rsync.UP_TO_DATE and rsync.failure is None:
+                    self.archiver.drop(_g, uniq, loc)
+                elif not isinstance(j, int):
+                    j.files.close()
+
+    def restore_estimate(self, g: Game):
+        return time_elapsed(timedelta(seconds=max(self.archiver.restore_time(g), 1)), form="in about {}")
+
+    def _unpack(self, g: Game, msg_clb=None):
+        try:
+            for uniq in self.archiver.packed(g):
+                if uniq in g.conf.get("data"):
+                    self.archiver.unpack(g, uniq, g.conf.get("data")[uniq])
+        finally:
+            self._unpacking.discard(g.conf.get("id"))
+
+    def unarchive(self, g: Game, win):
+        """
+        Unpacks the packed data of g, after any archival or restore of it already running. Returns False if some
+        of its data is still archived: the dropped roots come back with a pull.
+        """
+        with self.archiver.lock(g):
+            pass
+        if self.archiver.packed(g):
+            if win:
+                self.render_loading(win, "Restoring Data", f"Unpacking the data of {g.conf.get('name')}, done "
+                                                           f"{self.restore_estimate(g)}...")
+            self._unpack(g)
+        return not self.archiver.dropped(g)
+
+    def ready_data(self, g: Game, win):
+        """
+        Brings back the archived data of g before it's launched, returns False if it can't be launched yet.
+        """
+        if self.unarchive(g, win):
+            return True
+        if self.dialog(win, "Archived Data", f"The data of {g.conf.get('name')} was removed from this host, pull it "
+                                             f"back from remote? The pull should end {self.restore_estimate(g)}.",
+                       "confirm"):
+            self.sync_data(g, win, PULL)
+        return False
+
+    # seconds a packed game stays selected before it's unpacked in background, scrolling past it doesn't count
+    RESTORE_DWELL = 2
+
+    def dwelled(self, seconds):
+        # whether the selection stayed on the same game for seconds
+        if self._selected is not self._dwelling:
+            self._dwelling, self._dwell_start = self._selected, monotonic()
+        return monotonic() - self._dwell_start >= seconds
+
+    def restore_selected(self):
+        g = self._selected
+        if not g or g.conf.get("id") in self._unpacking or not self.archiver.packed(g) or \
+                not self.dwelled(self.RESTORE_DWELL):
+            return
+        self._unpacking.add(g.conf.get("id"))
+        self._jobs.add_job(Job("restore", 1, actual_job=self._unpack, actual_job_args=(g, )))
+        self._jobs.run_threaded()
+
+    def scan_progress(self, win):
+        """
+        Returns the on_scan callback of Rsync.gen_job: shows what the dry run found so far, Q cancels.
+        """
+        if win is None:
+            return None
+
+        def on_scan(files, bytes_):
+            self.render_loading(win, "Planning transfer", f"Scanning: {files} files / {size_fmt(bytes_)}\n"
+                                                          f"[Q] to cancel")
+            win.timeout(0)
+            _k = win.getch()
+            win.timeout(0 if self.loop else 500)
+            return _k in (ord("q"), ord("Q"))
+        return on_scan
+
+    def sync_data(self, g: Game, win, operation=PULL):
+        from compression import Compression
+
+        self.unarchive(g, win)
+        dropped = self.archiver.dropped(g)
         if self._init_sync(win):
-            rem = f"{self.sync.conf.get('remote_data_path', path=True, expanduser_func=self.sync.expanduser)}" \
-                  f"{g.conf.get('id')}/"
+            # pulls come from the nearest up to date replica, pushes go to all of them
+            source = self.replicas.reader() if operation == PULL else self.sync
+            rem = self.data_remote(source, g)
             if win:
                 self.render_loading(win, "Starting transaction")
-            g.rsync = self.gen_rsync(win)
+            g.rsync = self.gen_rsync(win, source)
+            compression = Compression(g.conf, g.rsync.compress_list(), self._jobs.defer)
             for uniq, loc in g.conf.get("data").items():
-                loc = os.path.expanduser(loc)
-                if os.path.exists(loc):
-                    if os.path.isdir(loc) and not os.path.islink(loc) and loc[-1] != "/":
-                        loc += "/"
-                j = g.rsync.gen_job(loc, rem, uniq, operation=operation)
+                if operation == PUSH and uniq in dropped:
+                    continue
+                loc = self.data_root(loc)
+                j = g.rsync.gen_job(loc, rem, uniq, operation=operation, compression=compression,
+                                    on_scan=self.scan_progress(win))
                 if isinstance(j, int):
-                    if j == 0:
+                    if j == g.rsync.CANCELED:
+                        self.dialog(win, "Sync Data", "Planning canceled, the roots already planned are synced.")
                         return
+                    if j == g.rsync.UP_TO_DATE:
+                        self.journal.done(self.journal.key("data", f"{g.conf.get('id')}/{uniq}/{operation}"))
+                        continue
+                    if j == g.rsync.FAILED:
+                        self.dialog(win, "Sync Data", f"Planning the sync of\n{loc}\nfailed: "
+                                                      f"{g.rsync.failure or 'rsync exited with an error'}.")
+                        continue
                     if j == -1:
-                        if operation == Rsync.PULL:
-                            if self.dialog(win, "Sync Data",
-                                                f"Data folder corresponding to \n{loc}\ndoesn't exists on remote,"
-                                                f" upload it?", "confirm"):
-                                if not self.sync.exists(rem):
-                                    self.sync.sftp.mkdir(rem)
-                                self.sync_data(g, win, Rsync.PUSH)
+                        if operation == PULL:
+                            if self.decide(win, "Sync Data",
+                                           f"Data folder corresponding to \n{loc}\ndoesn't exists on remote,"
+                                           f" upload it?", "upload"):
+                                self.sync.prepare_path(rem)
+                                self.sync_data(g, win, PUSH)
                         else:
-                            if self.dialog(win, "Sync Data",
-                                           "warning: data on local doesn't exist. Download id?", "confirm"):
-                                self.sync_data(g, win, Rsync.PULL)
+                            if self.decide(win, "Sync Data",
+                                           "warning: data on local doesn't exist. Download id?", "download"):
+                                self.sync_data(g, win, PULL)
                     return
                 else:
+                    if operation == PULL:
+                        self.snapshot(loc, lambda **l: self.dialog(win, **l))
+                    j.journal_key = self.journal_data(g, uniq, operation)
                     self._jobs.add_job(j)
                     self._jobs.run_threaded()
-            if not self._jobs.running():
+                    if uniq in dropped:
+                        # from here on the journal sees the pull through
+                        self.archiver.forget(g, uniq)
+            if operation == PUSH:
+                self.replicas.fan_out(lambda l: self.push_data(l, g), exclude=self.sync, kind="data",
+                                      item=g.conf.get("id"))
+                self._jobs.run_threaded()
+            if not self._jobs.running() and not self._jobs.has_runnable_jobs():
                 self.dialog(win, "Sync Data", f"No data to be synced.")
 
+        elif operation == PUSH:
+            self.journal.queue_many("data", [(f"{g.conf.get('id')}/{uniq}/{PUSH}",
+                                              {"game": g.conf.get("id"), "uniq": uniq, "operation": PUSH})
+                                             for uniq in g.conf.get("data") if uniq not in dropped])
+            self.dialog(win, "Sync Data", "No connection with remote, the push will start on the next connection.")
         else:
             self.dialog(win, "Sync Data", "Can't sync data without connection with remote.")
 
     def write(self, sync=False):
-        self.conf.set("__to_sync__", True)
-        self.conf.write()
-        for _g in self._games:
-            _g.conf.set("__to_sync__", True)
-            _g.conf.game_conf.write()
+        # only what changed since it was last synced is worth a round trip at the next startup
+        for _c in [self.conf] + [_g.conf.game_conf for _g in self._games]:
+            if conf_dict(_c) != self.bases.load(_c.config_path):
+                _c.set("__to_sync__", True)
+        if self.store:
+            # one transaction, only the files that changed are rewritten
+            from store import GLOBAL
+            self.store.save([self.conf], GLOBAL)
+            self.store.save([_g.conf.game_conf for _g in self._games])
+        else:
+            self.conf.write()
+            for _g in self._games:
+                _g.conf.game_conf.write()
         if sync:
             return self._sync_all()
 
     def _sync_all(self):
+        confs = [self.conf, self.sync_c] + [_g.conf.game_conf for _g in self._games]
+        # offline, the journal replays them on the next connection
+        keys = self.journal.queue_many("conf", [(_c.config_path, {}) for _c in confs])
         if self.sync and self.sync.sftp:
-            self._jobs.add_job(Job(self.conf.config_path, 1, actual_job=self.sync_conf, actual_job_args=(self.conf,)))
-            self._jobs.add_job(Job(self.sync_c.config_path, 1, actual_job=self.sync_conf,
-                                   actual_job_args=(self.sync_c,)))
-            for _g in self._games:
-                self._jobs.add_job(Job(_g.conf.game_conf.config_path, 1, actual_job=self.sync_conf,
-                                       actual_job_args=(_g.conf.game_conf, )))
+            for conf, k in zip(confs, keys):
+                if self._jobs.queued(k):
+                    continue
+                j = Job(conf.config_path, 1, actual_job=self.sync_conf, actual_job_args=(conf, ), sync=self.sync,
+                        retries=3)
+                j.journal_key = k
+                self._jobs.add_job(j)
+            self._jobs.add_job(Job("sessions", 1, actual_job=self.sessions.sync,
+                                   actual_job_args=(self.sync, [_g.conf.get("id") for _g in self._games]),
+                                   sync=self.sync, retries=3))
             self._jobs.run_threaded()
 
     def ls_games(self, win):
@@ -503,13 +1115,24 @@ class Bugl:
             if len(_p) > win.getmaxyx()[1]:
                 _p = _p[:win.getmaxyx()[1]-5]+"..."
             win.addstr(_i*2+2, 2, _p, curses.A_REVERSE if _i == selected else 0)
+        if self._trace_overlay:
+            self.render_trace(win, (_i+1)*2+1)
+
+    def render_trace(self, win: SafeWinWrapper, y):
+        win.addstr(y, 0, "Slowest recent operations", curses.A_REVERSE)
+        for _n, _s in enumerate(tracing.slowest()):
+            if y+_n+1 >= win.getmaxyx()[0]:
+                break
+            extra = " ".join(f"{k}={v}" for k, v in _s.attrs.items() if k in ("bytes", "rtt", "files", "error"))
+            win.addstr(y+_n+1, 1, f"{_s.duration*1000:8.1f}ms {_s.name} {extra}")
 
     def render_tooltip(self, win: SafeWinWrapper, _section):
         msg = f"BUGL {self.VERSION} - "
         msg += {
             "main": f"[{chr(8593)+chr(8595)}] to navigate, [Enter] to play, "
-                    f"[S] to sync, "
+                    f"[S] to sync, [R] to restore data, "
                     f"{'[Shift+K] to kill selected game, ' if self._selected and self._selected.is_alive() else ''}"
+                    f"{'[O] for slow operations, ' if tracing.ENABLED else ''}"
                     f"[Q] to exit.",
             "dialog": f"[{chr(8592)+chr(8594)}] to navigate, [Enter] to select.",
         }[_section]
@@ -522,12 +1145,22 @@ class Bugl:
             gran, done, tot = self._jobs.progress()
             msg = f"[{self._jobs.bar()}] Operations are in progress: {done:2d}/{tot:2d} | " \
                   f"Overall: {gran*100:5.1f}% | Speed: {self._jobs.speed()}"
+            if self.sync:
+                state, rtt = self.sync.link_state()
+                msg += f" | Link: {state}" + (f" ({rtt*1000:.0f}ms)" if rtt is not None else "")
+            if self._jobs.qos and self._jobs.qos.gaming and self._jobs.qos.bwlimit():
+                msg += f" | Throttled to {self._jobs.qos.bwlimit()}KiB/s"
 
             fill = int(win.getmaxyx()[1] * gran)
             msg += (" " * (win.getmaxyx()[1] - len(msg)))
             win.addstr(win.getmaxyx()[0] - 2, 0, msg[:fill], _attr=curses.A_REVERSE)
             if fill < win.getmaxyx()[0]:
                 win.addstr(win.getmaxyx()[0] - 2, fill, msg[fill:])
+        elif self._jobs.paused() and self._jobs.has_runnable_jobs():
+            gran, done, tot = self._jobs.progress()
+            msg = f"[||] Operations paused while a game is running: {done:2d}/{tot:2d}"
+            msg += (" " * (win.getmaxyx()[1] - len(msg)))
+            win.addstr(win.getmaxyx()[0] - 2, 0, msg, _attr=curses.A_REVERSE)
         else:
             if self._jobs.completed() or sticky:
                 self._jobs.dump_jobs()
@@ -597,6 +1230,69 @@ class Bugl:
             self.button.render(True)
             self._win.refresh()
 
+    # seconds a wine game stays selected before its wineserver is started, each one lingers once started
+    WINE_DWELL = 1
+
+    def prewarm(self):
+        """
+        Gets the selected game ready to launch, once per selection. Nothing is read ahead while a game runs.
+        """
+        if any(_g.is_alive() for _g in self._games):
+            if self.cache.running():
+                self.cache.stop()
+                # warmed again once the game exits
+                self._warmed = None
+            return
+        if self._selected is not self._warmed:
+            self._warmed = self._selected
+            if self._selected:
+                self.cache.warm(self._selected)
+        if self._selected is not self._wine_warmed and self.dwelled(self.WINE_DWELL):
+            self._wine_warmed = self._selected
+            if self._selected:
+                self.wine.warm(self._selected)
+
+    def loop_timeout(self):
+        # longest the ui can sleep without missing something that isn't signaled through the loop
+        if self._jobs.running() or self._jobs.has_runnable_jobs():
+            return 1
+        if any(_g._session_started for _g in self._games):
+            # playtime is shown and saved every second
+            return 1
+        if self.archiver.measuring():
+            return 1
+        if self._selected and self._selected is not self._wine_warmed and self.wine.is_wine(self._selected):
+            # the wineserver waits for the dwell
+            return self.WINE_DWELL
+        if self._selected and self.archiver.packed(self._selected):
+            # the restore on selection waits for the dwell
+            return self.RESTORE_DWELL
+        if self.watcher and self.watcher.fileno() is None:
+            return self.watcher.SCAN_INTERVAL
+        return None
+
+    def next_key(self, win: SafeWinWrapper):
+        """
+        Waits for the next key, returns -1 when something else woke the ui and it only needs a redraw.
+        """
+        if self.loop is None:
+            return win.getch()
+        if not self._input_pending:
+            events = self.loop.wait(self.loop_timeout())
+            if "library" in events:
+                # applied by the main loop, the queue is emptied here so that dialogs don't spin on it
+                self.watcher.drain()
+            if self.loop.RESIZE in events:
+                curses.resizeterm(*self.loop.terminal_size())
+                self._input_pending = True
+                return curses.KEY_RESIZE
+            if self.loop.INPUT not in events:
+                return -1
+        # curses may have buffered more than one key, read until it's empty before sleeping again
+        _k = win.getch()
+        self._input_pending = _k != -1
+        return _k
+
     class DialogCancel(Exception):
         pass
 
@@ -651,7 +1347,7 @@ class Bugl:
                 _b.render(_nb == sel)
                 diag.refresh()
 
-            _inp = win.getch()
+            _inp = self.next_key(win)
             if _type == "password":
                 if _inp == ord("\t") or _inp in (curses.KEY_LEFT, curses.KEY_RIGHT):
                     sel = 1 - sel
@@ -688,6 +1384,9 @@ class Bugl:
         diag.erase()
 
     def gui(self, scr: SafeWinWrapper, faulty_confs, args):
+        from events import EventLoop
+        from library import LibraryWatcher
+
         def panic(reason):
             scr.erase()
             self.dialog(scr, "!BUGL PANIC!",
@@ -696,18 +1395,28 @@ class Bugl:
 
         # generate gui layout
         maxy, maxx = scr.getmaxyx()
-        scr.timeout(500)
+        if not getattr(args, "poll", False):
+            self.loop = EventLoop.for_terminal()
+        if self.loop:
+            scr.timeout(0)
+            self._jobs.notify = self.loop.wake
+        else:
+            scr.timeout(500)
         curses.curs_set(False)
         p_g_select = SafeWinWrapper(curses.newpad(300, int(maxx/2)-1))
         p_g_details = SafeWinWrapper(curses.newpad(300, int(maxx/2)-1))
 
         # setup variables
+        self.watcher = LibraryWatcher("games")
+        if self.loop and self.watcher.fileno() is not None:
+            self.loop.add_reader(self.watcher.fileno(), "library")
         o_maxy, o_maxx = -1, -1
         show_completed = False
         request_refresh = False
 
         # warn if host has not set
-        if self.sync_c.get("host") is None and not self.conf.get("ignore_missing_host"):
+        if self.sync_c.get("host") is None and self.sync_c.get("backend") != "local" and \
+                not self.conf.get("ignore_missing_host"):
             if self.dialog(scr, f"No host set",
                            f"Warning: no remote host set for synchronization, set it in the sync.json file "
                            f"({os.path.abspath(self.sync_c.config_path)}).\n"
@@ -736,6 +1445,8 @@ class Bugl:
                            "confirm", butts=("Yes", "No")):
                 self.render_loading(scr, "Connecting")
                 if self._init_sync(scr):
+                    from sync import RConfigs
+
                     try:
                         rconf = RConfigs(self.sync, self.game_defaults, path_)
                         rconf.write_local()
@@ -754,23 +1465,32 @@ class Bugl:
                     _s = self.sync.download_a("games")
                     self.dialog(scr, "Game Loader", "Downloaded successful for all the games found on remote.")
                     if _s:
-                        self.dialog(scr, "Game Loader", f"Synchronized {len(_s)} games, a restart is needed.")
-                        return -1
+                        # picked up by reload_library in the main loop
+                        self.dialog(scr, "Game Loader", f"Synchronized {len(_s)} games.")
                     else:
                         self.dialog(scr, "Game Loader", f"No games found on remote.")
 
+        self.archive_cold()
         self.select("last_played")
         scr.erase()
         scr.refresh()
 
         while True:
             maxy, maxx = scr.getmaxyx()
+            self._jobs.set_gaming(any(_g.is_alive() for _g in self._games))
+            self.repair_replicas()
+            self.prewarm()
+            self.restore_selected()
             if self._selected:
                 if self._selected.tick():
                     self.dialog(scr, f'{self._selected.conf.get("name")} errored.',
                                 f'{self._selected.conf.get("name")} exited with code {self._selected.poll()}.\n'
                                 f'Error log:\n{" ".join(self._selected.args)}')
 
+            for path_, ex_ in self.reload_library().items():
+                self._jobs.msg_clb(title="Config loading error", msg=f"The config at path {path_} have an error:\n{ex_}")
+
+            self._jobs.apply_updates()
             for m in self._jobs.fetch_messages():
                 self.dialog(scr, **m)
 
@@ -801,7 +1521,10 @@ class Bugl:
             scr.vline(0, int(maxx/2), curses.ACS_VLINE, maxy)
 
             p_g_select.addstr(0, 0, "Select Game")
-            for _n, _g in enumerate(self._games):
+            # only the rows that fit on screen are drawn, scrolled to keep the selected game visible
+            rows = max(1, min(maxy, p_g_select.getmaxyx()[0]) - 3 - (1 if self._progress else 0))
+            first = max(0, self.index(self._selected) - rows + 1) if self._selected else 0
+            for _n, _g in enumerate(self._games[first:first + rows]):
                 attr = 0
                 if _g == self._selected:
                     attr = curses.A_REVERSE
@@ -830,7 +1553,7 @@ class Bugl:
 
                 synced = True"""
 
-            inp = scr.getch()
+            inp = self.next_key(scr)
 
             if inp == curses.KEY_DOWN:
                 if show_completed:
@@ -850,7 +1573,8 @@ class Bugl:
                         self.dialog(scr, "Already running", "The selected game is already running, close it before "
                                                             "starting it again. If it's not responding press "
                                                             "Shift+K to kill it.")
-                    else:
+                    elif self.ready_data(self._selected, scr):
+                        self.cache.stop()
                         self._selected.run()
             elif inp == curses.KEY_EXIT or inp == ord("q"):
                 if self.dialog(scr, "Quit", "Are you sure you want to quit?", "confirm"):
@@ -872,6 +1596,11 @@ class Bugl:
                     self._sync_all()
 
                 scr.erase()
+            elif inp == ord("r"):
+                if self._selected:
+                    self.restore_snapshot(self._selected, scr)
+            elif inp == ord("o") and tracing.ENABLED:
+                self._trace_overlay = not self._trace_overlay
             elif inp == ord("K"):
                 if self._selected.is_alive():
                     if self.dialog(scr, "Kill game?", "Are you sure of killing the game? Note that every game "
@@ -882,61 +1611,103 @@ class Bugl:
                 # put tests here
                 if self.dialog(scr, "Sync Data", "Select operation:", "confirm", butts=("Push", "Pull")):
                     self.render_loading(scr, "Generating rsync object")
-                    self.sync_data(self._selected, scr, Rsync.PUSH)
+                    self.sync_data(self._selected, scr, PUSH)
                 else:
                     self.render_loading(scr, "Generating rsync object")
-                    self.sync_data(self._selected, scr, Rsync.PULL)
+                    self.sync_data(self._selected, scr, PULL)
             elif inp == curses.KEY_RESIZE:
                 maxy, maxx = scr.getmaxyx()
                 p_g_select.resize(300, int(maxx/2))
                 p_g_details.resize(300, int(maxx/2))
-                while maxy < len(list(self._games))+5 or maxx < 2+2+30+30:
+                while maxy < 10 or maxx < 2+2+30+30:
                     scr.erase()
-                    scr.addstr(0, 0, f"Term too little (at least {len(list(self._games))+5}x{2+2+30+30})")
+                    scr.addstr(0, 0, f"Term too little (at least 10x{2+2+30+30})")
                     scr.refresh()
-                    scr.getch()
+                    self.next_key(scr)
                     maxy, maxx = scr.getmaxyx()
                 scr.erase()
 
 
 def prepare():
+    with span("prepare"):
+        try:
+            from bugl.templates import bugl_defaults
+            from bugl.templates import sync_defaults
+        except ModuleNotFoundError:
+            from templates import bugl_defaults
+            from templates import sync_defaults
+
+        if os.name == "nt":
+            conf = "~/Documents/bugl/"
+        else:
+            conf = "~/.config/bugl/"
+        conf = os.path.expanduser(conf)
+
+        prepare_path(conf)
+        os.chdir(conf)
+        with phase("config_parse"):
+            if not os.path.exists(conf + "config.json"):
+                prepare_path("config.json")
+                g_conf = Configs(bugl_defaults, config_path="config.json", write=True)
+                g_conf.write("config.json")
+            else:
+                g_conf = Configs(bugl_defaults, config_path="config.json")
+
+            if not os.path.exists("sync.json"):
+                prepare_path("sync.json")
+                s_conf = Configs(sync_defaults, config_path="sync.json", write=True)
+                s_conf.write("sync.json")
+            else:
+                s_conf = Configs(sync_defaults, config_path="sync.json")
+
+        _b = Bugl(g_conf, s_conf)
+        prepare_path("games", _folder=True)
+        _errs = {}
+        if g_conf.get("library_store") == "sqlite":
+            from store import LibraryStore
+
+            _b.store = LibraryStore()
+            fresh, stale = _b.store.load_games("games")
+            for _path, _data in fresh.items():
+                _b.add_game(_path, _data)
+            for _c in stale:
+                _path, _errs[_path] = _b.add_game(_c)
+            # the configs parsed from their files are stored for the next start
+            _b.store.index([_g.conf.game_conf for _g in _b._games if _g.conf.game_conf.config_path in stale])
+        else:
+            for _c in os.listdir("games"):
+                if _c.split(".")[-1] == "json":
+                    _path, _ex = _b.add_game(f"games/{_c}")
+                    _errs[_path] = _ex
+        return _b, {_p: _e for _p, _e in _errs.items() if _e}
+
+
+def profile_startup(out=None):
+    """
+    Prints how long importing bugl and each phase of prepare() took, and what loading the sync stack would cost.
+    """
+    import sys
+    out = out or sys.stderr
+    global phase_timer
+    phase_timer = timer = tracing.PhaseTimer()
+    start = perf_counter()
     try:
-        from bugl.templates import bugl_defaults
-        from bugl.templates import sync_defaults
-    except ModuleNotFoundError:
-        from templates import bugl_defaults
-        from templates import sync_defaults
-
-    if os.name == "nt":
-        conf = "~/Documents/bugl/"
-    else:
-        conf = "~/.config/bugl/"
-    conf = os.path.expanduser(conf)
-
-    prepare_path(conf)
-    os.chdir(conf)
-    if not os.path.exists(conf + "config.json"):
-        prepare_path("config.json")
-        g_conf = Configs(bugl_defaults, config_path="config.json", write=True)
-        g_conf.write("config.json")
-    else:
-        g_conf = Configs(bugl_defaults, config_path="config.json")
+        prepare()
+    finally:
+        phase_timer = None
+    total = perf_counter() - start
 
-    if not os.path.exists("sync.json"):
-        prepare_path("sync.json")
-        s_conf = Configs(sync_defaults, config_path="sync.json", write=True)
-        s_conf.write("sync.json")
-    else:
-        s_conf = Configs(sync_defaults, config_path="sync.json")
+    loaded = "paramiko" in sys.modules
+    start = perf_counter()
+    import sync
+    sync_import = perf_counter() - start
 
-    _b = Bugl(g_conf, s_conf)
-    prepare_path("games", _folder=True)
-    _errs = {}
-    for _c in os.listdir("games"):
-        if _c.split(".")[-1] == "json":
-            _path, _ex = _b.add_game(f"games/{_c}")
-            _errs[_path] = _ex
-    return _b, {_p: _e for _p, _e in _errs.items() if _e}
+    print(f"imports:            {_import_time*1000:8.1f}ms", file=out)
+    print(f"prepare():          {total*1000:8.1f}ms", file=out)
+    for _n, _t in sorted(timer.totals.items(), key=lambda l: l[1], reverse=True):
+        print(f"  {_n + ':':17s} {_t*1000:8.1f}ms ({timer.counts[_n]}x)", file=out)
+    print(f"sync stack import:  {sync_import*1000:8.1f}ms "
+          f"({'already loaded at startup' if loaded else 'deferred until a connection is needed'})", file=out)
 
 
 if __name__ == "__main__":
@@ -944,11 +1715,22 @@ if __name__ == "__main__":
 
     arg_p = ArgumentParser("bugl")
     arg_p.add_argument("--skip-check", action="store_true")
+    arg_p.add_argument("--trace", nargs="?", const="~/.log/bugl/trace.jsonl", default=None,
+                       help="record spans of sync, rsync and launch operations to this file")
+    arg_p.add_argument("--profile-startup", action="store_true", help="print a startup timing report and exit")
+    arg_p.add_argument("--poll", action="store_true", help="redraw every 500ms instead of waiting for events")
     args_ = arg_p.parse_args()
+    if args_.profile_startup:
+        profile_startup()
+        exit()
+    if args_.trace:
+        tracing.enable(args_.trace)
     while True:
         bugl, errs = prepare()
         try:
             r = curses.wrapper(lambda l: bugl.gui(SafeWinWrapper(l), errs, args_))
+            if bugl.loop:
+                bugl.loop.close()
             if r != -1:
                 bugl.write()
                 exit()
@@ -0,0 +1,433 @@
+#!/usr/bin/env python
+import os
+import sys
+import json
+import socket
+from getpass import getpass
+from socketserver import UnixStreamServer, StreamRequestHandler
+from argparse import ArgumentParser
+from threading import Lock
+from bugl import Bugl, JobRunner, prepare
+import sync_base
+from sync_base import PULL, PUSH
+from merge import apply_choice
+from archive import DROP
+from qos import QoS
+from library import LibraryWatcher
+import tracing
+
+
+class HeadlessBugl(Bugl):
+    """
+    Bugl without curses: every dialog is answered by the configured policies and every message is collected in
+    self.report instead of being shown.
+    """
+    # conflict / decision policies
+    LOCAL = "local"
+    REMOTE = "remote"
+    SKIP = "skip"
+    FAIL = "fail"
+    POLICIES = (LOCAL, REMOTE, SKIP, FAIL)
+
+    class PolicyFailure(Exception):
+        pass
+
+    def __init__(self, conf, sync_conf, policy=LOCAL, workers=1):
+        super().__init__(conf, sync_conf)
+        if policy not in self.POLICIES:
+            raise ValueError(policy)
+        self.policy = policy
+        self._jobs = JobRunner(workers=workers, qos=QoS(sync_conf))
+        # None until the journal is first used, it hooks itself on the runner then
+        self._jobs.journal = self._journal
+        self.report = []
+
+    @classmethod
+    def from_bugl(cls, _b: Bugl, policy=LOCAL, workers=1):
+        _h = cls(_b.conf, _b.sync_c, policy, workers)
+        for _g in _b._games:
+            _g.bugl = _h
+            _h._games.append(_g)
+        _h.store = _b.store
+        return _h
+
+    def log(self, title, msg):
+        self.report.append({"title": str(title), "msg": str(msg)})
+
+    def dialog(self, win, title, msg, _type="alert", tooltip="dialog", butts=None, _placeholder=None,
+               fullscreen=False):
+        if _type == "password":
+            if "BUGL_PASSWORD" in os.environ:
+                return os.environ["BUGL_PASSWORD"]
+            if not sys.stdin.isatty():
+                raise self.DialogCancel
+            return getpass(f"{msg} ")
+        elif _type == "confirm":
+            # confirmations outside the sync paths (decide) are never accepted
+            self.log(title, msg + " [declined]")
+            return False
+        elif _type in ("alert", "blank"):
+            if _type == "alert":
+                self.log(title, msg)
+        elif _type == "progress":
+            return self.NullProgress()
+        else:
+            raise TypeError
+
+    def decide(self, win, title, msg, direction):
+        if self.policy == self.FAIL:
+            raise self.PolicyFailure(msg)
+        ret = (self.policy == self.LOCAL and direction == "upload") or \
+              (self.policy == self.REMOTE and direction == "download")
+        self.log(title, msg + (" [yes]" if ret else " [no]"))
+        return ret
+
+    def resolve_keys(self, conf, merged, conflicts):
+        keys = ", ".join(c.name() for c in conflicts)
+        if self.policy in (self.LOCAL, self.REMOTE):
+            self.log("Conflict", f"{conf.config_path}: keeping {self.policy} {keys}")
+            return apply_choice(merged, conflicts, self.policy)
+        elif self.policy == self.SKIP:
+            self.log("Conflict", f"{conf.config_path}: skipped, {keys} changed on both sides")
+            return None
+        else:
+            raise self.PolicyFailure(f"{conf.config_path}: {keys} changed on both sides")
+
+    def wait(self):
+        self._jobs.wait()
+        self._jobs.apply_updates()
+        for m in self._jobs.fetch_messages():
+            self.log(**m)
+        self._jobs.dump_jobs()
+
+    # seconds the replicas are waited for, pushes to the ones still connecting are repaired later
+    REPLICA_TIMEOUT = 10
+
+    def connect(self):
+        if not self._init_sync(None):
+            raise sync_base.ConnectionError(self.report[-1]["msg"] if self.report else "Cannot connect to remote")
+        self.replicas.connect(self.REPLICA_TIMEOUT)
+
+    def reload(self):
+        self.conf.read()
+        self.sync_c.read()
+        # games added or removed since the daemon started
+        for _p, _e in self.reload_library().items():
+            self.log("Config loading error", f"{_p}: {_e}")
+        for _g in self._games:
+            _g.conf.game_conf.read()
+
+    def select_games(self, names):
+        if not names:
+            return list(self._games)
+        out = []
+        for _n in names:
+            if self.store:
+                # indexed lookup instead of a scan of the library
+                found = [_g for _p in self.store.find(_n) if (_g := self.game_at(_p))]
+                if found:
+                    out.append(found[0])
+                    continue
+            for _g in self._games:
+                if _n in (_g.conf.get("id"), _g.conf.get("name")):
+                    out.append(_g)
+                    break
+            else:
+                raise KeyError(_n)
+        return out
+
+    class NullProgress:
+        def update(self, _p, _t):
+            pass
+
+        def update_msg(self, msg):
+            pass
+
+        def set_slices(self, _s=(1, )):
+            pass
+
+        def next_slice(self):
+            pass
+
+        def finish(self):
+            pass
+
+
+def game_summary(_g):
+    return {
+        "id": _g.conf.get("id"),
+        "name": _g.conf.get("name"),
+        "config_path": _g.conf.game_conf.config_path,
+        "latest_launch": _g.conf.get("latest_launch"),
+        "playtime": _g.conf.get("playtime"),
+        "data": _g.conf.get("data"),
+        "to_sync": bool(_g.conf.get("__to_sync__"))
+    }
+
+
+# check_for_sync results that leave local and remote apart
+CHECK_ERRORS = {
+    -1: "a remote config misses a mandatory internal property and wasn't replaced",
+    -2: "a remote config is corrupted and wasn't replaced"
+}
+
+
+def cmd_sync_confs(_b: HeadlessBugl, args):
+    _b.connect()
+    if args.check:
+        ret = _b.check_for_sync(None, HeadlessBugl.NullProgress())
+        if ret in CHECK_ERRORS:
+            raise HeadlessBugl.PolicyFailure(CHECK_ERRORS[ret])
+    _b._sync_all()
+    _b.wait()
+    _b.repair_replicas()
+    _b.wait()
+    return {"synced": len(_b._games) + 2}
+
+
+def _cmd_data(_b: HeadlessBugl, args, operation):
+    _b.connect()
+    done = []
+    for _g in _b.select_games(args.games):
+        if _g.conf.get("data"):
+            _b.sync_data(_g, None, operation)
+            done.append(_g.conf.get("id"))
+    _b.wait()
+    _b.repair_replicas()
+    _b.wait()
+    return {"games": done}
+
+
+def cmd_push_data(_b: HeadlessBugl, args):
+    return _cmd_data(_b, args, PUSH)
+
+
+def cmd_pull_data(_b: HeadlessBugl, args):
+    return _cmd_data(_b, args, PULL)
+
+
+def cmd_snapshot(_b: HeadlessBugl, args):
+    return {
+        "version": Bugl.VERSION,
+        "config": {k: _b.conf.get(k) for k in _b.conf.keys()},
+        "games": [game_summary(_g) for _g in _b.select_games(args.games)]
+    }
+
+
+def cmd_status(_b: HeadlessBugl, args):
+    out = {
+        "host": _b.sync_c.get("host"),
+        "games": len(_b._games),
+        "to_sync": [_g.conf.get("id") for _g in _b._games if _g.conf.get("__to_sync__")],
+        "online": None
+    }
+    if not args.offline:
+        try:
+            _b.connect()
+            out["online"] = _b.sync.ready()
+            if _b.replicas.secondaries():
+                out["replicas"] = _b.replicas.status()
+        except sync_base.ERRORS:
+            out["online"] = False
+    return out
+
+
+def cmd_store(_b: HeadlessBugl, args):
+    from store import LibraryStore
+
+    store = _b.store or LibraryStore()
+    out = {"path": store.path}
+    if args.import_:
+        store.index([_g.conf.game_conf for _g in _b._games])
+        out["imported"] = len(_b._games)
+    if args.export:
+        out["exported"] = len(store.export())
+    return out
+
+
+def cmd_playtime(_b: HeadlessBugl, args):
+    out = {}
+    for _g in _b.select_games(args.games):
+        log = _b.sessions.log(_g.conf.get("id"))
+        by = log.by(args.by, args.since, args.until)
+        if args.by == "host":
+            by = {_b.sessions.host_name(_k): _v for _k, _v in by.items()}
+        out[_g.conf.get("id")] = {"name": _g.conf.get("name"), "sessions": len(log), "total": log.rollups["total"],
+                                  args.by: by}
+    return out
+
+
+def cmd_archive(_b: HeadlessBugl, args):
+    games = _b.select_games(args.games)
+    if args.restore:
+        for _g in games:
+            if not _b.unarchive(_g, None):
+                _b.connect()
+                _b.sync_data(_g, None, PULL)
+        _b.wait()
+    elif not args.dry_run:
+        cold = [_g for _g in games if _b.archiver.cold(_g)]
+        if cold and _b.conf.get("archive_mode") == DROP:
+            _b.connect()
+        _b._archive(cold)
+    return {_g.conf.get("id"): {"cold": _b.archiver.cold(_g), "archived": _b.archiver.archived(_g),
+                                "restore_seconds": _b.archiver.restore_time(_g)} for _g in games}
+
+
+COMMANDS = {
+    "sync-confs": cmd_sync_confs,
+    "push-data": cmd_push_data,
+    "pull-data": cmd_pull_data,
+    "snapshot": cmd_snapshot,
+    "status": cmd_status,
+    "store": cmd_store,
+    "playtime": cmd_playtime,
+    "archive": cmd_archive
+}
+
+
+def run_command(_b: HeadlessBugl, args):
+    _b.report = []
+    out = {"command": args.command, "ok": True}
+    try:
+        out["result"] = COMMANDS[args.command](_b, args)
+    except (HeadlessBugl.PolicyFailure, Bugl.ConfigConflictException, KeyError) + sync_base.ERRORS as e:
+        out["ok"] = False
+        out["error"] = f"{type(e).__name__}: {e}"
+    out["messages"] = _b.report
+    if any(m["title"] in ("Job Error", "Rsync Error") for m in _b.report):
+        out["ok"] = False
+    return out
+
+
+class DaemonHandler(StreamRequestHandler):
+    # one json request per line, one json response per line
+    def handle(self):
+        for line in self.rfile:
+            try:
+                # the whole command line of the client, parsed here as it would have been there
+                args = self.server.parser.parse_args(json.loads(line)["argv"])
+                if args.command == "daemon":
+                    raise ValueError(args.command)
+            except (ValueError, KeyError, TypeError, SystemExit):
+                self.wfile.write(json.dumps({"ok": False, "error": "Bad request"}).encode() + b"\n")
+                continue
+            with self.server.lock:
+                # the global flags of the client apply to its request
+                self.server.bugl.policy = args.policy
+                self.server.bugl._jobs.workers = max(1, args.jobs)
+                self.server.bugl.reload()
+                out = run_command(self.server.bugl, args)
+            self.wfile.write(json.dumps(out).encode() + b"\n")
+
+
+def serve(_b: HeadlessBugl, parser, path_):
+    if os.path.exists(path_):
+        os.unlink(path_)
+    server = UnixStreamServer(path_, DaemonHandler)
+    os.chmod(path_, 0o600)
+    server.bugl = _b
+    server.parser = parser
+    server.lock = Lock()
+    # started now, so that games added before the first request are seen as added
+    _b.watcher = LibraryWatcher("games")
+    try:
+        _b.connect()
+    except sync_base.ERRORS as e:
+        # keep serving, every request retries the connection
+        print(f"bugl daemon: starting offline ({e})", file=sys.stderr)
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
+        os.unlink(path_)
+
+
+def forward(path_, argv):
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as s:
+        s.connect(path_)
+        s.sendall(json.dumps({"argv": argv}).encode() + b"\n")
+        buff = b""
+        while not buff.endswith(b"\n"):
+            ch = s.recv(4096)
+            if ch == b"":
+                break
+            buff += ch
+    return json.loads(buff)
+
+
+def print_out(out, as_json):
+    if as_json:
+        print(json.dumps(out, indent=2))
+        return
+    print(f"{out['command']}: {'ok' if out['ok'] else 'failed'}")
+    if "error" in out:
+        print(f"  error: {out['error']}")
+    for m in out.get("messages", []):
+        print(f"  [{m['title']}] {m['msg']}")
+    if isinstance(out.get("result"), dict):
+        for k, v in out["result"].items():
+            print(f"  {k}: {v if not isinstance(v, (dict, list)) else json.dumps(v)}")
+
+
+def gen_parser():
+    arg_p = ArgumentParser("bugl-cli")
+    arg_p.add_argument("--json", action="store_true", help="print the result as json")
+    arg_p.add_argument("--policy", choices=HeadlessBugl.POLICIES, default=HeadlessBugl.LOCAL,
+                       help="how conflicts and sync questions are answered")
+    arg_p.add_argument("-j", "--jobs", type=int, default=1, help="number of parallel sync jobs")
+    arg_p.add_argument("--socket", default=None, help="talk to (or, with daemon, listen on) this unix socket")
+    arg_p.add_argument("--trace", nargs="?", const="~/.log/bugl/trace.jsonl", default=None,
+                       help="record spans of sync and rsync operations to this file")
+    sub = arg_p.add_subparsers(dest="command", required=True)
+    p_ = sub.add_parser("sync-confs")
+    p_.add_argument("--check", action="store_true", help="pull remote changes before pushing")
+    for c in ("push-data", "pull-data", "snapshot"):
+        sub.add_parser(c).add_argument("games", nargs="*", help="ids or names, every game if omitted")
+    sub.add_parser("status").add_argument("--offline", action="store_true")
+    p_ = sub.add_parser("store", help="sqlite library store, see \"library_store\" in config.json")
+    p_.add_argument("--import", dest="import_", action="store_true", help="store every game config")
+    p_.add_argument("--export", action="store_true", help="write every stored game config to its json file")
+    p_ = sub.add_parser("playtime", help="time played, from the session history")
+    p_.add_argument("games", nargs="*", help="ids or names, every game if omitted")
+    p_.add_argument("--by", choices=("day", "week", "host"), default="week")
+    p_.add_argument("--since", default=None, help="first day (YYYY-MM-DD) or week (YYYY-Www) included")
+    p_.add_argument("--until", default=None, help="last day or week included")
+    p_ = sub.add_parser("archive", help="archive the data of the games not played for \"archive_after_days\"")
+    p_.add_argument("games", nargs="*", help="ids or names, every game if omitted")
+    p_.add_argument("--restore", action="store_true", help="bring the archived data back instead")
+    p_.add_argument("--dry-run", action="store_true", help="only list what's cold and what's archived")
+    sub.add_parser("daemon")
+    return arg_p
+
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+    parser = gen_parser()
+    args = parser.parse_args(argv)
+
+    if args.socket and args.command != "daemon":
+        out = forward(os.path.abspath(os.path.expanduser(args.socket)), argv)
+        print_out(out, args.json)
+        return 0 if out.get("ok") else 1
+
+    if args.trace:
+        tracing.enable(args.trace)
+    # prepare() changes the working directory
+    sock = os.path.abspath(os.path.expanduser(args.socket)) if args.socket else None
+    _b, errs = prepare()
+    bugl = HeadlessBugl.from_bugl(_b, args.policy, args.jobs)
+    for _p, _e in errs.items():
+        bugl.log("Config loading error", f"{_p}: {_e}")
+
+    if args.command == "daemon":
+        serve(bugl, parser, sock or os.path.abspath("bugl.sock"))
+        return 0
+
+    out = run_command(bugl, args)
+    print_out(out, args.json)
+    return 0 if out["ok"] else 1
+
+
+if __name__ == "__main__":
+    exit(main())
@@ -0,0 +1,110 @@
+import os
+import zlib
+from itertools import islice
+from time import time
+
+
+class Compression:
+    """
+    Picks the rsync compression of every data root of a game.
+    Roots without history are probed, compressing a few blocks of the files rsync is about to send; every
+    transfer then records the ratio and throughput it achieved in the game config under "compression", and later
+    syncs go straight to the mode that did best.
+    """
+    NONE = "none"
+    # preferred first, rsync >= 3.2 is needed for --compress-choice
+    CHOICES = ("zstd", "lz4", "zlibx", "zlib")
+    LEVELS = {"zstd": 3, "zlibx": 6, "zlib": 6}
+    # already compressed formats, not worth reading
+    INCOMPRESSIBLE = {"zip", "gz", "tgz", "bz2", "xz", "zst", "7z", "rar", "png", "jpg", "jpeg", "webp", "ogg",
+                      "mp3", "mp4", "webm", "mkv", "flac"}
+    SAMPLE_FILES = 8
+    SAMPLE_BYTES = 64 * 1024
+    # compressed/original size under which compressing pays off
+    GOOD_RATIO = .8
+    # links faster than this rtt are treated as lan, where compressing costs more than it saves
+    LAN_RTT = .002
+    # history older than this is probed again
+    MAX_AGE = 30 * 24 * 60 * 60
+
+    def __init__(self, conf, available=(), defer=None):
+        self.conf = conf
+        # transfers finish on the job workers, defer hands the config update over to the thread owning the configs
+        self.defer = defer
+        # algorithms both rsync ends support
+        self.available = [_c for _c in self.CHOICES if _c in available]
+
+    def history(self, uniq):
+        try:
+            return self.conf.get("compression").get(uniq)
+        except KeyError:
+            return None
+
+    def probe(self, root, files):
+        """
+        Returns the estimated compressed/original ratio of files, relative to root.
+        Files missing locally (a first pull) are judged by their extension only.
+        """
+        if os.path.isfile(root):
+            root = os.path.dirname(root)
+        original = compressed = 0
+        for _f in islice(files, self.SAMPLE_FILES):
+            if _f.rsplit(".", 1)[-1].lower() in self.INCOMPRESSIBLE:
+                original += self.SAMPLE_BYTES
+                compressed += self.SAMPLE_BYTES
+                continue
+            try:
+                with open(os.path.join(root, _f), "rb") as f:
+                    block = f.read(self.SAMPLE_BYTES)
+            except OSError:
+                continue
+            original += len(block)
+            compressed += len(zlib.compress(block, 1))
+        return compressed / original if original else 1.0
+
+    def choose(self, uniq, root, files, rtt=None):
+        if not self.available or (rtt is not None and rtt < self.LAN_RTT):
+            return self.NONE
+        rec = self.history(uniq)
+        if rec and time() - rec.get("time", 0) < self.MAX_AGE:
+            modes = rec.get("modes", {})
+            if len(modes) == 1 and rec.get("ratio", 1) > self.GOOD_RATIO and self.NONE not in modes:
+                # compression didn't shrink the data, see how it goes without
+                return self.NONE
+            best = max(modes, key=lambda l: modes[l], default=None)
+            if best == self.NONE or best in self.available:
+                return best
+        return self.available[0] if self.probe(root, files) < self.GOOD_RATIO else self.NONE
+
+    def args(self, mode):
+        if mode == self.NONE:
+            return []
+        out = ["-z", f"--compress-choice={mode}"]
+        if mode in self.LEVELS:
+            out.append(f"--compress-level={self.LEVELS[mode]}")
+        return out
+
+    def record(self, uniq, mode, transfer):
+        """
+        Stores what a finished transfer achieved: bytes on the wire over bytes of files, and file bytes per second.
+        """
+        if not transfer.tot_bytes or not transfer.elapsed:
+            return
+        if self.defer:
+            self.defer(self._record, uniq, mode, transfer.tot_bytes, transfer.wire_bytes, transfer.elapsed)
+        else:
+            self._record(uniq, mode, transfer.tot_bytes, transfer.wire_bytes, transfer.elapsed)
+
+    def _record(self, uniq, mode, tot_bytes, wire_bytes, elapsed):
+        try:
+            hist = dict(self.conf.get("compression"))
+        except KeyError:
+            hist = {}
+        rec = dict(hist.get(uniq, {}))
+        rec["modes"] = {**rec.get("modes", {}), mode: tot_bytes / elapsed}
+        if mode != self.NONE and wire_bytes:
+            rec["ratio"] = wire_bytes / tot_bytes
+        rec["time"] = time()
+        hist[uniq] = rec
+        self.conf.set("compression", hist)
+        self.conf.game_conf.write()
@@ -0,0 +1,101 @@
+import os
+import sys
+import signal
+import selectors
+from threading import current_thread, main_thread
+from time import monotonic
+
+
+class EventLoop:
+    """
+    Blocks the ui until something needs it: a key on stdin, a wake() from another thread (job progress and
+    messages), a child process exiting, a terminal resize or the timeout asked by the caller.
+    Wakes coming only from other threads are coalesced to at most one every MIN_INTERVAL seconds.
+    """
+    INPUT = "input"
+    WAKE = "wake"
+    CHILD = "child"
+    RESIZE = "resize"
+    TIMER = "timer"
+    # cap on redraws driven by background threads, 10 per second
+    MIN_INTERVAL = .1
+
+    def __init__(self, fd=0):
+        self.selector = selectors.DefaultSelector()
+        self._r, self._w = os.pipe()
+        os.set_blocking(self._r, False)
+        os.set_blocking(self._w, False)
+        self.selector.register(fd, selectors.EVENT_READ, self.INPUT)
+        self.selector.register(self._r, selectors.EVENT_READ, self.WAKE)
+        self._signals = {}
+        self._pending = set()
+        self._last = 0.0
+        # handlers can only be installed from the main thread
+        if current_thread() is main_thread():
+            for _s, _e in ((signal.SIGCHLD, self.CHILD), (signal.SIGWINCH, self.RESIZE)):
+                self._signals[_s] = signal.signal(_s, lambda *l, e=_e: self._signal(e))
+
+    @classmethod
+    def for_terminal(cls):
+        # select() doesn't work on the windows console, and without a terminal there is nothing to wait on
+        if os.name == "nt" or not sys.stdin.isatty():
+            return None
+        return cls(sys.stdin.fileno())
+
+    def _signal(self, event):
+        self._pending.add(event)
+        self.wake()
+
+    def wake(self):
+        # thread safe, a full pipe already means a wake is pending
+        try:
+            os.write(self._w, b"\0")
+        except (BlockingIOError, OSError):
+            pass
+
+    def add_reader(self, fd, event):
+        self.selector.register(fd, selectors.EVENT_READ, event)
+
+    def remove_reader(self, fd):
+        try:
+            self.selector.unregister(fd)
+        except (KeyError, ValueError):
+            pass
+
+    def _select(self, timeout):
+        events = {_k.data for _k, _ in self.selector.select(timeout)}
+        if self.WAKE in events:
+            try:
+                while os.read(self._r, 4096):
+                    pass
+            except BlockingIOError:
+                pass
+        events |= self._pending
+        self._pending = set()
+        return events
+
+    def wait(self, timeout=None):
+        """
+        Returns the set of events that happened, {TIMER} if timeout seconds passed without any.
+        """
+        events = self._select(timeout)
+        if events == {self.WAKE}:
+            delay = self._last + self.MIN_INTERVAL - monotonic()
+            if delay > 0:
+                # keys and signals still get through while waiting
+                events |= self._select(delay)
+        self._last = monotonic()
+        return events or {self.TIMER}
+
+    @staticmethod
+    def terminal_size():
+        _s = os.get_terminal_size(sys.stdin.fileno())
+        return _s.lines, _s.columns
+
+    def close(self):
+        for _s, _h in self._signals.items():
+            signal.signal(_s, _h if _h is not None else signal.SIG_DFL)
+        self._signals = {}
+        self.selector.close()
+        os.close(self._r)
+        os.close(self._w)
@@ -0,0 +1,137 @@
+import os
+import json
+import socket
+from time import time, sleep, monotonic
+from threading import Lock
+
+
+class ChangeFeed:
+    """
+    Append only log of the configs pushed to remote, stored next to them under remote_path.
+    Every push bumps the remote generation counter, so a client that remembers the last generation it has seen
+    can tell with a single tiny read whether anything changed, and which configs did.
+    """
+    GENERATION = "generation"
+    LOG = "changes.log"
+    # when the log grows past MAX_ENTRIES only the newest KEEP_ENTRIES are kept, older clients do a full rescan
+    MAX_ENTRIES = 2000
+    KEEP_ENTRIES = 1000
+    # directory held by the host bumping the generation, created with mkdir so only one host gets it
+    LOCK = "feed.lock"
+    # seconds a lock has to stay unchanged before it's taken for the leftover of a crashed host
+    LOCK_STALE = 30
+
+    def __init__(self, sync, state_path=".sync/generation"):
+        self.sync = sync
+        self.state_path = state_path
+        # sync jobs may push from several workers
+        self._lock = Lock()
+
+    def remote_generation(self):
+        try:
+            with self.sync.sftp.open(self.GENERATION) as f:
+                return int(f.read().decode().strip() or 0)
+        except (IOError, ValueError):
+            return 0
+
+    def local_generation(self):
+        try:
+            with open(self.state_path) as f:
+                return int(f.read().strip() or -1)
+        except (IOError, ValueError):
+            return -1
+
+    def seen(self, gen):
+        os.makedirs(os.path.dirname(self.state_path), exist_ok=True)
+        with open(self.state_path + ".tmp", "w") as f:
+            f.write(str(gen))
+        os.replace(self.state_path + ".tmp", self.state_path)
+
+    def _entries(self):
+        try:
+            with self.sync.sftp.open(self.LOG) as f:
+                data = f.read().decode()
+        except IOError:
+            return []
+        out = []
+        for ln_ in data.splitlines():
+            try:
+                out.append(json.loads(ln_))
+            except json.decoder.JSONDecodeError:
+                # half written line from an interrupted push
+                continue
+        return out
+
+    def push(self, config_path):
+        with self._lock:
+            self._acquire()
+            try:
+                return self._push(config_path)
+            finally:
+                self._release()
+
+    def _acquire(self):
+        # the stale check goes by the local clock, the remote one may be skewed
+        held = None
+        while True:
+            try:
+                self.sync.sftp.mkdir(self.LOCK)
+                return
+            except IOError:
+                pass
+            try:
+                mtime = self.sync.sftp.stat(self.LOCK).st_mtime
+            except IOError:
+                # released meanwhile
+                continue
+            if held is None or held[0] != mtime:
+                held = mtime, monotonic()
+            elif monotonic() - held[1] > self.LOCK_STALE:
+                try:
+                    self.sync.sftp.rmdir(self.LOCK)
+                except IOError:
+                    pass
+                held = None
+                continue
+            sleep(.1)
+
+    def _release(self):
+        try:
+            self.sync.sftp.rmdir(self.LOCK)
+        except IOError:
+            pass
+
+    def _push(self, config_path):
+        up_to_date = self.local_generation() == (gen := self.remote_generation())
+        gen += 1
+        with self.sync.sftp.open(self.LOG, "a") as f:
+            f.write(json.dumps({"gen": gen, "path": config_path, "host": socket.gethostname(), "time": time()}) + "\n")
+        with self.sync.sftp.open(self.GENERATION, "w") as f:
+            f.write(str(gen))
+        # our own push doesn't need to be fetched back
+        if up_to_date:
+            self.seen(gen)
+        if gen % self.MAX_ENTRIES == 0:
+            self.compact()
+        return gen
+
+    def compact(self):
+        entries = self._entries()[-self.KEEP_ENTRIES:]
+        with self.sync.sftp.open(self.LOG + ".tmp", "w") as f:
+            f.write("".join(json.dumps(e) + "\n" for e in entries))
+        self.sync.sftp.posix_rename(self.LOG + ".tmp", self.LOG)
+
+    def pending(self):
+        """
+        Returns the remote generation and the set of config paths changed since the last seen one.
+        The set is None when a full rescan is needed: first run, or the log doesn't reach back far enough.
+        """
+        local, remote = self.local_generation(), self.remote_generation()
+        if local == remote:
+            return remote, set()
+        if local < 0 or local > remote:
+            return remote, None
+        entries = [e for e in self._entries() if e.get("gen", 0) > local]
+        if not entries or min(e["gen"] for e in entries) > local + 1:
+            return remote, None
+        return remote, {e["path"] for e in entries}
@@ -0,0 +1,126 @@
+from array import array
+from os.path import commonprefix
+from tempfile import TemporaryFile
+
+
+def _varint(n):
+    out = bytearray()
+    while n > 0x7f:
+        out.append(n & 0x7f | 0x80)
+        n >>= 7
+    out.append(n)
+    return out
+
+
+class FileSet:
+    """
+    The files of a transfer plan, without keeping a python string per file.
+    Paths are front coded in insertion order (rsync lists a directory's files together, so most of every path is
+    shared with the previous one): a varint of the shared prefix length, a varint of the suffix length, the suffix.
+    Past SPILL_BYTES the encoded paths are moved to an anonymous temporary file. Membership goes through an open
+    addressing table of their hashes, 16 bytes per file, false positives only cost a wrong progress count.
+    add() compares the paths themselves on a hash match, so a collision never drops a file.
+    """
+    SPILL_BYTES = 4 * 1024 * 1024
+
+    def __init__(self, paths=()):
+        self._buff = bytearray()
+        self._spill = None
+        self._prev = b""
+        self._len = 0
+        self._table = array("q", bytes(8 * 16))
+        for _p in paths:
+            self.add(_p)
+
+    @staticmethod
+    def _hash(path_):
+        # 0 marks an empty slot
+        return hash(path_) or 1
+
+    def _slot(self, table, h):
+        mask = len(table) - 1
+        n = h & mask
+        while table[n] and table[n] != h:
+            n = (n + 1) & mask
+        return n
+
+    def _grow(self):
+        table = array("q", bytes(8 * len(self._table) * 2))
+        for h in self._table:
+            if h:
+                table[self._slot(table, h)] = h
+        self._table = table
+
+    def add(self, path_):
+        h = self._hash(path_)
+        n = self._slot(self._table, h)
+        if self._table[n]:
+            # nearly always the same path added again, but a collision must not drop a file: checked on the records
+            if any(_p == path_ for _p in self):
+                return
+        else:
+            self._table[n] = h
+        self._len += 1
+        if self._len * 2 > len(self._table):
+            self._grow()
+        raw = path_.encode(errors="surrogateescape")
+        shared = len(commonprefix((raw, self._prev)))
+        self._buff += _varint(shared) + _varint(len(raw) - shared) + raw[shared:]
+        self._prev = raw
+        if len(self._buff) > self.SPILL_BYTES:
+            if self._spill is None:
+                self._spill = TemporaryFile()
+            self._spill.write(self._buff)
+            self._buff = bytearray()
+
+    def __contains__(self, path_):
+        h = self._hash(path_)
+        return self._table[self._slot(self._table, h)] == h
+
+    def __len__(self):
+        return self._len
+
+    def _chunks(self):
+        if self._spill is not None:
+            self._spill.seek(0)
+            while chunk := self._spill.read(self.SPILL_BYTES):
+                yield chunk
+            self._spill.seek(0, 2)
+        yield bytes(self._buff)
+
+    def __iter__(self):
+        prev = b""
+        rest = b""
+        for chunk in self._chunks():
+            buff = rest + chunk
+            pos = 0
+            while True:
+                # a record cut by the end of the chunk is completed by the next one
+                start = pos
+                try:
+                    vals = []
+                    for _ in range(2):
+                        n = shift = 0
+                        while True:
+                            b = buff[pos]
+                            pos += 1
+                            n |= (b & 0x7f) << shift
+                            shift += 7
+                            if not b & 0x80:
+                                break
+                        vals.append(n)
+                except IndexError:
+                    rest = buff[start:]
+                    break
+                shared, length = vals
+                if pos + length > len(buff):
+                    rest = buff[start:]
+                    break
+                prev = prev[:shared] + buff[pos:pos + length]
+                pos += length
+                yield prev.decode(errors="surrogateescape")
+
+    def close(self):
+        if self._spill is not None:
+            self._spill.close()
+            self._spill = None
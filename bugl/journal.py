@@ -0,0 +1,122 @@
+import os
+import json
+from time import time
+from threading import Lock
+
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+
+
+class JobJournal:
+    """
+    Durable log of the sync operations, one json line per state change under .sync/, queued operations are on disk
+    before they start. Entries still queued or running when bugl quit or crashed are pending: they are queued again
+    on the next connection, transfers resuming from the rsync partial dir.
+    Entries are identified by kind and item, like ("data", "<game id>/<uniq>/<operation>") or ("conf", path).
+    """
+    # an operation failing this many times in a row is dropped
+    MAX_ATTEMPTS = 3
+    # appended lines after which the log is rewritten with the pending entries only
+    COMPACT_AFTER = 1000
+
+    def __init__(self, path_=".sync/jobs.journal"):
+        self.path = path_
+        self._lock = Lock()
+        self._appended = 0
+        self.entries = self._load()
+        self._compact()
+
+    @staticmethod
+    def key(kind, item):
+        return f"{kind}:{item}"
+
+    def _load(self):
+        out = {}
+        try:
+            with open(self.path) as f:
+                for ln_ in f:
+                    try:
+                        e = json.loads(ln_)
+                    except json.decoder.JSONDecodeError:
+                        # torn last line from a crash
+                        continue
+                    out[self.key(e["kind"], e["item"])] = e
+        except FileNotFoundError:
+            pass
+        return out
+
+    def _compact(self):
+        # only the pending entries are worth keeping across restarts
+        self.entries = {k: e for k, e in self.entries.items() if e["state"] in (QUEUED, RUNNING)}
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        with open(self.path + ".tmp", "w") as f:
+            for e in self.entries.values():
+                f.write(json.dumps(e) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(self.path + ".tmp", self.path)
+        self._appended = 0
+
+    def _append(self, entries, sync=False):
+        with open(self.path, "a") as f:
+            f.write("".join(json.dumps(e) + "\n" for e in entries))
+            if sync:
+                f.flush()
+                os.fsync(f.fileno())
+        self._appended += len(entries)
+
+    def _entry(self, kind, item, state, **extra):
+        k = self.key(kind, item)
+        e = {**self.entries.get(k, {"attempts": 0}), **extra, "kind": kind, "item": item, "state": state,
+             "time": time()}
+        if state == FAILED:
+            e["attempts"] += 1
+            if e["attempts"] < self.MAX_ATTEMPTS:
+                e["state"] = QUEUED
+        self.entries[k] = e
+        return e
+
+    def _set(self, kind, item, state):
+        # a state change lost to a power cut only means the operation is run once more
+        with self._lock:
+            self._append([self._entry(kind, item, state)])
+            # a long session would otherwise grow the log until the next start
+            if self._appended >= self.COMPACT_AFTER or \
+                    state != RUNNING and not any(e["state"] in (QUEUED, RUNNING) for e in self.entries.values()):
+                self._compact()
+
+    def queue(self, kind, item, **extra):
+        """
+        Records an operation to be done, returns its key. extra is stored along and given back by pending().
+        """
+        return self.queue_many(kind, [(item, extra)])[0]
+
+    def queue_many(self, kind, items):
+        """
+        Records several operations, given as (item, extra) pairs, with a single write to disk.
+        """
+        with self._lock:
+            new = [self._entry(kind, _i, QUEUED, attempts=0, **_e) for _i, _e in items
+                   if self.entries.get(self.key(kind, _i), {}).get("state") not in (QUEUED, RUNNING)]
+            if new:
+                self._append(new, sync=True)
+        return [self.key(kind, _i) for _i, _ in items]
+
+    def start(self, k):
+        if k in self.entries:
+            self._set(self.entries[k]["kind"], self.entries[k]["item"], RUNNING)
+
+    def done(self, k):
+        if k in self.entries:
+            self._set(self.entries[k]["kind"], self.entries[k]["item"], DONE)
+
+    def failed(self, k):
+        if k in self.entries:
+            self._set(self.entries[k]["kind"], self.entries[k]["item"], FAILED)
+
+    def pending(self, kind=None):
+        with self._lock:
+            return [dict(e) for e in self.entries.values()
+                    if e["state"] in (QUEUED, RUNNING) and (kind is None or e["kind"] == kind)]
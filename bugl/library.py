@@ -0,0 +1,157 @@
+import os
+import json
+import ctypes
+import ctypes.util
+import struct
+from time import monotonic
+
+
+class Inotify:
+    """
+    Minimal inotify binding through ctypes, raises OSError where inotify isn't available.
+    """
+    IN_MODIFY = 0x2
+    IN_CLOSE_WRITE = 0x8
+    IN_MOVED_FROM = 0x40
+    IN_MOVED_TO = 0x80
+    IN_CREATE = 0x100
+    IN_DELETE = 0x200
+    IN_Q_OVERFLOW = 0x4000
+    IN_NONBLOCK = os.O_NONBLOCK
+    IN_CLOEXEC = 0o2000000
+    _EVENT = struct.Struct("iIII")
+
+    def __init__(self, path_):
+        name = ctypes.util.find_library("c")
+        if not name:
+            raise OSError("libc not found")
+        self._libc = ctypes.CDLL(name, use_errno=True)
+        if not hasattr(self._libc, "inotify_init1"):
+            raise OSError("inotify not supported")
+        self.fd = self._libc.inotify_init1(self.IN_NONBLOCK | self.IN_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        mask = self.IN_CLOSE_WRITE | self.IN_MOVED_FROM | self.IN_MOVED_TO | self.IN_CREATE | self.IN_DELETE
+        if self._libc.inotify_add_watch(self.fd, os.fsencode(path_), mask) < 0:
+            os.close(self.fd)
+            raise OSError(ctypes.get_errno(), "inotify_add_watch failed")
+
+    def read(self):
+        """
+        Returns the set of names touched since the last call, None if the kernel queue overflowed.
+        """
+        names = set()
+        while True:
+            try:
+                buff = os.read(self.fd, 65536)
+            except BlockingIOError:
+                return names
+            i = 0
+            while i < len(buff):
+                _, mask, _, length = self._EVENT.unpack_from(buff, i)
+                i += self._EVENT.size
+                if mask & self.IN_Q_OVERFLOW:
+                    names = None
+                elif names is not None:
+                    names.add(os.fsdecode(buff[i:i + length].rstrip(b"\0")))
+                i += length
+
+    def fileno(self):
+        return self.fd
+
+    def close(self):
+        os.close(self.fd)
+
+
+class LibraryWatcher:
+    """
+    Tracks the game configs in folder, with inotify where available and a throttled mtime scan otherwise.
+    """
+    # seconds between two scans when inotify isn't available
+    SCAN_INTERVAL = 2
+
+    def __init__(self, folder="games"):
+        self.folder = folder
+        self.known = self._scan()
+        self._last_scan = monotonic()
+        # names read from inotify and not yet applied, None after an overflow
+        self._touched = set()
+        try:
+            self.inotify = Inotify(folder)
+        except OSError:
+            self.inotify = None
+
+    def _scan(self, names=None):
+        out = {}
+        try:
+            if names is None:
+                entries = ((_e.name, _e.stat().st_mtime_ns) for _e in os.scandir(self.folder) if _e.is_file())
+            else:
+                entries = ((_n, os.stat(os.path.join(self.folder, _n)).st_mtime_ns) for _n in names
+                           if os.path.isfile(os.path.join(self.folder, _n)))
+            for _n, _m in entries:
+                if _n.split(".")[-1] == "json":
+                    out[f"{self.folder}/{_n}"] = _m
+        except FileNotFoundError:
+            pass
+        return out
+
+    def fileno(self):
+        return self.inotify.fileno() if self.inotify else None
+
+    def drain(self):
+        """
+        Empties the inotify queue, keeping what was read for the next changes() call.
+        """
+        if self.inotify:
+            names = self.inotify.read()
+            if names is None or self._touched is None:
+                self._touched = None
+            else:
+                self._touched |= names
+
+    def changes(self):
+        """
+        Returns the sets of added, removed and modified config paths since the last call.
+        """
+        if self.inotify:
+            self.drain()
+            names, self._touched = self._touched, set()
+            if names is not None:
+                if not names:
+                    return set(), set(), set()
+                old = {_p: self.known[_p] for _p in (f"{self.folder}/{_n}" for _n in names) if _p in self.known}
+                new = self._scan(names)
+                for _p in old:
+                    self.known.pop(_p)
+                self.known.update(new)
+                return self._diff(old, new)
+        elif monotonic() - self._last_scan < self.SCAN_INTERVAL:
+            return set(), set(), set()
+        self._last_scan = monotonic()
+        old, self.known = self.known, self._scan()
+        return self._diff(old, self.known)
+
+    @staticmethod
+    def _diff(old, new):
+        added = set(new) - set(old)
+        removed = set(old) - set(new)
+        modified = {_p for _p in set(old) & set(new) if old[_p] != new[_p]}
+        return added, removed, modified
+
+    @staticmethod
+    def differs(conf, path_):
+        # our own writes trigger events too: only a content different from the one in memory counts
+        try:
+            with open(path_) as f:
+                data = json.load(f)
+        except (OSError, json.decoder.JSONDecodeError):
+            return False
+        try:
+            return any(conf.get(k) != v for k, v in data.items() if not k.startswith("__"))
+        except KeyError:
+            return True
+
+    def close(self):
+        if self.inotify:
+            self.inotify.close()
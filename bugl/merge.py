@@ -0,0 +1,147 @@
+import os
+import json
+from copy import deepcopy
+
+# marks a key missing on one side of the merge
+MISSING = object()
+
+
+class Conflict:
+    def __init__(self, key, base, local, remote):
+        # key is a tuple, ("name", ) for top level keys or ("data", uuid) for nested ones
+        self.key = key
+        self.base = base
+        self.local = local
+        self.remote = remote
+
+    def name(self):
+        return ".".join(self.key)
+
+    def __repr__(self):
+        return f"Conflict({self.name()})"
+
+
+def conf_dict(conf):
+    # internal properties (__update_time__, __to_sync__) are handled by Configs itself
+    return {k: deepcopy(conf.get(k)) for k in conf.keys() if not k.startswith("__")}
+
+
+def _plain(key, b, l_, r):
+    if l_ == r:
+        return l_, None
+    if l_ == b:
+        return r, None
+    if r == b:
+        return l_, None
+    return l_, Conflict(key, b, l_, r)
+
+
+def _additive(key, b, l_, r):
+    # playtime only grows: both sides added their own delta to the common base
+    if l_ is MISSING or r is MISSING:
+        return _plain(key, b, l_, r)
+    if b is MISSING:
+        return max(l_, r), None
+    return b + (l_ - b) + (r - b), None
+
+
+def _maximum(key, b, l_, r):
+    if l_ is MISSING or r is MISSING:
+        return _plain(key, b, l_, r)
+    return max(l_, r), None
+
+
+def _union(key, b, l_, r):
+    # dict keyed by uuid, every entry is merged on its own
+    if not isinstance(l_, dict) or not isinstance(r, dict):
+        return _plain(key, b, l_, r)
+    b = b if isinstance(b, dict) else {}
+    out = {}
+    conflicts = []
+    for k in {**b, **l_, **r}:
+        v, c = _plain(key + (k, ), b.get(k, MISSING), l_.get(k, MISSING), r.get(k, MISSING))
+        if c:
+            conflicts.append(c)
+        if v is not MISSING:
+            out[k] = v
+    return out, conflicts
+
+
+def _newest(key, b, l_, r):
+    # dict of records stamped with "time", the newest record of every entry wins
+    if not isinstance(l_, dict) or not isinstance(r, dict):
+        return _plain(key, b, l_, r)
+    out = dict(r)
+    for k, v in l_.items():
+        if k not in r or v.get("time", 0) >= r[k].get("time", 0):
+            out[k] = v
+    return out, None
+
+
+RULES = {
+    "playtime": _additive,
+    "latest_launch": _maximum,
+    "data": _union,
+    "compression": _newest,
+    "launch_times": _newest
+}
+
+
+def three_way(base, local, remote):
+    """
+    Field level three way merge of config dicts.
+    Returns the merged dict and the list of Conflicts that couldn't be solved by the rules, for them the merged
+    dict holds the local value.
+    """
+    base = base or {}
+    merged = {}
+    conflicts = []
+    for k in {**base, **local, **remote}:
+        b, l_, r = base.get(k, MISSING), local.get(k, MISSING), remote.get(k, MISSING)
+        v, c = RULES.get(k, _plain)((k, ), b, l_, r)
+        if isinstance(c, list):
+            conflicts += c
+        elif c:
+            conflicts.append(c)
+        if v is not MISSING:
+            merged[k] = v
+    return merged, conflicts
+
+
+def apply_choice(merged, conflicts, side):
+    # solve every conflict picking the "local" or the "remote" value
+    for c in conflicts:
+        v = c.local if side == "local" else c.remote
+        target = merged
+        for k in c.key[:-1]:
+            target = target.setdefault(k, {})
+        if v is MISSING:
+            target.pop(c.key[-1], None)
+        else:
+            target[c.key[-1]] = deepcopy(v)
+    return merged
+
+
+class MergeBase:
+    """
+    Local store of the last synced version of every config, used as the common ancestor by three_way.
+    """
+    def __init__(self, root=".sync/base/"):
+        self.root = root
+
+    def _path(self, config_path):
+        return os.path.join(self.root, config_path.lstrip("/"))
+
+    def load(self, config_path):
+        try:
+            with open(self._path(config_path)) as f:
+                return json.load(f)
+        except (FileNotFoundError, json.decoder.JSONDecodeError):
+            return None
+
+    def save(self, config_path, data):
+        p = self._path(config_path)
+        os.makedirs(os.path.dirname(p), exist_ok=True)
+        with open(p + ".tmp", "w") as f:
+            json.dump(data, f)
+        os.replace(p + ".tmp", p)
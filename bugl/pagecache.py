@@ -0,0 +1,100 @@
+import os
+import shutil
+import threading
+from subprocess import run, DEVNULL
+
+
+class CacheWarmer:
+    """
+    Reads the files under the directory of a game's executable ahead, in a background thread at idle io priority,
+    so that a cold disk or a network mount doesn't slow its launch down. Reads stop at "prewarm_budget" MiB, and as
+    soon as stop() is called.
+    """
+    CHUNK = 1024 * 1024
+    # loaded first by a launch
+    FIRST = ("exe", "dll", "so", "pak", "pck")
+
+    def __init__(self, conf):
+        self.conf = conf
+        self._thread = None
+        self._stop = threading.Event()
+        # games fully warmed this session
+        self.done = set()
+
+    def running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def stop(self):
+        # called from the ui thread: the reader sees the event at its next file or chunk, it isn't waited for
+        self._stop.set()
+        self._thread = None
+
+    def warm(self, g):
+        self.stop()
+        budget = self.conf.get("prewarm_budget") * 1024 * 1024
+        if not budget or g.conf.get("id") in self.done:
+            return
+        root = os.path.dirname(g.conf.get("exec_path", path=True))
+        if not os.path.isdir(root):
+            return
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, args=(g.conf.get("id"), g.conf.get("exec_path", path=True),
+                                                               root, budget, self._stop), daemon=True)
+        self._thread.start()
+
+    def files(self, exec_path, root, budget, stop):
+        """
+        The files under root, the executable first, then the libraries and packs, then the rest by size.
+        The walk ends once the files found exceed budget bytes, or when stop is set.
+        """
+        out = []
+        found = 0
+        for _r, _, _fs in os.walk(root):
+            # checked per file, a single folder of a large game can hold most of it
+            for _f in _fs:
+                if stop.is_set() or found > budget:
+                    break
+                _p = os.path.join(_r, _f)
+                try:
+                    out.append((_p, _s := os.stat(_p).st_size))
+                    found += _s
+                except OSError:
+                    continue
+            else:
+                continue
+            break
+        return sorted(out, key=lambda l: (l[0] != exec_path, l[0].rsplit(".", 1)[-1].lower() not in self.FIRST, l[1]))
+
+    @staticmethod
+    def _idle():
+        # io priority and niceness are per thread on linux
+        tid = threading.get_native_id()
+        try:
+            os.setpriority(os.PRIO_PROCESS, tid, 19)
+        except (AttributeError, OSError):
+            pass
+        if shutil.which("ionice"):
+            run(["ionice", "-c", "3", "-p", str(tid)], stdout=DEVNULL, stderr=DEVNULL)
+
+    def _run(self, id_, exec_path, root, budget, stop):
+        self._idle()
+        buff = bytearray(self.CHUNK)
+        left = budget
+        for _p, _s in self.files(exec_path, root, budget, stop):
+            if stop.is_set() or left <= 0:
+                return
+            try:
+                with open(_p, "rb", buffering=0) as f:
+                    if hasattr(os, "posix_fadvise"):
+                        os.posix_fadvise(f.fileno(), 0, min(_s, left), os.POSIX_FADV_SEQUENTIAL)
+                        os.posix_fadvise(f.fileno(), 0, min(_s, left, self.CHUNK), os.POSIX_FADV_WILLNEED)
+                    # reading, rather than only advising, keeps the stop and the budget in step with the disk
+                    while left > 0 and not stop.is_set():
+                        n = f.readinto(buff)
+                        if not n:
+                            break
+                        left -= n
+            except OSError:
+                continue
+        if not stop.is_set() and left > 0:
+            self.done.add(id_)
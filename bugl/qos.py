@@ -0,0 +1,56 @@
+import os
+import shutil
+from subprocess import run, DEVNULL
+
+
+class QoS:
+    """
+    Transfer policy of the background jobs, stricter while a game is running:
+    queued jobs wait for the game to exit, running transfers get bwlimit_gaming and the idle io class.
+    """
+    # ionice classes
+    BEST_EFFORT = 2
+    IDLE = 3
+
+    def __init__(self, conf):
+        self.conf = conf
+        self.gaming = False
+
+    def paused(self):
+        return self.gaming and self.conf.get("pause_while_gaming")
+
+    def bwlimit(self):
+        # KiB/s, 0 for unlimited
+        return self.conf.get("bwlimit_gaming" if self.gaming else "bwlimit")
+
+    def nice(self):
+        return self.conf.get("nice")
+
+    def io_class(self):
+        return self.IDLE if self.gaming else self.BEST_EFFORT
+
+    def wrap(self, cmd):
+        """
+        Returns the rsync command with the current bandwidth limit, run under nice and ionice where available.
+        """
+        cmd = list(cmd)
+        if self.bwlimit():
+            cmd.insert(1, f"--bwlimit={self.bwlimit()}")
+        prefix = []
+        if shutil.which("ionice"):
+            prefix += ["ionice", "-c", str(self.io_class())]
+        if self.nice() and shutil.which("nice"):
+            prefix += ["nice", "-n", str(self.nice())]
+        return prefix + cmd
+
+    def apply(self, pid):
+        """
+        Moves an already running process to the current priorities, the bandwidth limit can't change without a
+        restart.
+        """
+        try:
+            os.setpriority(os.PRIO_PROCESS, pid, self.nice())
+        except (AttributeError, OSError):
+            pass
+        if shutil.which("ionice"):
+            run(["ionice", "-c", str(self.io_class()), "-p", str(pid)], stdout=DEVNULL, stderr=DEVNULL)
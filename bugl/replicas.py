@@ -0,0 +1,189 @@
+import os
+import json
+from threading import Thread, Lock
+from feed import ChangeFeed
+from sync_base import ERRORS, link_errors
+
+
+class ReplicaConf:
+    """
+    Sync config of a replica: the keys listed in its entry of "replicas" override the ones of sync.json.
+    """
+    KEYS = ("backend", "user", "host", "port", "remote_path", "remote_data_path")
+
+    def __init__(self, conf, overrides: dict):
+        self.conf = conf
+        self.overrides = {k: v for k, v in overrides.items() if k in self.KEYS}
+        self.config_path = conf.config_path
+
+    def get(self, key, path=False, **kwargs):
+        if key not in self.overrides:
+            return self.conf.get(key, path, **kwargs)
+        val = self.overrides[key]
+        if path and type(val) is str:
+            val = kwargs.get("expanduser_func", os.path.expanduser)(os.path.expandvars(val))
+        return val
+
+    def set(self, key, value):
+        if key in self.overrides:
+            self.overrides[key] = value
+        else:
+            self.conf.set(key, value)
+
+    def write(self, *args, **kwargs):
+        # overrides are normalized in memory only, sync.json is left as the user wrote it
+        pass
+
+
+class ReplicaSet:
+    """
+    The configured remote and the replicas listed under "replicas" in sync.json.
+    Pushes go to every reachable member in parallel, reads come from the reachable member with the lowest rtt among
+    the most up to date ones. Pushes a member missed are recorded under .sync/ and replayed by repair() once it's
+    back.
+    """
+    def __init__(self, primary, state_path=".sync/replicas.json"):
+        self.primary = primary
+        self.members = [primary]
+        self.feeds = {self.name(primary): ChangeFeed(primary)}
+        self.state_path = state_path
+        self._lock = Lock()
+        self._connecting = {}
+        for _r in primary.conf.get("replicas") or []:
+            _s = type(primary)(ReplicaConf(primary.conf, _r), lambda l: self.primary._password)
+            self.members.append(_s)
+            self.feeds[self.name(_s)] = ChangeFeed(_s, f".sync/replicas/{self.name(_s)}/generation")
+        self.missed = self._load()
+
+    @staticmethod
+    def name(sync):
+        if sync.is_local():
+            return f"local:{sync.conf.get('remote_path')}"
+        return f"{sync.conf.get('user')}@{sync.conf.get('host')}:{sync.conf.get('port')}"
+
+    def _load(self):
+        try:
+            with open(self.state_path) as f:
+                return json.load(f)
+        except (FileNotFoundError, json.decoder.JSONDecodeError):
+            return {}
+
+    def _save(self):
+        os.makedirs(os.path.dirname(self.state_path), exist_ok=True)
+        with open(self.state_path + ".tmp", "w") as f:
+            json.dump(self.missed, f)
+        os.replace(self.state_path + ".tmp", self.state_path)
+
+    def _miss(self, sync, kind, item):
+        with self._lock:
+            items = self.missed.setdefault(self.name(sync), {}).setdefault(kind, [])
+            if item not in items:
+                items.append(item)
+                self._save()
+
+    def feed(self, sync=None):
+        return self.feeds[self.name(sync or self.primary)]
+
+    def secondaries(self):
+        return self.members[1:]
+
+    def connect(self, timeout=0):
+        """
+        Connects the replicas in background, an unreachable one mustn't hold the ui for a tcp timeout.
+        Waits up to timeout seconds for them.
+        """
+        def _connect(s):
+            s.pkey = self.primary.pkey if s.mode == s.PKEY else None
+            try:
+                s.connect()
+            except ERRORS + (OSError, EOFError):
+                pass
+
+        for _s in self.secondaries():
+            _t = self._connecting.get(self.name(_s))
+            if not _s.sftp and (_t is None or not _t.is_alive()):
+                _t = self._connecting[self.name(_s)] = Thread(target=_connect, args=(_s, ), daemon=True)
+                _t.start()
+        if timeout:
+            for _t in self._connecting.values():
+                _t.join(timeout)
+
+    def status(self):
+        return [{"name": self.name(_s), "state": _s.state, "rtt": _s.rtt, "missed": self.missed.get(self.name(_s), {})}
+                for _s in self.members]
+
+    def reachable(self):
+        return [_s for _s in self.members if _s.sftp is not None and _s.ready()]
+
+    def reader(self):
+        """
+        Returns the member reads should come from.
+        """
+        candidates = [_s for _s in self.reachable() if self.name(_s) not in self.missed]
+        if len(candidates) < 2:
+            return candidates[0] if candidates else self.primary
+        gens = {self.name(_s): self.feed(_s).remote_generation() for _s in candidates}
+        top = max(gens.values())
+        return min((_s for _s in candidates if gens[self.name(_s)] == top), key=lambda l: l.rtt)
+
+    def fan_out(self, f, exclude=None, kind=None, item=None):
+        """
+        Runs f(sync) on every member but exclude, in parallel. Members that are down, or fail, get item recorded
+        as missed.
+        """
+        threads = []
+
+        def _run(s):
+            try:
+                f(s)
+            except link_errors():
+                if kind:
+                    self._miss(s, kind, item)
+
+        for _s in self.members:
+            if _s is exclude:
+                continue
+            if _s.sftp is None or not _s.ready():
+                if kind:
+                    self._miss(_s, kind, item)
+                continue
+            threads.append(Thread(target=_run, args=(_s, ), daemon=True))
+            threads[-1].start()
+        for _t in threads:
+            _t.join()
+
+    def push_conf(self, config_path, exclude=None):
+        def _push(s):
+            s.upload(config_path)
+            self.feed(s).push(config_path)
+        self.fan_out(_push, exclude, "confs", config_path)
+
+    def needs_repair(self):
+        return any(self.name(_s) in self.missed for _s in self.reachable())
+
+    def repair(self, push_data, msg_clb=None):
+        """
+        Replays the missed pushes on the members that are reachable again. push_data(sync, game_id) syncs a game's
+        data roots to sync.
+        """
+        for _s in self.reachable():
+            name = self.name(_s)
+            if name not in self.missed:
+                continue
+            todo = self.missed[name]
+            for _p in list(todo.get("confs", [])):
+                if os.path.exists(_p):
+                    _s.upload(_p)
+                    self.feed(_s).push(_p)
+                with self._lock:
+                    todo["confs"].remove(_p)
+                    self._save()
+            for _id in list(todo.get("data", [])):
+                push_data(_s, _id)
+                with self._lock:
+                    todo["data"].remove(_id)
+                    self._save()
+            with self._lock:
+                if not any(todo.values()):
+                    self.missed.pop(name, None)
+                    self._save()
@@ -0,0 +1,223 @@
+"""
+Per game session history, kept out of the game configs so that it doesn't grow every sync.
+
+Every game has an append only log of fixed width records (start, duration, host id) under .sync/sessions/, and a
+rollup file with the daily, weekly and per host sums, updated as sessions end. Every machine uploads the sessions
+played on it to sessions/<game id>@<hostname>.log on remote and merges the ones of the others.
+"""
+import os
+import json
+import socket
+import struct
+import zlib
+from array import array
+from bisect import bisect_left, bisect_right
+from datetime import datetime, timedelta
+
+
+def host_id(name=None):
+    return zlib.crc32((name or socket.gethostname()).encode())
+
+
+def day_key(d: datetime):
+    return d.strftime("%Y-%m-%d")
+
+
+def week_key(d: datetime):
+    y, w, _ = d.isocalendar()
+    return f"{y}-W{w:02d}"
+
+
+class SessionLog:
+    # start (epoch seconds), duration (seconds), host id
+    RECORD = struct.Struct("<dfI")
+
+    def __init__(self, path_):
+        self.path = path_
+        self.rollup_path = path_[:-len(".log")] + ".rollup.json"
+        self.starts = array("d")
+        self.durations = array("f")
+        self.hosts = array("I")
+        self._load()
+        self.rollups = self._load_rollups()
+
+    def _load(self):
+        try:
+            with open(self.path, "rb") as f:
+                buff = f.read()
+        except FileNotFoundError:
+            return
+        # a torn last record from a crash is dropped
+        buff = buff[:len(buff) - len(buff) % self.RECORD.size]
+        for _s, _d, _h in self.RECORD.iter_unpack(buff):
+            self.starts.append(_s)
+            self.durations.append(_d)
+            self.hosts.append(_h)
+
+    def _load_rollups(self):
+        try:
+            with open(self.rollup_path) as f:
+                rollups = json.load(f)
+            if rollups.get("count") == len(self.starts):
+                return rollups
+        except (FileNotFoundError, json.decoder.JSONDecodeError):
+            pass
+        return self._rebuild()
+
+    def _rebuild(self):
+        self.rollups = {"count": 0, "total": 0.0, "day": {}, "week": {}, "host": {}}
+        for n in range(len(self.starts)):
+            self._roll(self.starts[n], self.durations[n], self.hosts[n])
+        self._save_rollups()
+        return self.rollups
+
+    def _roll(self, start, duration, host):
+        # sessions across midnight are split between the days they touched
+        end = start + duration
+        t = start
+        while t < end:
+            d = datetime.fromtimestamp(t)
+            next_day = datetime(d.year, d.month, d.day) + timedelta(days=1)
+            chunk = min(end, next_day.timestamp()) - t
+            for _k, _v in (("day", day_key(d)), ("week", week_key(d))):
+                self.rollups[_k][_v] = self.rollups[_k].get(_v, 0.0) + chunk
+            t += chunk
+        self.rollups["host"][str(host)] = self.rollups["host"].get(str(host), 0.0) + duration
+        self.rollups["total"] += duration
+        self.rollups["count"] += 1
+
+    def _save_rollups(self):
+        os.makedirs(os.path.dirname(self.rollup_path) or ".", exist_ok=True)
+        with open(self.rollup_path + ".tmp", "w") as f:
+            json.dump(self.rollups, f)
+        os.replace(self.rollup_path + ".tmp", self.rollup_path)
+
+    def __len__(self):
+        return len(self.starts)
+
+    def append(self, start, duration, host=None):
+        host = host_id() if host is None else host
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        with open(self.path, "ab") as f:
+            f.write(self.RECORD.pack(start, duration, host))
+        if self.starts and start < self.starts[-1]:
+            # out of order, only possible with a skewed clock: keep the arrays sorted for the range queries
+            self.merge([(start, duration, host)])
+            return
+        self.starts.append(start)
+        self.durations.append(duration)
+        self.hosts.append(host)
+        self._roll(start, duration, host)
+        self._save_rollups()
+
+    def records(self, host=None):
+        for n in range(len(self.starts)):
+            if host is None or self.hosts[n] == host:
+                yield self.starts[n], self.durations[n], self.hosts[n]
+
+    def pack(self, host=None):
+        return b"".join(self.RECORD.pack(*_r) for _r in self.records(host))
+
+    @classmethod
+    def unpack(cls, buff):
+        buff = buff[:len(buff) - len(buff) % cls.RECORD.size]
+        return list(cls.RECORD.iter_unpack(buff))
+
+    def merge(self, records):
+        """
+        Adds the records not already in the log, returns how many were new.
+        """
+        known = set(zip(self.starts, self.hosts))
+        # float32 durations: compare records by start and host only
+        new = [_r for _r in records if (_r[0], _r[2]) not in known]
+        if not new:
+            return 0
+        merged = sorted(set(self.records()) | set(new))
+        self.starts, self.durations, self.hosts = array("d"), array("f"), array("I")
+        for _s, _d, _h in merged:
+            self.starts.append(_s)
+            self.durations.append(_d)
+            self.hosts.append(_h)
+        with open(self.path + ".tmp", "wb") as f:
+            f.write(self.pack())
+        os.replace(self.path + ".tmp", self.path)
+        self._rebuild()
+        return len(new)
+
+    def total(self, since=None, until=None):
+        """
+        Seconds played in sessions started between since and until, epoch seconds.
+        """
+        lo = 0 if since is None else bisect_left(self.starts, since)
+        hi = len(self.starts) if until is None else bisect_right(self.starts, until)
+        return sum(self.durations[lo:hi])
+
+    def by(self, key, since=None, until=None):
+        """
+        Rollup sums by "day", "week" or "host". since and until are day or week keys, like the ones returned.
+        """
+        return {_k: _v for _k, _v in sorted(self.rollups[key].items())
+                if (since is None or _k >= since) and (until is None or _k <= until)}
+
+
+class SessionStore:
+    def __init__(self, root=".sync/sessions/"):
+        self.root = root
+        self._logs = {}
+        self.hosts_path = os.path.join(root, "hosts.json")
+        try:
+            with open(self.hosts_path) as f:
+                self.hosts = json.load(f)
+        except (FileNotFoundError, json.decoder.JSONDecodeError):
+            self.hosts = {}
+        self._learn(socket.gethostname())
+
+    def _learn(self, name):
+        if str(host_id(name)) not in self.hosts:
+            self.hosts[str(host_id(name))] = name
+            os.makedirs(self.root, exist_ok=True)
+            with open(self.hosts_path, "w") as f:
+                json.dump(self.hosts, f)
+
+    def host_name(self, id_):
+        return self.hosts.get(str(id_), str(id_))
+
+    def log(self, game_id) -> SessionLog:
+        if game_id not in self._logs:
+            self._logs[game_id] = SessionLog(os.path.join(self.root, f"{game_id}.log"))
+        return self._logs[game_id]
+
+    def record(self, game_id, start, duration):
+        self.log(game_id).append(start, duration)
+
+    def sync(self, sync, game_ids, msg_clb=None):
+        """
+        Uploads the sessions played here and merges the ones played elsewhere, remote files that didn't grow since
+        the last merge are skipped.
+        """
+        sync.prepare_path("sessions/")
+        me = socket.gethostname()
+        seen_path = os.path.join(self.root, "remote.json")
+        try:
+            with open(seen_path) as f:
+                seen = json.load(f)
+        except (FileNotFoundError, json.decoder.JSONDecodeError):
+            seen = {}
+        remote = {_a.filename: _a.st_size for _a in sync.sftp.listdir_attr("sessions")}
+        for _id in game_ids:
+            own = self.log(_id).pack(host_id(me))
+            name = f"{_id}@{me}.log"
+            if own and remote.get(name) != len(own):
+                with sync.sftp.open(f"sessions/{name}", "wb") as f:
+                    f.write(own)
+        for name, size in remote.items():
+            _id, _, host = name[:-len(".log")].rpartition("@")
+            if host == me or _id not in game_ids or seen.get(name) == size:
+                continue
+            self._learn(host)
+            with sync.sftp.open(f"sessions/{name}") as f:
+                self.log(_id).merge(SessionLog.unpack(f.read()))
+            seen[name] = size
+        os.makedirs(self.root, exist_ok=True)
+        with open(seen_path, "w") as f:
+            json.dump(seen, f)
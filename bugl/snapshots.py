@@ -0,0 +1,147 @@
+"""
+Local snapshots of the data roots of a game, taken before a pull overwrites them.
+
+A snapshot of <dir>/<root> lives in <dir>/.<root>.bugl-snapshots/<timestamp>/, on the same filesystem, so that
+taking it costs metadata only: every file is a reflink (FICLONE) of the live one where the filesystem supports it,
+a hardlink otherwise. Hardlinks are enough against a pull because rsync writes every file it updates aside and
+renames it over the old one, the snapshot keeps the old inode; they don't protect from a game rewriting a file in
+place afterwards. Restores clone or copy back and never link, the live tree never shares inodes with a snapshot.
+"""
+import os
+import shutil
+from datetime import datetime
+
+REFLINK = "reflink"
+HARDLINK = "hardlink"
+# ioctl making a copy on write clone, on btrfs, xfs and the like
+FICLONE = 0x40049409
+
+
+class SnapshotError(Exception):
+    pass
+
+
+def _clone(src, dst):
+    import fcntl
+    with open(src, "rb") as s, open(dst, "wb") as d:
+        fcntl.ioctl(d.fileno(), FICLONE, s.fileno())
+    shutil.copystat(src, dst)
+
+
+class Snapshots:
+    SUFFIX = ".bugl-snapshots"
+    STAMP = "%Y%m%d-%H%M%S-%f"
+
+    def __init__(self, keep=5):
+        # snapshots kept per data root, 0 disables them
+        self.keep = keep
+
+    @classmethod
+    def folder(cls, root):
+        root = os.path.expanduser(root).rstrip("/")
+        return os.path.join(os.path.dirname(root), f".{os.path.basename(root)}{cls.SUFFIX}")
+
+    def list(self, root):
+        """
+        The snapshots of root, newest first.
+        """
+        try:
+            return sorted((_e.path for _e in os.scandir(self.folder(root)) if _e.is_dir()), reverse=True)
+        except FileNotFoundError:
+            return []
+
+    @staticmethod
+    def taken(snapshot):
+        return datetime.strptime(os.path.basename(snapshot), Snapshots.STAMP)
+
+    def _files(self, root):
+        # (relative path, is dir) of root, or of the file root itself
+        if os.path.isfile(root):
+            yield os.path.basename(root), False
+            return
+        for _r, _ds, _fs in os.walk(root):
+            rel = os.path.relpath(_r, root)
+            for _d in _ds:
+                yield os.path.normpath(os.path.join(rel, _d)), True
+            for _f in _fs:
+                yield os.path.normpath(os.path.join(rel, _f)), False
+
+    def take(self, root, prune=True):
+        """
+        Snapshots root, returns the snapshot path and the mode used, None if there's nothing to snapshot.
+        Raises SnapshotError when the filesystem can neither reflink nor hardlink.
+        """
+        root = os.path.expanduser(root).rstrip("/")
+        if not self.keep or not os.path.exists(root):
+            return None
+        dest = os.path.join(self.folder(root), datetime.now().strftime(self.STAMP))
+        os.makedirs(dest)
+        base = root if os.path.isdir(root) else os.path.dirname(root)
+        mode = REFLINK
+        try:
+            for rel, is_dir in self._files(root):
+                src, dst = os.path.join(base, rel), os.path.join(dest, rel)
+                if is_dir:
+                    os.makedirs(dst, exist_ok=True)
+                elif os.path.islink(src):
+                    os.symlink(os.readlink(src), dst)
+                else:
+                    if mode == REFLINK:
+                        try:
+                            _clone(src, dst)
+                            continue
+                        except (ImportError, OSError):
+                            mode = HARDLINK
+                            if os.path.exists(dst):
+                                os.remove(dst)
+                    os.link(src, dst)
+        except OSError as e:
+            shutil.rmtree(dest, ignore_errors=True)
+            raise SnapshotError(f"Can't snapshot {root}: {e}")
+        if prune:
+            self.prune(root)
+        return dest, mode
+
+    def prune(self, root):
+        for _s in self.list(root)[self.keep:]:
+            shutil.rmtree(_s, ignore_errors=True)
+
+    def restore(self, root, snapshot):
+        """
+        Puts root back as it was in snapshot. The current state is snapshotted first, so a restore can be undone.
+        """
+        root = os.path.expanduser(root).rstrip("/")
+        # the one being restored mustn't be pruned by this snapshot
+        self.take(root, prune=False)
+        tmp = f"{root}.restore"
+        if os.path.isfile(root) or not os.path.exists(root) and os.listdir(snapshot) == [os.path.basename(root)] \
+                and os.path.isfile(os.path.join(snapshot, os.path.basename(root))):
+            # a file root
+            self._copy(os.path.join(snapshot, os.path.basename(root)), tmp)
+            os.replace(tmp, root)
+            self.prune(root)
+            return
+        # built aside, then swapped with the live tree
+        shutil.rmtree(tmp, ignore_errors=True)
+        os.makedirs(tmp)
+        for rel, is_dir in self._files(snapshot):
+            src, dst = os.path.join(snapshot, rel), os.path.join(tmp, rel)
+            if is_dir:
+                os.makedirs(dst, exist_ok=True)
+            elif os.path.islink(src):
+                os.symlink(os.readlink(src), dst)
+            else:
+                self._copy(src, dst)
+        old = f"{root}.old"
+        if os.path.exists(root):
+            os.rename(root, old)
+        os.rename(tmp, root)
+        shutil.rmtree(old, ignore_errors=True)
+        self.prune(root)
+
+    @staticmethod
+    def _copy(src, dst):
+        try:
+            _clone(src, dst)
+        except (ImportError, OSError):
+            shutil.copy2(src, dst)
@@ -0,0 +1,192 @@
+"""
+Storage backends of Sync, chosen by "backend" in sync.json.
+
+Both expose the subset of paramiko's SFTPClient that the sync stack uses (open, stat, lstat, listdir_attr, mkdir,
+rmdir, normalize, getcwd, chdir, posix_rename, remove, put, get, close) plus what rsync and the remote commands
+need: rsync_target(), rsync_shell() and exec_command(). Sync keeps the backend of the current connection in Sync.sftp.
+  "sftp": the store is reached through ssh, the default.
+  "local": remote_path and remote_data_path are local paths, like a NFS or SMB mount; files are copied with
+           reflinks or copy_file_range, written through atomic renames, data synced by a local rsync.
+"""
+import os
+import shutil
+from subprocess import run, PIPE, STDOUT
+from paramiko import SFTPClient
+from snapshots import FICLONE
+
+SFTP = "sftp"
+LOCAL = "local"
+
+
+class SFTPStorage(SFTPClient):
+    local = False
+
+    @classmethod
+    def open_on(cls, sync):
+        storage = cls.from_transport(sync.ssh.get_transport())
+        storage.sync = sync
+        return storage
+
+    def rsync_target(self, path_):
+        return f"{self.sync.conf.get('user')}@{self.sync.conf.get('host')}:{path_}"
+
+    def rsync_shell(self):
+        return ["-e", f"ssh -p {self.sync.conf.get('port')}"]
+
+    def exec_command(self, command, timeout=10):
+        """
+        Runs command on the remote, returns its exit code and its output.
+        """
+        _, stdout, _ = self.sync.ssh.exec_command(command, timeout=timeout)
+        out = stdout.read().decode()
+        return stdout.channel.recv_exit_status(), out
+
+
+class LocalAttributes:
+    # the fields of paramiko's SFTPAttributes that are used
+    def __init__(self, filename, st):
+        self.filename = filename
+        self.st_mode = st.st_mode
+        self.st_size = st.st_size
+        self.st_mtime = st.st_mtime
+
+
+class LocalFile:
+    """
+    A local file behaving like paramiko's: it reads bytes and writes bytes or str. Files opened for writing are
+    written aside and renamed over the target when closed, readers never see half a file.
+    """
+    def __init__(self, path_, mode="r"):
+        self.path = path_
+        self._tmp = None
+        mode = mode.replace("b", "").replace("t", "")
+        if mode[0] in "wx":
+            self._tmp = f"{path_}.{os.getpid()}.tmp"
+            self._f = open(self._tmp, mode + "b")
+        else:
+            self._f = open(path_, mode + "b")
+
+    def write(self, data):
+        return self._f.write(data.encode() if isinstance(data, str) else data)
+
+    def close(self):
+        if self._f.closed:
+            return
+        if self._tmp:
+            self._f.flush()
+            os.fsync(self._f.fileno())
+        self._f.close()
+        if self._tmp:
+            os.replace(self._tmp, self.path)
+
+    def __getattr__(self, item):
+        return getattr(self._f, item)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, *args):
+        if exc_type is not None and self._tmp:
+            # a failed write leaves the target as it was
+            self._f.close()
+            os.remove(self._tmp)
+            return
+        self.close()
+
+
+class LocalStorage:
+    local = True
+
+    def __init__(self):
+        self.cwd = None
+
+    def _abs(self, path_):
+        return os.path.join(self.cwd or os.path.expanduser("~"), os.path.expanduser(path_))
+
+    def open(self, path_, mode="r", bufsize=-1):
+        return LocalFile(self._abs(path_), mode)
+
+    def stat(self, path_):
+        return os.stat(self._abs(path_))
+
+    def lstat(self, path_):
+        return os.lstat(self._abs(path_))
+
+    def listdir_attr(self, path_="."):
+        return [LocalAttributes(_e.name, _e.stat(follow_symlinks=False)) for _e in os.scandir(self._abs(path_))]
+
+    def mkdir(self, path_, mode=0o777):
+        os.mkdir(self._abs(path_), mode)
+
+    def rmdir(self, path_):
+        os.rmdir(self._abs(path_))
+
+    def normalize(self, path_):
+        return os.path.realpath(self._abs(path_))
+
+    def getcwd(self):
+        return self.cwd
+
+    def chdir(self, path_=None):
+        self.cwd = None if path_ is None else self.normalize(path_)
+
+    def posix_rename(self, old, new):
+        os.replace(self._abs(old), self._abs(new))
+
+    rename = posix_rename
+
+    def remove(self, path_):
+        os.remove(self._abs(path_))
+
+    @classmethod
+    def copy(cls, src, dst, callback=None):
+        """
+        Copies src to dst atomically: a reflink where the filesystem supports it, else copy_file_range, which
+        stays in the kernel and lets network filesystems copy server side.
+        """
+        size = os.path.getsize(src)
+        tmp = f"{dst}.{os.getpid()}.tmp"
+        with open(src, "rb") as s, open(tmp, "wb") as d:
+            try:
+                import fcntl
+                fcntl.ioctl(d.fileno(), FICLONE, s.fileno())
+            except (ImportError, OSError):
+                try:
+                    done = 0
+                    while done < size:
+                        n = os.copy_file_range(s.fileno(), d.fileno(), size - done)
+                        if n == 0:
+                            break
+                        done += n
+                        if callback:
+                            callback(done, size)
+                except (AttributeError, OSError):
+                    s.seek(0)
+                    d.seek(0)
+                    d.truncate()
+                    shutil.copyfileobj(s, d)
+            d.flush()
+            os.fsync(d.fileno())
+        shutil.copystat(src, tmp)
+        os.replace(tmp, dst)
+        if callback:
+            callback(size, size)
+
+    def put(self, localpath, remotepath, callback=None):
+        self.copy(localpath, self._abs(remotepath), callback)
+
+    def get(self, remotepath, localpath, callback=None):
+        self.copy(self._abs(remotepath), localpath, callback)
+
+    def close(self):
+        pass
+
+    def rsync_target(self, path_):
+        return path_
+
+    def rsync_shell(self):
+        return []
+
+    def exec_command(self, command, timeout=10):
+        proc = run(command, shell=True, stdout=PIPE, stderr=STDOUT, timeout=timeout, cwd=self.cwd)
+        return proc.returncode, proc.stdout.decode()
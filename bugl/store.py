@@ -0,0 +1,146 @@
+"""
+Optional SQLite store of the library, enabled with "library_store": "sqlite" in config.json.
+
+The json files stay the format synced to remote and edited by hand: the store keeps a copy of every config along
+with the mtime of its file. prepare() builds the configs from one query, parsing only the files changed behind its
+back, and Bugl.write() saves in a single transaction, rewriting only the files whose content actually changed.
+"""
+import os
+import json
+import sqlite3
+from threading import Lock
+
+GAME = "game"
+GLOBAL = "global"
+
+
+def conf_record(conf):
+    # every key, internal ones included, in a stable order so that records can be compared as text
+    return json.dumps({k: conf.get(k) for k in conf.keys()}, sort_keys=True)
+
+
+class LibraryStore:
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS configs (
+            path TEXT PRIMARY KEY,
+            kind TEXT NOT NULL,
+            id TEXT,
+            name TEXT,
+            latest_launch REAL,
+            mtime_ns INTEGER,
+            data TEXT NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS configs_name ON configs (kind, name);
+        CREATE INDEX IF NOT EXISTS configs_latest_launch ON configs (kind, latest_launch);
+    """
+
+    def __init__(self, path_=".sync/library.db"):
+        os.makedirs(os.path.dirname(path_) or ".", exist_ok=True)
+        self.path = path_
+        # sync jobs write configs from their workers
+        self.db = sqlite3.connect(path_, check_same_thread=False)
+        self._lock = Lock()
+        with self.db:
+            self.db.executescript(self.SCHEMA)
+
+    @staticmethod
+    def _mtime(path_):
+        try:
+            return os.stat(path_).st_mtime_ns
+        except FileNotFoundError:
+            return None
+
+    def load(self, path_):
+        """
+        Returns the stored data of path_, None if the file changed since it was stored.
+        """
+        row = self.db.execute("SELECT mtime_ns, data FROM configs WHERE path = ?", (path_, )).fetchone()
+        if row is None or row[0] != self._mtime(path_):
+            return None
+        return json.loads(row[1])
+
+    def load_games(self, folder="games"):
+        """
+        Returns {path: data} of the game configs in folder whose file didn't change since they were stored, and
+        the paths that need to be parsed again. Records of deleted files are dropped.
+        """
+        rows = dict(((_p, (_m, _d)) for _p, _m, _d in
+                     self.db.execute("SELECT path, mtime_ns, data FROM configs WHERE kind = ?", (GAME, ))))
+        fresh, stale = {}, []
+        for _e in os.scandir(folder):
+            if not _e.is_file() or _e.name.split(".")[-1] != "json":
+                continue
+            _p = f"{folder}/{_e.name}"
+            row = rows.pop(_p, None)
+            if row and row[0] == _e.stat().st_mtime_ns:
+                fresh[_p] = json.loads(row[1])
+            else:
+                stale.append(_p)
+        if rows:
+            with self._lock, self.db:
+                self.db.executemany("DELETE FROM configs WHERE path = ?", ((_p, ) for _p in rows))
+        return fresh, stale
+
+    def _row(self, conf, kind, data):
+        path_ = conf.config_path
+        if kind == GAME:
+            return path_, kind, conf.get("id"), conf.get("name"), conf.get("latest_launch"), self._mtime(path_), data
+        return path_, kind, None, None, None, self._mtime(path_), data
+
+    def save(self, confs, kind=GAME):
+        """
+        Writes the configs that changed, both to their json file and to the store, in a single transaction.
+        Returns how many were written.
+        """
+        paths = [_c.config_path for _c in confs]
+        stored = {}
+        for n in range(0, len(paths), 500):
+            chunk = paths[n:n + 500]
+            marks = ",".join("?" * len(chunk))
+            stored.update(self.db.execute(f"SELECT path, data FROM configs WHERE path IN ({marks})", chunk))
+        rows = []
+        for _c in confs:
+            data = conf_record(_c)
+            if stored.get(_c.config_path) == data and self._mtime(_c.config_path) is not None:
+                continue
+            _c.write()
+            # taken again after the write, which may touch the config itself
+            rows.append(self._row(_c, kind, conf_record(_c)))
+        if rows:
+            with self._lock, self.db:
+                self.db.executemany("INSERT OR REPLACE INTO configs VALUES (?, ?, ?, ?, ?, ?, ?)", rows)
+        return len(rows)
+
+    def index(self, confs, kind=GAME):
+        # stores configs just parsed from their files
+        with self._lock, self.db:
+            self.db.executemany("INSERT OR REPLACE INTO configs VALUES (?, ?, ?, ?, ?, ?, ?)",
+                                [self._row(_c, kind, conf_record(_c)) for _c in confs])
+
+    def find(self, name):
+        return [_r[0] for _r in self.db.execute(
+            "SELECT path FROM configs WHERE kind = ? AND (name = ? OR id = ?) ORDER BY name", (GAME, name, name))]
+
+    def last_played(self, limit=1):
+        return [_r[0] for _r in self.db.execute(
+            "SELECT path FROM configs WHERE kind = ? ORDER BY latest_launch DESC LIMIT ?", (GAME, limit))]
+
+    def export(self, folder="games"):
+        """
+        Writes every stored game config back to its json file, returns the paths written.
+        """
+        out = []
+        for _p, _d in self.db.execute("SELECT path, data FROM configs WHERE kind = ?", (GAME, )).fetchall():
+            if os.path.dirname(_p) != folder:
+                continue
+            with open(_p + ".tmp", "w") as f:
+                json.dump(json.loads(_d), f, indent=4)
+            os.replace(_p + ".tmp", _p)
+            out.append(_p)
+        with self._lock, self.db:
+            self.db.executemany("UPDATE configs SET mtime_ns = ? WHERE path = ?",
+                                [(self._mtime(_p), _p) for _p in out])
+        return out
+
+    def close(self):
+        self.db.close()
@@ -1,33 +1,136 @@
 import os
+import re
 import json
+import errno
 import socket
-from subprocess import Popen, PIPE, STDOUT, DEVNULL
+import posixpath
+from shlex import quote
+from subprocess import Popen, PIPE, STDOUT, DEVNULL, run
 from paramiko import SSHClient, RSAKey, AutoAddPolicy, ssh_exception
 from TopongoConfigs.configs import Configs
 from hashlib import sha256
 from stat import S_ISDIR
 from threading import Thread
-from time import sleep
+from time import sleep, monotonic
 from select import select
 from sys import stderr
-from typing import Callable
+from tracing import span, count
+from compression import Compression
+from fileset import FileSet
+from agent import RemoteAgent, AgentError
+from storage import SFTPStorage, LocalStorage, LOCAL as LOCAL_BACKEND
+from sync_base import LOCAL, REMOTE, PWD, PKEY, PULL, PUSH, AuthError, NoHostSet, ConnectionError, Job
+
+
+class RemotePaths:
+    """
+    Single resolver for every remote path used by Sync and Rsync.
+    The home directory is resolved once per connection and the directories known to exist are cached, so that
+    preparing a path costs at most one round trip.
+    """
+    def __init__(self, sync):
+        self.sync = sync
+        self.home = None
+        self.dirs = set()
 
-LOCAL = 0
-REMOTE = 1
+    def reset(self):
+        # called on every new connection, the remote may have changed under us
+        self.home = None
+        self.dirs = set()
+
+    def resolve_home(self):
+        if self.home is None:
+            # sftp sessions start in the login directory, its realpath is the home
+            count(rtt=1)
+            self.home = self.sync.sftp.normalize(".")
+        return self.home
+
+    def __call__(self, path_):
+        trailing = path_.endswith("/")
+        if path_ == "~" or path_.startswith("~/"):
+            path_ = self.resolve_home() + path_[1:]
+        elif not posixpath.isabs(path_):
+            # paramiko keeps track of the working directory locally, no round trip here
+            path_ = posixpath.join(self.sync.sftp.getcwd() or self.resolve_home(), path_)
+        path_ = posixpath.normpath(path_)
+        return path_ + "/" if trailing and path_ != "/" else path_
+
+    def known(self, path_):
+        return self(path_).rstrip("/") in self.dirs
+
+    def add(self, path_):
+        path_ = self(path_).rstrip("/") or "/"
+        while path_ not in self.dirs and path_ != "/":
+            self.dirs.add(path_)
+            path_ = posixpath.dirname(path_)
+
+    def makedirs(self, path_):
+        """
+        Creates path_ and its missing parents, returns the list of the created directories.
+        """
+        path_ = self(path_).rstrip("/")
+        if path_ in self.dirs or not path_:
+            return []
+        parents = []
+        _p = path_
+        while _p not in self.dirs and _p != "/":
+            parents.append(_p)
+            _p = posixpath.dirname(_p)
+        parents.reverse()
+        if (res := self.sync.ask({"op": "makedirs", "path": path_})) and not isinstance(res[0], OSError):
+            self.add(path_)
+            return res[0]
+        try:
+            created = self._makedirs_exec(parents)
+        except (ssh_exception.SSHException, OSError, RuntimeError):
+            created = self._makedirs_sftp(parents)
+        self.add(path_)
+        return created
+
+    def _makedirs_exec(self, parents):
+        # a single round trip: report the missing directories then create them all
+        script = f"for d in {' '.join(quote(_p) for _p in parents)}; do [ -d \"$d\" ] || echo \"$d\"; done; " \
+                 f"mkdir -p {quote(parents[-1])}"
+        count(rtt=1)
+        code, out = self.sync.sftp.exec_command(script, timeout=10)
+        if code != 0:
+            raise RuntimeError(f"mkdir -p {parents[-1]} failed")
+        return [_l for _l in out.splitlines() if _l]
+
+    def _makedirs_sftp(self, parents):
+        # no shell on the remote: find the deepest existing parent, then create the rest top down
+        created = []
+        first = len(parents)
+        while first > 0:
+            count(rtt=1)
+            try:
+                self.sync.sftp.stat(parents[first - 1])
+                break
+            except IOError:
+                first -= 1
+        for _p in parents[first:]:
+            count(rtt=1)
+            self.sync.sftp.mkdir(_p)
+            created.append(_p)
+        return created
 
 
 class Sync:
-    PWD = 0
-    PKEY = 1
+    PWD = PWD
+    PKEY = PKEY
 
-    class AuthError(Exception):
-        pass
+    # link states
+    UP = "up"
+    DOWN = "down"
+    RECONNECTING = "reconnecting"
 
-    class NoHostSet(Exception):
-        pass
+    # seconds a successful probe is trusted for
+    PROBE_INTERVAL = 5
+    MAX_BACKOFF = 60
 
-    class ConnectionError(Exception):
-        pass
+    AuthError = AuthError
+    NoHostSet = NoHostSet
+    ConnectionError = ConnectionError
 
     def __init__(self, _conf, _password_mtd=None, _full_init=False):
         self.conf = _conf
@@ -36,6 +139,11 @@ class Sync:
         self.home = None
         self.ssh.set_missing_host_key_policy(AutoAddPolicy())
         self.sftp = None
+        self.path = RemotePaths(self)
+        # RemoteAgent, when "remote_agent" is set and the remote can run it
+        self.agent = None
+        # path -> content or None if missing, read by prefetch() ahead of the configs that need it
+        self._prefetched = {}
         if self.conf.get("remote_path")[-1] != "/":
             self.conf.set("remote_path", self.conf.get("remote_path") + "/")
             self.conf.write()
@@ -50,24 +158,82 @@ class Sync:
                 self.pkey = None
 
         self.connected = False
+        self.state = self.DOWN
+        self.rtt = None
+        self.next_retry = None
+        self.auto_reconnect = False
+        self._password = None
+        self._last_probe = 0
+        self._reconnector = None
+
+    def is_local(self):
+        return self.conf.get("backend") == LOCAL_BACKEND
 
     def _update_status(self):
+        # cheap liveness probe: a single stat of remote_path, sftp's working directory
+        transport = self.ssh.get_transport()
+        if self.sftp is None or (not self.sftp.local and (transport is None or not transport.is_active())):
+            self._link_lost()
+            return
+        start = monotonic()
+        count(rtt=1)
         try:
-            self.sftp.listdir()
-        except OSError:
-            self.sftp.close()
+            self.sftp.stat(".")
+        except (OSError, EOFError, ssh_exception.SSHException):
+            self._link_lost()
+            return
+        self._last_probe = monotonic()
+        self.rtt = self._last_probe - start
+        self.connected = True
+        self.state = self.UP
+
+    def _link_lost(self):
+        self.connected = False
+        self.rtt = None
+        if self.auto_reconnect:
+            if self._reconnector is None:
+                self.state = self.RECONNECTING
+                self._reconnector = Thread(target=self._reconnect_loop, daemon=True)
+                self._reconnector.start()
+        else:
+            self.state = self.DOWN
+
+    def _reconnect_loop(self):
+        delay = 1
+        while not self.connected and self.auto_reconnect:
+            self.state = self.RECONNECTING
+            self.next_retry = monotonic() + delay
+            sleep(delay)
             try:
-                self.ssh.exec_command(f'ls {self.conf.get("remote_path")}', timeout=1)
-                self.sftp = self.ssh.open_sftp()
-                self.connected = True
-            except ssh_exception.SSHException:
                 self.ssh.close()
-                self.connected = False
+                self._open()
+            except self.AuthError:
+                # credentials are gone or changed, reconnecting needs the user
+                self.state = self.DOWN
+                break
+            except (self.ConnectionError, OSError, EOFError, ssh_exception.SSHException):
+                delay = min(delay * 2, self.MAX_BACKOFF)
+        self.next_retry = None
+        self._reconnector = None
 
     def ready(self):
+        if self.connected and monotonic() - self._last_probe < self.PROBE_INTERVAL:
+            return True
         self._update_status()
         return self.connected
 
+    def wait_connected(self, timeout=30):
+        # used by jobs to retry after a dropped link
+        end = monotonic() + timeout
+        while not self.ready():
+            if not self.auto_reconnect or monotonic() > end:
+                return False
+            sleep(.5)
+        return True
+
+    def link_state(self):
+        return self.state, self.rtt
+
     def _authenticate(self, custom_pwd=None):
         if self.mode == self.PWD:
             if custom_pwd:
@@ -96,32 +262,17 @@ class Sync:
             raise TypeError
 
     def expanduser(self, _path):
-        if self.home is None:
-            _, stdout, _ = self.ssh.exec_command("echo -n ~")
-            self.home = stdout.read().decode()
-        return os.path.join(self.home, _path.replace("~/", "").replace("~", ""))
+        return self.path(_path)
 
     def prepare_path(self, path_):
-        created = []
-        path_ = path_.replace("~", f"/home/{self.conf.get('user')}")
-        try:
-            self.sftp.stat(path_)
-        except IOError:
-            try:
-                self.sftp.mkdir(path_)
-                created.append(path_)
-            except IOError:
-                self.prepare_path(os.path.abspath(os.path.join(path_, os.path.pardir)))
-                self.sftp.mkdir(path_)
-                created.append(path_)
-        return created
+        return self.path.makedirs(path_)
 
     def connect(self, custom_pwd=None):
         # if auth method is pwd, ask for it
-        if self.mode == self.PWD or (self.mode == self.PKEY and self.pkey is None):
+        if not self.is_local() and (self.mode == self.PWD or (self.mode == self.PKEY and self.pkey is None)):
             self._authenticate(custom_pwd)
 
-        if self.conf.get("host") is None:
+        if self.conf.get("host") is None and not self.is_local():
             # no host set
             raise self.NoHostSet
 
@@ -133,44 +284,147 @@ class Sync:
         if self.connected:
             return
         else:
-            try:
-                if self.mode == self.PKEY:
-                    self.ssh.connect(self.conf.get("host"), port=self.conf.get("port"), username=self.conf.get("user"),
-                                     pkey=self.pkey)
-                elif self.mode == self.PWD:
-                    self.ssh.connect(self.conf.get("host"), port=self.conf.get("port"), username=self.conf.get("user"),
-                                     password=self.pwd_mtd(f"Password for {self.conf.get('user')}"))
-            except ValueError as e:
-                if e.args[0] == "password and salt must not be empty":
-                    raise self.AuthError("Empty password")
-                else:
-                    raise e
-            except ssh_exception.AuthenticationException:
-                raise self.AuthError("Invalid password")
-            except (ssh_exception.SSHException, socket.gaierror) as e_:
-                raise self.ConnectionError(e_)
-            self.sftp = self.ssh.open_sftp()
+            if self.mode == self.PWD and not self.is_local():
+                self._password = self.pwd_mtd(f"Password for {self.conf.get('user')}")
+            self._open()
+            self.auto_reconnect = True
+
+    def _open_local(self):
+        root = os.path.expanduser(self.conf.get("remote_path")).rstrip("/")
+        # an unmounted share must not be recreated on the bare mount point
+        if not os.path.isdir(os.path.dirname(root) or "/"):
+            raise self.ConnectionError(f"{os.path.dirname(root)} is not available, is the share mounted?")
+        self.sftp = LocalStorage()
+
+    def _open(self):
+        with span("Sync.connect", host=self.conf.get("host")):
+            self.agent = None
+            self._prefetched = {}
+            if self.is_local():
+                self._open_local()
+            else:
+                self._open_ssh()
+            self.path.reset()
             self.prepare_path(self.conf.get("remote_path"))
-            self.sftp.chdir(self.conf.get("remote_path").replace("~", f"/home/{self.conf.get('user')}"))
+            self.sftp.chdir(self.path(self.conf.get("remote_path")))
 
             self._update_status()
 
+    def _open_ssh(self):
+        try:
+            if self.mode == self.PKEY:
+                self.ssh.connect(self.conf.get("host"), port=self.conf.get("port"), username=self.conf.get("user"),
+                                 pkey=self.pkey)
+            elif self.mode == self.PWD:
+                self.ssh.connect(self.conf.get("host"), port=self.conf.get("port"), username=self.conf.get("user"),
+                                 password=self._password)
+        except ValueError as e:
+            if e.args[0] == "password and salt must not be empty":
+                raise self.AuthError("Empty password")
+            else:
+                raise e
+        except ssh_exception.AuthenticationException:
+            raise self.AuthError("Invalid password")
+        except (ssh_exception.SSHException, socket.gaierror) as e_:
+            raise self.ConnectionError(e_)
+        # keepalives let the transport notice a dead link without waiting for a request to time out
+        self.ssh.get_transport().set_keepalive(self.conf.get("keepalive"))
+        self.sftp = SFTPStorage.open_on(self)
+        if self.conf.get("remote_agent"):
+            try:
+                self.agent = RemoteAgent.start(self.ssh)
+            except (OSError, EOFError, ssh_exception.SSHException):
+                self.agent = None
+
+    def ask(self, *queries):
+        """
+        Runs queries on the remote agent in a single round trip, returns None when there's no agent: the caller
+        falls back to sftp.
+        """
+        if self.agent is None:
+            return None
+        count(rtt=1)
+        try:
+            return self.agent.query(*queries)
+        except (AgentError, OSError, EOFError, ValueError, ssh_exception.SSHException):
+            # a dead agent isn't worth a retry, sftp can do the same
+            self.agent = None
+            return None
+
+    def prefetch(self, paths):
+        """
+        Reads the remote files at paths in a single round trip, kept for the next read() of each. Without the
+        agent it does nothing. Whatever a previous prefetch left unread is dropped, it may be stale by now.
+        """
+        self._prefetched = {}
+        res = self.ask(*({"op": "read", "path": self.path(_p)} for _p in paths))
+        for _p, _r in zip(paths, res or ()):
+            if isinstance(_r, FileNotFoundError):
+                self._prefetched[_p] = None
+            elif not isinstance(_r, OSError):
+                self._prefetched[_p] = RemoteAgent.content(_r)
+
+    def forget(self, path_=None):
+        # drops the prefetched copy of path_, of every path when None
+        if path_ is None:
+            self._prefetched = {}
+        else:
+            self._prefetched.pop(path_, None)
+
+    def read(self, path_):
+        if path_ in self._prefetched:
+            data = self._prefetched.pop(path_)
+            if data is None:
+                raise FileNotFoundError(path_)
+            return data
+        count(rtt=1)
+        with self.sftp.open(path_) as f:
+            return f.read()
+
     def disconnect(self):
+        self.auto_reconnect = False
+        if self.agent:
+            self.agent.close()
+            self.agent = None
         self.sftp.close()
-        self.ssh.close()
+        if not self.sftp.local:
+            self.ssh.close()
         self._update_status()
 
+    def _manifest_walk(self, path_, manifest):
+        # r_walk's output from a single manifest query
+        tree = {".": ([], [])}
+        for _e in sorted(manifest, key=lambda l: l["path"]):
+            parent, name = posixpath.split(_e["path"])
+            if S_ISDIR(_e["mode"]):
+                tree[_e["path"]] = ([], [])
+            tree.setdefault(parent or ".", ([], []))[0 if S_ISDIR(_e["mode"]) else 1].append(name)
+
+        def _walk(rel, p_):
+            folders, files = tree[rel]
+            yield p_, folders, files
+            for folder in folders:
+                new_path = os.path.join(p_, folder)
+                self.path.add(new_path)
+                yield from _walk(folder if rel == "." else posixpath.join(rel, folder), new_path)
+        return _walk(".", path_)
+
     def r_walk(self, path_):
+        if (res := self.ask({"op": "manifest", "path": self.path(path_)})) and not isinstance(res[0], OSError):
+            yield from self._manifest_walk(path_, res[0])
+            return
         files = []
         folders = []
-        for f in self.sftp.listdir_attr(path_):
+        count(rtt=1)
+        for f in self.sftp.listdir_attr(self.path(path_)):
             if S_ISDIR(f.st_mode):
                 folders.append(f.filename)
             else:
                 files.append(f.filename)
         yield path_, folders, files
         for folder in folders:
-            new_path = path_.join(path_, folder)
+            new_path = os.path.join(path_, folder)
+            self.path.add(new_path)
             for _i in self.r_walk(new_path):
                 yield _i
 
@@ -180,10 +434,12 @@ class Sync:
         if remote is None:
             remote = local
 
+        count(rtt=1, bytes=os.path.getsize(local))
+        self.forget(remote)
         if callback:
-            self.sftp.put(local, remote, callback=callback)
+            self.sftp.put(local, self.path(remote), callback=callback)
         else:
-            self.sftp.put(local, remote)
+            self.sftp.put(local, self.path(remote))
         return [remote]
 
     def download(self, remote, local=None, callback=None):
@@ -193,9 +449,10 @@ class Sync:
             local = remote
 
         if callback:
-            self.sftp.get(local, remote, callback=callback)
+            self.sftp.get(self.path(remote), local, callback=callback)
         else:
-            self.sftp.get(local, remote)
+            self.sftp.get(self.path(remote), local)
+        count(rtt=1, bytes=os.path.getsize(local))
         return [local]
 
     def download_a(self, remote, local=None):
@@ -204,30 +461,27 @@ class Sync:
         if local is None:
             local = remote
         for _p, _d, _f in self.r_walk(remote):
-            if not os.path.exists(_p):
-                created += self.prepare_path(_p)
-            else:
-                if not os.path.isdir(_p):
-                    raise FileExistsError(f"{_p} exists locally")
+            _l = os.path.normpath(os.path.join(local, os.path.relpath(_p, remote)))
+            if not os.path.exists(_l):
+                os.makedirs(_l)
+                created.append(_l)
+            elif not os.path.isdir(_l):
+                raise FileExistsError(f"{_l} exists locally")
             for _ff in _f:
-                if _ff not in os.listdir(_p):
-                    created += self.download(os.path.join(_p, _ff), os.path.join(_p.replace(remote, local), _ff))
-            for _dd in _d:
-                if not os.path.exists(os.path.join(_p, _dd)):
-                    os.mkdir(os.path.join(_p, _dd))
-                    created.append(os.path.join(_p, _dd))
-                else:
-                    if not os.path.isdir(os.path.join(_p, _dd)):
-                        raise FileExistsError(f"{os.path.join(_p, _dd)} exists locally")
+                if not os.path.exists(os.path.join(_l, _ff)):
+                    created += self.download(os.path.join(_p, _ff), os.path.join(_l, _ff))
         return created
 
     def r_checksum(self, path_):
-        if os.path.basename(path_) not in self.sftp.listdir(os.path.dirname(path_)):
+        if (res := self.ask({"op": "hash", "path": self.path(path_)})) and not isinstance(res[0], OSError):
+            return res[0]
+        if not self.exists(path_):
             raise FileNotFoundError(f"Can't find {path_} on remote")
         _s = sha256()
-        with self.sftp.open(path_) as _f:
+        with self.sftp.open(self.path(path_)) as _f:
             while True:
                 _b = _f.read(1024)
+                count(rtt=1, bytes=len(_b))
                 if _b == b"":
                     break
                 _s.update(_b)
@@ -244,13 +498,25 @@ class Sync:
         return self.r_checksum(l_path if not r_path else r_path) == _s.hexdigest()
 
     def exists(self, path):
-        try:
-            if path[-1] == "/":
-                path = path[:-1]
-            return os.path.basename(path) in self.sftp.listdir(
-                os.path.dirname(path.replace("~", f"/home/{self.conf.get('user')}")))
-        except FileNotFoundError:
-            return False
+        if self.path.known(path):
+            return True
+        if path in self._prefetched:
+            return self._prefetched[path] is not None
+        if res := self.ask({"op": "stat", "path": self.path(path).rstrip("/") or "/"}):
+            if isinstance(res[0], FileNotFoundError):
+                return False
+            elif isinstance(res[0], OSError):
+                raise res[0]
+            mode = res[0]["mode"]
+        else:
+            count(rtt=1)
+            try:
+                mode = self.sftp.lstat(self.path(path).rstrip("/") or "/").st_mode
+            except FileNotFoundError:
+                return False
+        if S_ISDIR(mode):
+            self.path.add(path)
+        return True
 
 
 class RConfigs(Configs):
@@ -267,7 +533,7 @@ class RConfigs(Configs):
         elif load_from == REMOTE:
             if self.ex_rem:
                 try:
-                    d = json.load(self.sync.sftp.open(config_path))
+                    d = json.loads(self.sync.read(config_path))
                     Configs.__init__(self, template, data=d, config_path=config_path,
                                      raise_for_update_time=raise_for_update_time)
                 except json.decoder.JSONDecodeError:
@@ -294,6 +560,8 @@ class RConfigs(Configs):
                     break
 
     def write_remote(self):
+        count(rtt=1)
+        self.sync.forget(self.config_path)
         with self.sync.sftp.open(self.config_path, "w+") as r:
             Configs.write(self, r)
 
@@ -314,56 +582,115 @@ class RConfigs(Configs):
         return self.get("__update_time__") > other.get("__update_time__")
 
 
-class Job:
-    def __init__(self, files, tot_bytes, actual_job=None, actual_job_args=(), msg_clb=None):
-        self.files = files
-        self.tot_bytes = tot_bytes
-        self.speed = "N/A"
-        self.eta = "N/A"
-        self.speed = "N/A"
-        self.running = False
-        self.done = False
-        self.count = 0
-        self.bytes = 0
-        self.progress_ = 0
-        self.display = True
-        self.proc = None
-        if actual_job is not None and not isinstance(actual_job, Callable):
-            raise TypeError(actual_job)
-        self.actual_job = actual_job
-        self.actual_job_args = actual_job_args
-
-    def run(self, msg_clb):
-        if self.actual_job:
-            self.actual_job(*self.actual_job_args, msg_clb=(msg_clb if msg_clb else lambda l: None))
-        self.progress_ = 1
-
-    def standalone_run(self, msg_clb=None):
-        self.proc = Thread(target=self.run, args=(msg_clb, ) if msg_clb else (lambda l: None, ))
-        self.proc.start()
-
-    def is_alive(self):
-        return self.proc is not None and self.proc.poll() is None
-
-    def progress(self):
-        return self.progress_
-
-
 class Rsync:
-    PULL = 0
-    PUSH = 1
+    PULL = PULL
+    PUSH = PUSH
+
+    PARTIAL_DIR = ".rsync-partial"
+    # gen_job results: nothing to transfer, the dry run exited cleanly; canceled by on_scan; failed for another
+    # reason than a missing root, the network included
+    UP_TO_DATE = 0
+    CANCELED = -3
+    FAILED = -4
+    # seconds between two on_scan calls while the dry run goes
+    SCAN_TICK = .2
+    # rsync exit codes caused by the network or the remote shell, worth a retry once the link is back
+    NETWORK_ERRORS = (10, 12, 30, 35, 255)
+
+    class PlanFailure:
+        """
+        An error reported by rsync during a dry run, like
+        rsync: [sender] change_dir "/path" failed: No such file or directory (2)
+        """
+        LINE = re.compile(r'^rsync: (?:\[(\w+)\] )?(.+?) "(.*)" failed: (.*) \((\d+)\)$')
+        # the last line of a failed run tells the side when the error itself didn't
+        SUMMARY = re.compile(r'^rsync error: .*\[(\w+)=[^\]]*\]$')
+
+        def __init__(self, side, op, path_, reason, errno_):
+            self.side = side
+            self.op = op
+            self.path = path_
+            self.reason = reason
+            self.errno = errno_
+
+        @classmethod
+        def parse(cls, line):
+            m = cls.LINE.match(line)
+            if m is None:
+                return None
+            return cls(m.group(1).lower() if m.group(1) else None, m.group(2), m.group(3), m.group(4),
+                       int(m.group(5)))
+
+        def missing(self):
+            return self.errno == errno.ENOENT
+
+        def code(self):
+            if not self.missing():
+                return Rsync.FAILED
+            return -1 if self.side == "sender" else -2
+
+        def __str__(self):
+            return f"[{self.side or 'unknown'}] {self.op} {self.path}: {self.reason}"
 
     class Transfer(Job):
-        def __init__(self, cmd, files, t, tot_bytes):
-            super().__init__(files, tot_bytes)
+        def __init__(self, cmd, files, t, tot_bytes, sync: Sync = None, retries=3):
+            super().__init__(files, tot_bytes, sync=sync, retries=retries)
             self.cmd = cmd
             self.proc = None
             self.count = -1
             self.type = t
             self.speed = "0B/s"
+            self._bwlimit = 0
+            self._restart = False
+            # bytes sent and received by rsync, as opposed to the bytes of the files
+            self.wire_bytes = 0
+            self.elapsed = 0
+            self.on_finish = None
 
         def run(self, msg_clb=None):
-            self.proc = Popen(self.cmd, stdout=PIPE, stderr=STDOUT, bufsize=1000)
+            with span("Transfer.run", type=self.type, files=len(self.files)) as _span:
+                attempt = restarts = 0
+                start = monotonic()
+                # the partial dir keeps what was already transferred, so rerunning the same command resumes it
+                while True:
+                    code = self._run_once()
+                    if self._restart:
+                        self._restart = False
+                        restarts += 1
+                    elif code in Rsync.NETWORK_ERRORS and self.wait_retry(attempt):
+                        attempt += 1
+                    else:
+                        break
+                    self.count = -1
+                self.elapsed = monotonic() - start
+                _span.add(attempts=attempt + 1, restarts=restarts, bytes=self.bytes, wire_bytes=self.wire_bytes)
+
+                if code != 0:
+                    self.failed = True
+                    msg_clb(title="Rsync Error", msg=f"Rsync exited with code {code}.")
+                elif self.on_finish and not (attempt or restarts):
+                    # a resumed transfer doesn't tell how fast the link is
+                    self.on_finish(self)
+                self.bytes = self.tot_bytes
+                self.speed = "0B/s"
+                self.eta = "Finished"
+                self.progress_ = 1
+                self.count = len(self.files)
+
+        def throttle(self):
+            if self.qos is None or self.proc is None or self.proc.poll() is not None:
+                return
+            if self.qos.bwlimit() != self._bwlimit:
+                # rsync can't change its limit on the fly, restart it: the partial dir keeps what was transferred
+                self._restart = True
+                self.proc.terminate()
+            else:
+                self.qos.apply(self.proc.pid)
+
+        def _run_once(self):
+            self._bwlimit = self.qos.bwlimit() if self.qos else 0
+            self.proc = Popen(self.qos.wrap(self.cmd) if self.qos else self.cmd, stdout=PIPE, stderr=STDOUT,
+                              bufsize=1000)
             sleep(2)
 
             def split_read(proc):
@@ -408,16 +735,16 @@ class Rsync:
                     self.progress_ = float(perc.replace("%", "")) / 100.0
                     self.speed = speed
                     self.eta = eta
+                    self.changed()
+                elif line.startswith("sent ") and " received " in line:
+                    # "sent 1,234 bytes  received 56 bytes  ...", printed by -v at the end
+                    _w = line.replace(",", "").split()
+                    self.wire_bytes = int(_w[1]) + int(_w[4])
                 elif line.strip() in self.files:
                     self.count += 1
+                    self.changed()
 
-            if self.proc.poll() != 0:
-                msg_clb(title="Rsync Error", msg=f"Rsync exited with code {self.proc.poll()}.")
-            self.bytes = self.tot_bytes
-            self.speed = "0B/s"
-            self.eta = "Finished"
-            self.progress_ = 1
-            self.count = len(self.files)
+            return self.proc.wait()
 
         def progress(self):
             if self.tot_bytes == 0:
@@ -444,83 +771,159 @@ class Rsync:
         for i in s_exclude:
             self.switches.replace(i, "")
         self.proc = None
+        # error of the last dry run
+        self.failure = None
+        self._compress_list = None
+
+    @staticmethod
+    def _parse_compress_list(version):
+        for ln_ in version.splitlines():
+            if ln_.strip().startswith("Compress list:"):
+                return ln_.split(":", 1)[1].split()
+        # before 3.2 rsync only had zlib, and no way to choose it
+        return []
+
+    def compress_list(self):
+        """
+        Returns the compression algorithms supported by both the local and the remote rsync, asked once.
+        """
+        if self._compress_list is None:
+            try:
+                local = self._parse_compress_list(run(["rsync", "--version"], stdout=PIPE, stderr=DEVNULL).stdout
+                                                  .decode())
+                remote = self._parse_compress_list(self.sync.sftp.exec_command("rsync --version")[1])
+                count(rtt=1)
+                self._compress_list = [_c for _c in local if _c in remote]
+            except Exception:
+                self._compress_list = []
+        return self._compress_list
 
     def command_gen(self, dry=False):
-        return ["rsync", f"-{self.switches}" + ("n" if dry else ""), "-e", f"ssh -p {self.sync.conf.get('port')}"] + \
-               ([] if not dry else ["--stats"])
+        # partial files are kept aside until complete, so that an interrupted transfer resumes on the next run,
+        # even after a restart, instead of leaving a truncated file newer than its source (skipped by -u)
+        return ["rsync", f"-{self.switches}" + ("n" if dry else "")] + self.sync.sftp.rsync_shell() + \
+               [f"--partial-dir={self.PARTIAL_DIR}"] + ([] if not dry else ["--stats"])
 
     def gen_remote(self, path):
-        path = path.replace("~", f"/home/{self.sync.conf.get('user')}")
+        path = self.sync.path(path).rstrip("/")
         if self.sync.exists(path):
-            attr = self.sync.sftp.lstat(path)
-            if S_ISDIR(attr.st_mode) and path[-1] != "/":
-                path += "/"
-            else:
+            # exists() caches directories, a path it doesn't know as such is a file
+            if not self.sync.path.known(path):
                 # TODO: handle this
                 raise FileExistsError
-        return f"{self.sync.conf.get('user')}@{self.sync.conf.get('host')}:{path}"
+            path += "/"
+        return self.sync.sftp.rsync_target(path)
 
-    def gen_job(self, local, remote, uniq, operation=0):
+    def _stream(self, proc):
+        """
+        Yields the lines of proc's output as they come, and None after every SCAN_TICK seconds of silence.
         """
-        Returns a pair of integers, for pull and push status:
+        fd = proc.stdout.fileno()
+        buff = b""
+        while True:
+            rd, _, _ = select([fd], [], [], self.SCAN_TICK)
+            if not rd:
+                yield None
+                continue
+            chunk = os.read(fd, 64 * 1024)
+            if not chunk:
+                break
+            *lines, buff = (buff + chunk).split(b"\n")
+            for ln_ in lines:
+                yield ln_.decode(errors="replace")
+        if buff:
+            yield buff.decode(errors="replace")
+
+    def gen_job(self, local, remote, uniq, operation=0, compression: Compression = None, on_scan=None):
+        """
+        Returns the transfer of uniq, or an integer when there's nothing to transfer:
          0: OK
         -1: Error on sender
         -2: Error on receiver
+        -3: Canceled, by on_scan
+        -4: Any other failure of the dry run
+        The error reported by rsync, if any, is left in self.failure.
 
         :param local:
         :param remote:
         :param uniq:
         :param operation:
+        :param compression:
+        :param on_scan: called with the files and bytes found so far while the dry run goes, returns True to cancel
         :return:
         """
-        local = os.path.expanduser(local)
-        remote = self.gen_remote(os.path.join(remote, uniq))
-
-        def cmd(l_):
-            if operation == Rsync.PULL:
-                return self.command_gen(dry=l_) + [remote, local]
-            elif operation == Rsync.PUSH:
-                return self.command_gen(dry=l_) + [local, remote]
-
-        proc = Popen(cmd(True), stdout=PIPE, stderr=STDOUT, stdin=DEVNULL)
-        output = proc.communicate()[0].decode()
-        ret = 0
-        if proc.poll():
-            for li in output.split("\n"):
-                if "failed" in li:
-                    if "[Receiver]" in li:
-                        target = "receiver"
-                    elif "[sender]" in li:
-                        target = "sender"
-                    else:
-                        target = "unknown"
-                    if "No such file or directory" in output:
-                        ret = -1 if target == "sender" else -2
-            return ret
-        else:
-            files = []
-
-            start = False
-            it = output.split("\n")
-            for ln_ in it:
-                if start:
-                    if "created directory" in ln_:
-                        continue
-                    if ln_ == "":
-                        break
-                    files.append(ln_)
+        with span("Rsync.gen_job", uniq=uniq, operation=operation) as _span:
+            local = os.path.expanduser(local)
+            remote = self.gen_remote(os.path.join(remote, uniq))
+            self.failure = None
+
+            def cmd(l_):
+                if operation == Rsync.PULL:
+                    return self.command_gen(dry=l_) + [remote, local]
+                elif operation == Rsync.PUSH:
+                    return self.command_gen(dry=l_) + [local, remote]
+
+            # sizes in the listing, for a live total
+            proc = Popen(cmd(True) + ["--out-format=%l %n%L"], stdout=PIPE, stderr=STDOUT, stdin=DEVNULL)
+            files = FileSet()
+            # kept only by the Transfer returned, a spilled plan mustn't leave its temporary file open otherwise
+            planned = None
+            try:
+                scanned = tot_bytes = 0
+                listing = listed = False
+                side = None
+                last = monotonic()
+                for ln_ in self._stream(proc):
+                    if ln_ is None:
+                        pass
+                    elif (f := self.PlanFailure.parse(ln_)) or ln_.startswith("rsync error: "):
+                        # errors come through stderr, mixed with the listing
+                        if f and not self.failure:
+                            self.failure = f
+                        elif m := self.PlanFailure.SUMMARY.match(ln_):
+                            side = m.group(1).lower()
+                    elif listing:
+                        size, _, name = ln_.partition(" ")
+                        if ln_ == "":
+                            listing, listed = False, True
+                        elif size.isdigit():
+                            # anything else, like "created directory", is a message
+                            files.add(name)
+                            if not name.endswith("/"):
+                                scanned += int(size)
+                    elif not listed and ln_.endswith(" incremental file list"):
+                        listing = True
+                    elif ln_.startswith("Total transferred file size: "):
+                        tot_bytes = int(ln_.split(": ")[-1].split(" bytes")[0].replace(",", ""))
+                    if on_scan and (ln_ is None or monotonic() - last > self.SCAN_TICK):
+                        last = monotonic()
+                        if on_scan(len(files), scanned):
+                            proc.terminate()
+                            proc.wait()
+                            _span.add(files=len(files))
+                            _span.set(canceled=True)
+                            return self.CANCELED
+                if proc.wait():
+                    if self.failure and self.failure.side is None:
+                        self.failure.side = side
+                    _span.set(error=str(self.failure) if self.failure else proc.returncode)
+                    return self.failure.code() if self.failure else self.FAILED
                 else:
-                    if " incremental file list" in ln_:
-                        start = True
-
-            tot_bytes = 0
-            for ln_ in it:
-                if "Total transferred file size:" in ln_:
-                    tot_bytes = int(
-                        ln_.split("Total transferred file size: ")[-1].split(" bytes")[0].replace(",", "")
-                    )
-
-            if files:
-                return Rsync.Transfer(cmd(False), files, {0: "Pull", 1: "Push"}[operation], tot_bytes)
-            else:
-                return ret
+                    _span.add(files=len(files), bytes=tot_bytes)
+                    if files:
+                        cmd_ = cmd(False)
+                        mode = None
+                        if compression:
+                            mode = compression.choose(uniq, local, files, self.sync.rtt)
+                            cmd_[1:1] = compression.args(mode)
+                            _span.set(compression=mode)
+                        t = Rsync.Transfer(cmd_, files, {0: "Pull", 1: "Push"}[operation], tot_bytes, self.sync)
+                        if compression:
+                            t.on_finish = lambda l: compression.record(uniq, mode, l)
+                        planned = t
+                        return t
+                    else:
+                        return self.UP_TO_DATE
+            finally:
+                if planned is None:
+                    files.close()
@@ -0,0 +1,106 @@
+"""
+Constants, exceptions and jobs of the sync stack that don't need paramiko, so that importing them doesn't pay for
+it. Sync, RConfigs and Rsync live in sync.py and are imported only when a connection is actually needed.
+"""
+from threading import Thread
+from typing import Callable
+
+LOCAL = 0
+REMOTE = 1
+
+# authentication modes
+PWD = 0
+PKEY = 1
+
+# rsync directions
+PULL = 0
+PUSH = 1
+
+
+class AuthError(Exception):
+    pass
+
+
+class NoHostSet(Exception):
+    pass
+
+
+class ConnectionError(Exception):
+    pass
+
+
+ERRORS = (AuthError, NoHostSet, ConnectionError)
+
+
+def link_errors():
+    # exceptions raised by a dropped link, paramiko is surely loaded by the time a job fails
+    from paramiko import ssh_exception
+    return OSError, EOFError, ssh_exception.SSHException
+
+
+class Job:
+    # seconds a failed job waits for the link to come back before giving up
+    RETRY_TIMEOUT = 60
+
+    def __init__(self, files, tot_bytes, actual_job=None, actual_job_args=(), msg_clb=None, sync=None, retries=0):
+        self.files = files
+        self.tot_bytes = tot_bytes
+        self.speed = "N/A"
+        self.eta = "N/A"
+        self.speed = "N/A"
+        self.running = False
+        self.done = False
+        self.count = 0
+        self.bytes = 0
+        self.progress_ = 0
+        self.display = True
+        self.proc = None
+        if actual_job is not None and not isinstance(actual_job, Callable):
+            raise TypeError(actual_job)
+        self.actual_job = actual_job
+        self.actual_job_args = actual_job_args
+        self.sync = sync
+        self.retries = retries
+        # set by the JobRunner, called when progress moves
+        self.on_change = None
+        # transfer policy, set by the JobRunner
+        self.qos = None
+        # key of the job in the JobJournal, if it's recorded there
+        self.journal_key = None
+        # set by jobs that report their errors instead of raising them
+        self.failed = False
+
+    def changed(self):
+        if self.on_change:
+            self.on_change()
+
+    def throttle(self):
+        # called when the transfer policy changes while the job runs
+        pass
+
+    def wait_retry(self, attempt):
+        return attempt < self.retries and self.sync is not None and self.sync.wait_connected(self.RETRY_TIMEOUT)
+
+    def run(self, msg_clb):
+        if self.actual_job:
+            attempt = 0
+            while True:
+                try:
+                    self.actual_job(*self.actual_job_args, msg_clb=(msg_clb if msg_clb else lambda l: None))
+                    break
+                except Exception as e:
+                    # jobs must be idempotent: after a dropped link they are simply run again
+                    if not isinstance(e, link_errors()) or not self.wait_retry(attempt):
+                        raise
+                    attempt += 1
+        self.progress_ = 1
+
+    def standalone_run(self, msg_clb=None):
+        self.proc = Thread(target=self.run, args=(msg_clb, ) if msg_clb else (lambda l: None, ))
+        self.proc.start()
+
+    def is_alive(self):
+        return self.proc is not None and self.proc.poll() is None
+
+    def progress(self):
+        return self.progress_
@@ -1,10 +1,18 @@
-from sync import Sync
+from sync_base import PWD
 
 bugl_defaults = {
     "stdout": "~/.log/bugl/%i/out.log",
     "stderr": "~/.log/bugl/%i/err.log",
     "games_folder": "~/.config/bugl/games/",
-    "ignore_missing_host": False
+    "ignore_missing_host": False,
+    "library_store": "json",
+    "wine_prefix": "",
+    "wine_prewarm": True,
+    "wineserver_linger": 300,
+    "prewarm_budget": 512,
+    "snapshot_keep": 5,
+    "archive_after_days": 0,
+    "archive_mode": "pack"
 }
 
 game_defaults = {
@@ -16,7 +24,9 @@ game_defaults = {
     "exec_args": [],
     "latest_launch": -1.0,
     "playtime": 0.0,
-    "data": {}
+    "data": {},
+    "compression": {},
+    "launch_times": {}
 }
 
 game_shared = (
@@ -25,11 +35,19 @@ game_shared = (
 )
 
 sync_defaults = {
+    "backend": "sftp",
     "user": "",
     "host": "",
     "port": 22,
     "private_key_path": "",
-    "mode": Sync.PWD,
+    "mode": PWD,
     "remote_path": "~/.config/bugl/",
-    "remote_data_path": "~/data/bugl/data/"
+    "remote_data_path": "~/data/bugl/data/",
+    "keepalive": 15,
+    "bwlimit": 0,
+    "bwlimit_gaming": 1024,
+    "pause_while_gaming": True,
+    "nice": 10,
+    "remote_agent": False,
+    "replicas": []
 }
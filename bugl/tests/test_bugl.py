@@ -0,0 +1,138 @@
+"""
+Run from the bugl folder: python -m unittest discover tests
+"""
+import os
+import shutil
+import unittest
+from tempfile import mkdtemp
+from unittest import mock
+from bugl import Bugl, Game
+from merge import MergeBase
+from events import EventLoop
+from fileset import FileSet
+from library import LibraryWatcher
+from sessions import SessionStore
+from sww import SafeWinWrapper
+
+
+class FakeConf:
+    # the part of Configs and RConfigs that sync_conf uses
+    def __init__(self, config_path, **data):
+        self.config_path = config_path
+        self.template = {}
+        self.data = data
+
+    def get(self, key, path=False):
+        return self.data[key]
+
+    def set(self, key, value):
+        self.data[key] = value
+
+    def keys(self):
+        return list(self.data)
+
+    def read(self):
+        pass
+
+    def write(self):
+        pass
+
+    def newer(self, other):
+        return self.get("__update_time__") > other.get("__update_time__")
+
+
+class SyncConfTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp = mkdtemp()
+        self.bugl = Bugl.__new__(Bugl)
+        self.bugl.bases = MergeBase(os.path.join(self.tmp, "base/"))
+        self.bugl.replicas = None
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def test_newer_local_merges_remote_playtime(self):
+        self.bugl.bases.save("games/g.json", {"name": "g", "playtime": 100.0})
+        local = FakeConf("games/g.json", name="g", playtime=150.0, __update_time__=20, __to_sync__=True)
+        remote = FakeConf("games/g.json", name="g", playtime=130.0, __update_time__=10, __to_sync__=False)
+        with mock.patch("sync.RConfigs.from_conf", return_value=remote), \
+                mock.patch.object(Bugl, "mirror_confs") as mirror:
+            self.bugl.sync_conf(local, sync=object())
+        mirrored = mirror.call_args[0][0]
+        self.assertEqual(mirrored.get("playtime"), 180.0)
+        self.assertTrue(mirror.call_args[1]["pushed"])
+
+
+class ReloadLibraryTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp = mkdtemp()
+        self._r, self._w = os.pipe()
+        self.bugl = Bugl.__new__(Bugl)
+        self.bugl._games = []
+        self.bugl._selected = None
+        self.bugl._reload_pending = set()
+        self.bugl.loop = EventLoop(self._r)
+        self.bugl.watcher = LibraryWatcher(self.tmp)
+
+    def tearDown(self):
+        self.bugl.loop.close()
+        os.close(self._r)
+        os.close(self._w)
+        shutil.rmtree(self.tmp)
+
+    def test_reload_twice_on_event_loop(self):
+        # registered once, as gui does
+        if self.bugl.watcher.fileno() is not None:
+            self.bugl.loop.add_reader(self.bugl.watcher.fileno(), "library")
+        self.assertEqual(self.bugl.reload_library(), {})
+        self.assertEqual(self.bugl.reload_library(), {})
+
+
+class FileSetTest(unittest.TestCase):
+    def test_hash_collision_keeps_both_paths(self):
+        with mock.patch.object(FileSet, "_hash", staticmethod(lambda l: 42)):
+            files = FileSet(["a/b.sav", "a/c.sav", "a/b.sav"])
+            self.assertEqual(len(files), 2)
+            self.assertEqual(list(files), ["a/b.sav", "a/c.sav"])
+            files.close()
+
+
+class FakeWin:
+    def __init__(self, lines=40, cols=80):
+        self.size = (lines, cols)
+        self.lines = {}
+
+    def getmaxyx(self):
+        return self.size
+
+    def addstr(self, y, x, text, attr=0):
+        self.lines[y] = text
+
+
+class RenderDetailsTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp = mkdtemp()
+        self.bugl = Bugl.__new__(Bugl)
+        self.bugl._sessions = SessionStore(os.path.join(self.tmp, "sessions/"))
+        self.bugl._trace_overlay = False
+        self.bugl.conf = FakeConf("config.json")
+        g = Game.__new__(Game)
+        g.conf = Game.GameConfig(FakeConf("games/g.json", id="g", name="g", exec="wine", exec_path="g.exe",
+                                          latest_launch=-1, playtime=3600.0, data={}), self.bugl.conf)
+        g.bugl = self.bugl
+        g._proc = None
+        self.bugl._selected = g
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def test_render_with_sessions(self):
+        self.bugl.sessions.record("g", 1700000000.0, 1800.0)
+        win = FakeWin()
+        self.bugl.render_details(SafeWinWrapper(win))
+        self.assertIn("Sessions:", win.lines.values())
+        self.assertIn("1", win.lines.values())
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,165 @@
+"""
+Lightweight spans for the sync, rsync and launch paths.
+
+    with span("sync_conf", path=conf.config_path) as s:
+        ...
+        s.add(bytes=n)
+        s.set(mode="pull")
+
+When tracing is disabled span() returns a shared no-op object, so instrumented code pays a global lookup and a
+function call. When enabled every finished span is appended to a rotating trace file as one Chrome trace event
+("ph": "X") per line; wrap the lines in [ ] to open them in chrome://tracing or Perfetto.
+"""
+import os
+import json
+from collections import deque, defaultdict
+from contextlib import contextmanager
+from threading import local, Lock, get_ident
+from time import perf_counter, time
+
+ENABLED = False
+
+_writer = None
+_stack = local()
+# finished spans kept for the in-UI overlay
+recent = deque(maxlen=100)
+
+
+class Span:
+    __slots__ = ("name", "attrs", "start", "duration")
+
+    def __init__(self, name, attrs):
+        self.name = name
+        self.attrs = attrs
+        self.start = 0.0
+        self.duration = None
+
+    def add(self, **counters):
+        for k, v in counters.items():
+            self.attrs[k] = self.attrs.get(k, 0) + v
+
+    def set(self, **attrs):
+        # for what isn't a counter: names, modes, errors
+        self.attrs.update(attrs)
+
+    def __enter__(self):
+        if not hasattr(_stack, "spans"):
+            _stack.spans = []
+        _stack.spans.append(self)
+        self.start = perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.duration = perf_counter() - self.start
+        _stack.spans.pop()
+        if exc_type is not None:
+            self.attrs["error"] = exc_type.__name__
+        recent.append(self)
+        if _writer:
+            _writer.emit(self)
+        return False
+
+
+class NullSpan:
+    def add(self, **counters):
+        pass
+
+    def set(self, **attrs):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+
+NULL = NullSpan()
+
+
+def span(name, **attrs):
+    if not ENABLED:
+        return NULL
+    return Span(name, attrs)
+
+
+def count(**counters):
+    # adds to the innermost open span of the calling thread, e.g. count(rtt=1) for a remote round trip
+    if ENABLED and getattr(_stack, "spans", None):
+        _stack.spans[-1].add(**counters)
+
+
+def slowest(n=5):
+    return sorted(list(recent), key=lambda l: l.duration, reverse=True)[:n]
+
+
+class PhaseTimer:
+    def __init__(self):
+        self.totals = defaultdict(float)
+        self.counts = defaultdict(int)
+
+    @contextmanager
+    def __call__(self, name):
+        start = perf_counter()
+        try:
+            yield
+        finally:
+            self.totals[name] += perf_counter() - start
+            self.counts[name] += 1
+
+
+class RotatingWriter:
+    def __init__(self, path_, max_bytes=4 * 1024 * 1024, backups=3):
+        self.path = os.path.expanduser(path_)
+        self.max_bytes = max_bytes
+        self.backups = backups
+        self._lock = Lock()
+        # perf_counter has no epoch, anchor it to wall time once
+        self._offset = time() - perf_counter()
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        self._f = open(self.path, "a")
+
+    def _rotate(self):
+        self._f.close()
+        for n in range(self.backups - 1, 0, -1):
+            if os.path.exists(f"{self.path}.{n}"):
+                os.replace(f"{self.path}.{n}", f"{self.path}.{n + 1}")
+        if self.backups:
+            os.replace(self.path, f"{self.path}.1")
+        else:
+            os.remove(self.path)
+        self._f = open(self.path, "a")
+
+    def emit(self, s: Span):
+        ev = {
+            "name": s.name,
+            "ph": "X",
+            "ts": int((s.start + self._offset) * 1e6),
+            "dur": int(s.duration * 1e6),
+            "pid": os.getpid(),
+            "tid": get_ident(),
+            "args": s.attrs
+        }
+        with self._lock:
+            self._f.write(json.dumps(ev, default=str) + "\n")
+            self._f.flush()
+            if self._f.tell() > self.max_bytes:
+                self._rotate()
+
+    def close(self):
+        self._f.close()
+
+
+def enable(path_="~/.log/bugl/trace.jsonl", max_bytes=4 * 1024 * 1024, backups=3):
+    global ENABLED, _writer
+    if path_:
+        _writer = RotatingWriter(path_, max_bytes, backups)
+    ENABLED = True
+
+
+def disable():
+    global ENABLED, _writer
+    ENABLED = False
+    if _writer:
+        _writer.close()
+        _writer = None
@@ -0,0 +1,140 @@
+import os
+import shutil
+import socket
+from subprocess import Popen, DEVNULL
+from threading import Thread
+from time import monotonic, sleep, time
+
+
+class WinePrewarmer:
+    """
+    Starts a persistent wineserver for the prefix of the selected wine game, so that launching it doesn't wait for
+    the server and the prefix to come up. The server exits by itself "wineserver_linger" seconds after its last
+    client, and every launch in between shares it.
+    """
+    def __init__(self, conf):
+        self.conf = conf
+        # prefix -> wineserver process started by us
+        self.servers = {}
+
+    @staticmethod
+    def is_wine(g):
+        return os.path.basename(g.conf.get("exec") or "").startswith("wine")
+
+    @staticmethod
+    def prefix(g):
+        try:
+            prefix = g.conf.get("wine_prefix", path=True)
+        except KeyError:
+            prefix = ""
+        return prefix or os.environ.get("WINEPREFIX") or os.path.expanduser("~/.wine")
+
+    def env(self, g):
+        # the game must run in the prefix the server was started for
+        if not self.is_wine(g):
+            return None
+        return {**os.environ, "WINEPREFIX": self.prefix(g)}
+
+    def wineserver(self, g):
+        # next to the wine binary of the game if it isn't the one in PATH
+        wine = shutil.which(g.conf.get("exec")) or g.conf.get("exec")
+        local = os.path.join(os.path.dirname(wine), "wineserver")
+        return local if os.path.isfile(local) else shutil.which("wineserver")
+
+    def warm(self, g):
+        if not self.conf.get("wine_prewarm") or not self.is_wine(g):
+            return False
+        prefix = self.prefix(g)
+        if prefix in self.servers and self.servers[prefix].poll() is None:
+            return True
+        server = self.wineserver(g)
+        if server is None or not os.path.isdir(prefix):
+            return False
+        # -p: persistent, exits linger seconds after the last client; a second server on the same prefix quits
+        self.servers[prefix] = Popen([server, "-p", str(self.conf.get("wineserver_linger"))],
+                                     env={**os.environ, "WINEPREFIX": prefix},
+                                     stdin=DEVNULL, stdout=DEVNULL, stderr=DEVNULL, start_new_session=True)
+        return True
+
+    def warm_for(self, g):
+        return self.is_wine(g) and self.prefix(g) in self.servers and self.servers[self.prefix(g)].poll() is None
+
+
+class LaunchTimer(Thread):
+    """
+    Measures launch to process ready: the moment a process of the game's tree runs its executable, for wine games
+    that's after the server answered and the prefix was loaded. The result is added to the game's "launch_times", by host.
+    """
+    INTERVAL = .02
+    TIMEOUT = 120
+
+    def __init__(self, g, start, warm):
+        super().__init__(daemon=True)
+        self.g = g
+        self.start_ = start
+        self.warm = warm
+        self.target_ = os.path.basename(g.conf.get("exec_path")).lower()
+
+    def _tree(self, pid):
+        # the game process and its descendants, from /proc
+        children = {}
+        for _p in os.listdir("/proc"):
+            if not _p.isdigit():
+                continue
+            try:
+                with open(f"/proc/{_p}/stat") as f:
+                    ppid = int(f.read().rsplit(")", 1)[1].split()[1])
+            except (OSError, IndexError, ValueError):
+                continue
+            children.setdefault(ppid, []).append(int(_p))
+        out, todo = [], [pid]
+        while todo:
+            _p = todo.pop()
+            out.append(_p)
+            todo += children.get(_p, [])
+        return out
+
+    def _ready(self, pid):
+        for _p in self._tree(pid):
+            try:
+                with open(f"/proc/{_p}/cmdline", "rb") as f:
+                    args = f.read().decode(errors="replace").lower().split("\0")
+            except OSError:
+                continue
+            if _p == pid:
+                # wine execs the game's image in the launched process, whose command line then starts with the exe
+                # instead of "wine game.exe"
+                if self.target_ in os.path.basename(args[0].replace("\\", "/")):
+                    return True
+            elif self.target_ in " ".join(args):
+                return True
+        return False
+
+    def run(self):
+        proc = self.g._proc
+        wine = WinePrewarmer.is_wine(self.g)
+        # native games are ready as soon as they are exec'd
+        while wine and proc.poll() is None and monotonic() - self.start_ < self.TIMEOUT:
+            if self._ready(proc.pid):
+                break
+            sleep(self.INTERVAL)
+        else:
+            if wine:
+                return
+        # the game config belongs to the ui thread, the measurement is saved from there
+        self.g.bugl._jobs.defer(self.record, monotonic() - self.start_)
+
+    def record(self, latency):
+        # per host, the prefix and the disk differ from a machine to another
+        try:
+            times = dict(self.g.conf.get("launch_times"))
+        except KeyError:
+            times = {}
+        rec = dict(times.get(socket.gethostname(), {}))
+        key = "warm" if self.warm else "cold"
+        count_, mean = rec.get(key, (0, 0.0))
+        rec[key] = (count_ + 1, mean + (latency - mean) / (count_ + 1))
+        rec["last"] = latency
+        rec["time"] = time()
+        times[socket.gethostname()] = rec
+        self.g.conf.set("launch_times", times)